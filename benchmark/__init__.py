@@ -0,0 +1,2 @@
+from .swarm import FakeTracker, FakeSeeder, SeederConfig, SyntheticTorrent, make_torrent
+from .swarm_bench import SwarmBenchmark
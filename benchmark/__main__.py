@@ -0,0 +1,125 @@
+import json
+import asyncio
+import argparse
+import tempfile
+
+from .swarm import SeederConfig
+from .swarm_bench import SwarmBenchmark
+
+
+async def main(args: argparse.Namespace) -> list:
+    config = SeederConfig(
+        latency=args.latency / 1000,
+        bandwidth=int(args.bandwidth * 1024 * 1024),
+        choke_every=args.choke_every,
+        choke_for=args.choke_for,
+        corrupt_rate=args.corrupt_rate
+    )
+
+    with tempfile.TemporaryDirectory(prefix='pybt-bench-') as directory:
+        bench = SwarmBenchmark(
+            directory,
+            length=args.size * 1024 * 1024,
+            piece_length=args.piece_length * 1024,
+            seeders=args.seeders,
+            config=config,
+            session_args=dict(port=args.port, hash_workers=args.hash_workers),
+            torrent_args=dict(max_peers=args.max_peer, storage=args.storage),
+            seed=args.seed
+        )
+        await bench.start()
+        try:
+            results = []
+            for n in range(args.runs):
+                result = await bench.run(timeout=args.timeout, quiet=not args.verbose)
+                print(_report(n, result))
+                results.append(result)
+        finally:
+            await bench.close()
+
+    return results
+
+
+def _report(n: int, result: dict) -> str:
+    def secs(value):
+        return '-' if value is None else f'{value:.3f}s'
+
+    if not result['complete']:
+        return f'run {n}: timed out after {result["seconds"]:.1f}s'
+
+    return (
+        f'run {n}: {result["mb_per_s"]:.1f} MB/s, '
+        f'{result["cpu_s_per_gb"]:.2f} CPU s/GB, '
+        f'first piece {secs(result["time_to_first_piece_s"])}, '
+        f'endgame {secs(result["endgame_s"])}, '
+        f'peak RSS {result["peak_rss_mb"]:.0f} MiB, '
+        f'{result["corrupt_blocks"]} corrupt blocks, '
+        f'{result["wasted_bytes"]} bytes wasted'
+    )
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+                        prog = 'python -m benchmark',
+                        description ='Download a synthetic torrent from fake seeders on loopback and report the throughput'
+    )
+
+    parser.add_argument('--size', type = int, default=64,
+                            help='MiB of the synthetic torrent (default: %(default)s)')
+    parser.add_argument('--piece-length', type = int, default=256,
+                            help='KiB of each piece (default: %(default)s)')
+    parser.add_argument('--seeders', type = int, default=8,
+                            help='Number of fake seeders (default: %(default)s)')
+    parser.add_argument('--latency', type = float, default=0,
+                            help='Milliseconds seeders take to answer a request (default: %(default)s)')
+    parser.add_argument('--bandwidth', type = float, default=0,
+                            help='MiB/s each seeder uploads at, 0 is unlimited (default: %(default)s)')
+    parser.add_argument('--choke-every', type = float, default=0,
+                            help='Seconds between seeder chokes, 0 never chokes (default: %(default)s)')
+    parser.add_argument('--choke-for', type = float, default=1,
+                            help='Seconds a seeder choke lasts (default: %(default)s)')
+    parser.add_argument('--corrupt-rate', type = float, default=0,
+                            help='Probability a block is sent corrupted (default: %(default)s)')
+
+    parser.add_argument('--storage', choices=['file', 'mmap'], default='file',
+                            help='Storage backend of the client (default: %(default)s)')
+    parser.add_argument('--max-peer', type = int, default=30,
+                            help='Max number of peers of the client (default: %(default)s)')
+    parser.add_argument('--hash-workers', type = int, default=2,
+                            help='Number of threads verifying piece hashes (default: %(default)s)')
+    parser.add_argument('--port', type = int, default=6881,
+                            help='Port the client announces, nothing listens on it (default: %(default)s)')
+
+    parser.add_argument('--runs', type = int, default=1,
+                            help='Number of downloads of the same torrent (default: %(default)s)')
+    parser.add_argument('--timeout', type = float, default=300,
+                            help='Seconds before a download is given up (default: %(default)s)')
+    parser.add_argument('--seed', type = int, default=0,
+                            help='Seed of the synthetic data and of the seeders (default: %(default)s)')
+    parser.add_argument('--json', metavar='PATH',
+                            help='Write the results of every run to a JSON file')
+    parser.add_argument('--min-mbps', type = float, default=None,
+                            help='Exit with an error if any run is slower than this many MB/s')
+    parser.add_argument('--verbose', action='store_true',
+                            help='Show the client output')
+
+    args = parser.parse_args()
+    if args.size < 1 or args.piece_length < 16 or args.seeders < 1 or args.runs < 1:
+        print("Invalid arguments")
+        exit(1)
+
+    if not 0 <= args.corrupt_rate < 1:
+        print("Invalid corrupt rate")
+        exit(1)
+
+    results = asyncio.run(main(args))
+
+    if args.json:
+        with open(args.json, 'w') as fp:
+            json.dump({'args': vars(args), 'runs': results}, fp, indent=2)
+
+    if not all(result['complete'] for result in results):
+        exit(1)
+    if args.min_mbps is not None and min(r['mb_per_s'] for r in results) < args.min_mbps:
+        print(f'Slower than {args.min_mbps} MB/s')
+        exit(1)
@@ -0,0 +1,494 @@
+from typing import Any, Callable, Dict, List, Tuple
+
+import os
+import json
+import time
+import timeit
+import asyncio
+import argparse
+import platform
+import tempfile
+import contextlib
+
+from types import SimpleNamespace
+from hashlib import sha1
+from statistics import median
+
+import bencode
+
+from bitarray.util import ones
+
+from protocol import Handshake, Have, Request, PieceMessage
+from torrent import InfoDict
+from tracker.compact import compact_peers, peer_from_compact
+from tracker.http_tracker.http_tracker_response import HTTPTrackerResponse
+from torrent_manager import TorrentManager, TorrentStatus, PieceVerifier
+from torrent_manager.piece_download import PieceDownload
+from torrent_manager.torrent_manager import PieceState
+from peer.peer import PeerConnection, PeerMessageStreamIter
+from peer.peer_protocol import PeerWireProtocol
+from file_manager.disk_writer import DiskWriter, FsyncPolicy
+from file_manager.single_file_manager import SingleFileManager
+
+
+BLOCK_SIZE = PieceDownload.BLOCK_SIZE
+PIECE_LENGTH = 256 * 1024
+
+# a benchmark returns the seconds per operation of every round
+Bench = Callable[[int], List[float]]
+
+# name -> (benchmark, bytes per operation or None)
+BENCHMARKS: Dict[str, Tuple[Bench, int | None]] = {}
+
+
+def benchmark(name: str, nbytes: int | None = None):
+    def register(fn: Bench) -> Bench:
+        BENCHMARKS[name] = (fn, nbytes)
+        return fn
+
+    return register
+
+
+def _repeat(fn: Callable[[], Any], rounds: int, number: int) -> List[float]:
+    timer = timeit.Timer(fn)
+    return [timer.timeit(number) / number for _ in range(rounds)]
+
+
+#--------------------****------------------#
+#                 Protocol                 #
+#--------------------****------------------#
+@benchmark('protocol.handshake_encode')
+def bench_handshake_encode(rounds: int) -> List[float]:
+    info_hash = sha1(b'pybt').digest()
+    return _repeat(lambda: Handshake('-ZZ0001-000000000000', info_hash), rounds, 100_000)
+
+
+@benchmark('protocol.handshake_decode')
+def bench_handshake_decode(rounds: int) -> List[float]:
+    handshake = Handshake('-ZZ0001-000000000000', sha1(b'pybt').digest())
+    return _repeat(lambda: Handshake.decode(handshake), rounds, 100_000)
+
+
+@benchmark('protocol.request_encode')
+def bench_request_encode(rounds: int) -> List[float]:
+    return _repeat(lambda: Request(1234, 5 * BLOCK_SIZE, BLOCK_SIZE), rounds, 100_000)
+
+
+@benchmark('protocol.request_decode')
+def bench_request_decode(rounds: int) -> List[float]:
+    payload = memoryview(Request(1234, 5 * BLOCK_SIZE, BLOCK_SIZE))[5:]
+    return _repeat(lambda: Request.decode(payload), rounds, 100_000)
+
+
+@benchmark('protocol.piece_decode', BLOCK_SIZE)
+def bench_piece_decode(rounds: int) -> List[float]:
+    msg = PieceMessage.header(1234, 5 * BLOCK_SIZE, BLOCK_SIZE) + bytes(BLOCK_SIZE)
+    payload = memoryview(msg)[5:]
+    return _repeat(lambda: PieceMessage.decode(payload), rounds, 100_000)
+
+
+#--------------------****------------------#
+#                 Framing                  #
+#--------------------****------------------#
+class _MemoryTransport:
+    """ Just enough of a transport for PeerWireProtocol to be fed from memory """
+    def get_extra_info(self, name, default=None):
+        return ('127.0.0.1', 6881) if name == 'peername' else default
+
+    def is_closing(self) -> bool:
+        return False
+
+    def pause_reading(self):
+        pass
+
+    def resume_reading(self):
+        pass
+
+    def write(self, data):
+        pass
+
+    def abort(self):
+        pass
+
+    def close(self):
+        pass
+
+
+def _peer_stream(blocks: int) -> Tuple[bytes, int]:
+    """ What a seeder sends, a HAVE and a REQUEST along every PIECE """
+    messages = []
+    for n in range(blocks):
+        index, offset = divmod(n * BLOCK_SIZE, PIECE_LENGTH)
+        messages.append(Have(index))
+        messages.append(Request(index, offset, BLOCK_SIZE))
+        messages.append(PieceMessage.header(index, offset, BLOCK_SIZE) + bytes(BLOCK_SIZE))
+
+    return b''.join(messages), 3 * blocks
+
+
+async def _read_stream(stream: bytes, count: int, sink: bool, chunk: int = 64 * 1024) -> float:
+    """ Seconds it takes to feed stream to a PeerWireProtocol in chunk sized
+    reads and get its count messages out of a PeerMessageStreamIter
+    """
+    piece = bytearray(PIECE_LENGTH)
+    view = memoryview(piece)
+    ctx = SimpleNamespace(
+        ip='127.0.0.1',
+        port=6881,
+        block_buffer=(lambda index, offset, length: view[offset: offset + length]) if sink else (lambda *_: None)
+    )
+
+    protocol = PeerWireProtocol()
+    protocol.connection_made(_MemoryTransport())
+    conn = PeerConnection(ctx)
+    conn.attach(protocol)
+    messages = PeerMessageStreamIter(conn)
+
+    handshake = Handshake('-ZZ0001-000000000000', sha1(b'pybt').digest())
+    data = memoryview(handshake + stream)
+
+    started = time.perf_counter()
+    received, pos = 0, 0
+    while received < count:
+        # one socket read
+        if pos < len(data):
+            buf = protocol.get_buffer(chunk)
+            n = min(len(buf), chunk, len(data) - pos)
+            buf[:n] = data[pos: pos + n]
+            pos += n
+            protocol.buffer_updated(n)
+
+        # and whatever it completed
+        while protocol._messages and received < count:
+            await messages.__anext__()
+            received += 1
+
+    elapsed = time.perf_counter() - started
+    protocol._timeout_handle.cancel()
+    return elapsed
+
+
+def _bench_framing(rounds: int, sink: bool) -> List[float]:
+    stream, count = _peer_stream(1024)
+
+    async def run() -> List[float]:
+        return [await _read_stream(stream, count, sink) / count for _ in range(rounds)]
+
+    return asyncio.run(run())
+
+
+@benchmark('framing.stream_iter')
+def bench_framing(rounds: int) -> List[float]:
+    return _bench_framing(rounds, sink=False)
+
+
+@benchmark('framing.stream_iter_block_sink')
+def bench_framing_sink(rounds: int) -> List[float]:
+    return _bench_framing(rounds, sink=True)
+
+
+#--------------------****------------------#
+#              Torrent manager             #
+#--------------------****------------------#
+class _NullFileManager:
+    """ Storage that drops everything, for the torrent manager alone to be timed """
+    def write_piece(self, index: int, piece: bytes) -> None:
+        pass
+
+    def piece_buffer(self, index: int) -> memoryview | None:
+        return None
+
+
+def _torrent_manager(total_pieces: int) -> TorrentManager:
+    meta_info = InfoDict(**{
+        'name': b'micro.bin',
+        'length': total_pieces * PIECE_LENGTH,
+        'piece length': PIECE_LENGTH,
+        'pieces': bytes(20 * total_pieces),
+    })
+    manager = TorrentManager(meta_info, _NullFileManager(), TorrentStatus(meta_info), PieceVerifier(workers=1))
+    # a few seeders, every piece equally available
+    for _ in range(3):
+        manager.peer_bitfield(ones(total_pieces))
+
+    return manager
+
+
+def _bench_get_pieces(rounds: int, total_pieces: int) -> List[float]:
+    manager = _torrent_manager(total_pieces)
+    bitfield = ones(total_pieces)
+    number = min(total_pieces, 1000)
+
+    times = []
+    for _ in range(rounds):
+        started = time.perf_counter()
+        picked = [manager.get_pieces(bitfield) for _ in range(number)]
+        times.append((time.perf_counter() - started) / number)
+
+        for idx in picked:
+            manager.put_pieces(idx)
+
+    return times
+
+
+def _bench_save_piece(rounds: int, total_pieces: int) -> List[float]:
+    manager = _torrent_manager(total_pieces)
+    bitfield = ones(total_pieces)
+    number = min(total_pieces, 1000)
+    piece = bytes(PIECE_LENGTH)
+
+    times = []
+    # it prints every piece, to nowhere here
+    with open(os.devnull, 'w') as out, contextlib.redirect_stdout(out):
+        for _ in range(rounds):
+            picked = [manager.get_pieces(bitfield) for _ in range(number)]
+
+            started = time.perf_counter()
+            for idx in picked:
+                manager.save_piece(idx, piece)
+            times.append((time.perf_counter() - started) / number)
+
+            # saved pieces can't be put back
+            for idx in picked:
+                manager._set_state(idx, PieceState.MISSING)
+
+    return times
+
+
+for _pieces in (1_000, 10_000, 100_000, 1_000_000):
+    benchmark(f'torrent_manager.get_pieces[{_pieces}]')(
+        lambda rounds, n=_pieces: _bench_get_pieces(rounds, n)
+    )
+    benchmark(f'torrent_manager.save_piece[{_pieces}]')(
+        lambda rounds, n=_pieces: _bench_save_piece(rounds, n)
+    )
+
+
+#--------------------****------------------#
+#                 Tracker                  #
+#--------------------****------------------#
+# compact peer lists are split by tracker/compact.py and each peer is only
+# decoded when it is dialed
+def _tracker_response(peers: int) -> bytes:
+    compact = b''.join(
+        bytes([10, n >> 16 & 0xff, n >> 8 & 0xff, n & 0xff]) + (6881 + n).to_bytes(2, 'big')
+        for n in range(peers)
+    )
+    return bencode.dumps({'interval': 1800, 'complete': peers, 'incomplete': 0, 'peers': compact})
+
+
+@benchmark('tracker.compact_peers[200]')
+def bench_compact_peers(rounds: int) -> List[float]:
+    raw = HTTPTrackerResponse(**bencode.loads(_tracker_response(200)))['peers']
+    return _repeat(lambda: compact_peers(raw), rounds, 10_000)
+
+
+@benchmark('tracker.peer_from_compact[200]')
+def bench_peer_from_compact(rounds: int) -> List[float]:
+    peers = compact_peers(HTTPTrackerResponse(**bencode.loads(_tracker_response(200)))['peers'])
+    return _repeat(lambda: [peer_from_compact(peer) for peer in peers], rounds, 1_000)
+
+
+@benchmark('tracker.response[200]')
+def bench_tracker_response(rounds: int) -> List[float]:
+    raw = _tracker_response(200)
+
+    def decode():
+        response = HTTPTrackerResponse(**bencode.loads(raw))
+        return compact_peers(response['peers'])
+
+    return _repeat(decode, rounds, 1_000)
+
+
+#--------------------****------------------#
+#                 Storage                  #
+#--------------------****------------------#
+STORAGE_PIECES = 64 # 16 MiB file
+
+
+def _bench_storage(rounds: int, run: Callable[[SingleFileManager, DiskWriter], Any]) -> List[float]:
+    with tempfile.TemporaryDirectory(prefix='pybt-micro-') as directory:
+        meta_info = InfoDict(**{
+            'name': os.path.join(directory, 'micro.bin').encode(),
+            'length': STORAGE_PIECES * PIECE_LENGTH,
+            'piece length': PIECE_LENGTH,
+            'pieces': bytes(20 * STORAGE_PIECES),
+        })
+
+        async def main() -> List[float]:
+            writer = DiskWriter(fsync=FsyncPolicy.NEVER)
+            manager = SingleFileManager(meta_info, writer)
+            try:
+                return [await run(manager, writer) for _ in range(rounds)]
+            finally:
+                manager.end()
+                writer.close()
+
+        return asyncio.run(main())
+
+
+@benchmark('storage.write_piece', PIECE_LENGTH)
+def bench_write_piece(rounds: int) -> List[float]:
+    """ Event loop side of a write, queueing it for the writer thread """
+    pieces = [os.urandom(PIECE_LENGTH) for _ in range(STORAGE_PIECES)]
+
+    async def run(manager: SingleFileManager, writer: DiskWriter) -> float:
+        started = time.perf_counter()
+        for idx, piece in enumerate(pieces):
+            manager.write_piece(idx, piece)
+        elapsed = time.perf_counter() - started
+
+        await writer.flush()
+        return elapsed / STORAGE_PIECES
+
+    return _bench_storage(rounds, run)
+
+
+@benchmark('storage.write_piece_flushed', PIECE_LENGTH)
+def bench_write_piece_flushed(rounds: int) -> List[float]:
+    """ Writes until they reach the page cache """
+    pieces = [os.urandom(PIECE_LENGTH) for _ in range(STORAGE_PIECES)]
+
+    async def run(manager: SingleFileManager, writer: DiskWriter) -> float:
+        started = time.perf_counter()
+        for idx, piece in enumerate(pieces):
+            manager.write_piece(idx, piece)
+        await writer.flush()
+
+        return (time.perf_counter() - started) / STORAGE_PIECES
+
+    return _bench_storage(rounds, run)
+
+
+@benchmark('storage.read_piece_sequential', PIECE_LENGTH)
+def bench_read_piece_sequential(rounds: int) -> List[float]:
+    """ Every piece in order from an empty read cache, so with readahead """
+    async def run(manager: SingleFileManager, writer: DiskWriter) -> float:
+        for idx in range(STORAGE_PIECES):
+            manager.write_piece(idx, bytes(PIECE_LENGTH))
+        await writer.flush()
+        manager.cache.clear()
+
+        started = time.perf_counter()
+        for idx in range(STORAGE_PIECES):
+            manager.read_piece(idx)
+
+        return (time.perf_counter() - started) / STORAGE_PIECES
+
+    return _bench_storage(rounds, run)
+
+
+@benchmark('storage.read_piece_cached', PIECE_LENGTH)
+def bench_read_piece_cached(rounds: int) -> List[float]:
+    async def run(manager: SingleFileManager, writer: DiskWriter) -> float:
+        for idx in range(4):
+            manager.write_piece(idx, bytes(PIECE_LENGTH))
+        await writer.flush()
+        for idx in range(4):
+            manager.read_piece(idx)
+
+        return timeit.Timer(lambda: manager.read_piece(2)).timeit(100_000) / 100_000
+
+    return _bench_storage(rounds, run)
+
+
+#--------------------****------------------#
+#                  Runner                  #
+#--------------------****------------------#
+def run(names: List[str], rounds: int) -> Dict[str, Dict[str, Any]]:
+    results = {}
+    for name in names:
+        bench, nbytes = BENCHMARKS[name]
+        times = bench(rounds)
+        result = {
+            'min_ns': min(times) * 1e9,
+            'median_ns': median(times) * 1e9,
+            'rounds': rounds,
+        }
+        if nbytes is not None:
+            result['mb_per_s'] = nbytes / median(times) / 1e6
+        results[name] = result
+
+        print(_report(name, result), flush=True)
+
+    return results
+
+
+def compare(results: Dict[str, Dict[str, Any]], baseline: Dict[str, Dict[str, Any]]):
+    """ Print how the medians changed, below 1.00x is faster """
+    print('\ncompared to baseline (median, new / old):')
+    for name, result in results.items():
+        old = baseline.get(name)
+        if old is None:
+            continue
+
+        print(f'{name:<45} {result["median_ns"] / old["median_ns"]:6.2f}x')
+
+
+def _report(name: str, result: Dict[str, Any]) -> str:
+    line = f'{name:<45} {result["min_ns"]:>14,.0f} ns  {result["median_ns"]:>14,.0f} ns'
+    if 'mb_per_s' in result:
+        line += f'  {result["mb_per_s"]:>10,.0f} MB/s'
+
+    return line
+
+
+def main():
+    parser = argparse.ArgumentParser(
+                        prog = 'python -m benchmark.micro',
+                        description ='Microbenchmarks of the protocol codec, piece picker, tracker responses and storage'
+    )
+    parser.add_argument('--filter', action='append', default=[],
+                            help='Only run benchmarks whose name contains this, can be repeated')
+    parser.add_argument('--rounds', type = int, default=5,
+                            help='Rounds every benchmark is timed over (default: %(default)s)')
+    parser.add_argument('--quick', action='store_true',
+                            help='Skip the 1M piece benchmarks and time 3 rounds')
+    parser.add_argument('--json', metavar='PATH',
+                            help='Write the results to a JSON file')
+    parser.add_argument('--compare', metavar='PATH',
+                            help='JSON file of a previous run to compare against')
+    parser.add_argument('--list', action='store_true',
+                            help='List the benchmarks and exit')
+
+    args = parser.parse_args()
+
+    names = [
+        name for name in BENCHMARKS
+        if not args.filter or any(f in name for f in args.filter)
+    ]
+    if args.quick:
+        names = [name for name in names if '[1000000]' not in name]
+        args.rounds = min(args.rounds, 3)
+
+    if args.list:
+        print('\n'.join(names))
+        return
+
+    if args.rounds < 1:
+        print("Invalid number of rounds")
+        exit(1)
+
+    baseline = None
+    if args.compare:
+        with open(args.compare) as fp:
+            baseline = json.load(fp)['results']
+
+    print(f'{"benchmark":<45} {"min":>17}  {"median":>17}')
+    results = run(names, args.rounds)
+
+    if baseline is not None:
+        compare(results, baseline)
+
+    if args.json:
+        with open(args.json, 'w') as fp:
+            json.dump({
+                'python': platform.python_version(),
+                'machine': platform.machine(),
+                'time': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+                'results': results,
+            }, fp, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,319 @@
+from typing import List, Set, Tuple
+
+import os
+import socket
+import struct
+import random
+import asyncio
+import bencode
+import bitarray
+
+from aiohttp import web
+from hashlib import sha1
+from dataclasses import dataclass
+
+from protocol import MessageOP, FormatStrings
+from protocol import (
+    Handshake,
+    Choke,
+    Unchoke,
+    Bitfield,
+    PieceMessage,
+)
+
+
+HANDSHAKE_SIZE = struct.calcsize(FormatStrings.HANDSHAKE)
+
+
+@dataclass
+class SeederConfig:
+    """ How the fake seeders behave """
+    latency: float = 0.0 # seconds before a request is answered
+    bandwidth: int = 0 # bytes per second each seeder uploads, 0 is unlimited
+    choke_every: float = 0.0 # seconds between chokes, 0 never chokes
+    choke_for: float = 1.0 # seconds a choke lasts
+    corrupt_rate: float = 0.0 # probability a block is sent corrupted
+
+
+@dataclass
+class SyntheticTorrent:
+    """ A single file torrent made up of random data """
+    path: str # .torrent file
+    data_path: str # the data seeders upload
+    info_hash: bytes
+    length: int
+    piece_length: int
+
+
+def make_torrent(
+    directory: str,
+    announce: str,
+    length: int,
+    piece_length: int,
+    name: str = 'bench.bin',
+    seed: int = 0
+) -> SyntheticTorrent:
+    """ Write random data and its .torrent to directory, the data goes to a
+    seed subdirectory so it can't be mistaken for the download
+    """
+    os.makedirs(os.path.join(directory, 'seed'), exist_ok=True)
+    data_path = os.path.join(directory, 'seed', name)
+
+    rng = random.Random(seed)
+    hashes = []
+    with open(data_path, 'wb') as fp:
+        for offset in range(0, length, piece_length):
+            piece = rng.randbytes(min(piece_length, length - offset))
+            hashes.append(sha1(piece).digest())
+            fp.write(piece)
+
+    info = {
+        'name': name.encode(),
+        'length': length,
+        'piece length': piece_length,
+        'pieces': b''.join(hashes),
+    }
+    path = os.path.join(directory, name + '.torrent')
+    with open(path, 'wb') as fp:
+        fp.write(bencode.dumps({'announce': announce.encode(), 'info': info}))
+
+    return SyntheticTorrent(
+        path=path,
+        data_path=data_path,
+        info_hash=sha1(bencode.dumps(info)).digest(),
+        length=length,
+        piece_length=piece_length
+    )
+
+
+class FakeTracker:
+    """ HTTP tracker on loopback that gives every announce the same peers """
+    def __init__(self, interval: int = 1800):
+        self.interval = interval
+        self.announces = 0
+        self._peers: List[Tuple[str, int]] = []
+        self._runner: web.AppRunner | None = None
+        self._port = 0
+
+
+    @property
+    def announce_url(self) -> str:
+        return f'http://127.0.0.1:{self._port}/announce'
+
+
+    def add_peer(self, addr: Tuple[str, int]):
+        self._peers.append(addr)
+
+
+    async def start(self):
+        app = web.Application()
+        app.router.add_get('/announce', self._announce)
+
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        sock.bind(('127.0.0.1', 0))
+        self._port = sock.getsockname()[1]
+
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        await web.SockSite(self._runner, sock).start()
+
+
+    async def close(self):
+        if self._runner is not None:
+            await self._runner.cleanup()
+
+
+    async def _announce(self, request: web.Request) -> web.Response:
+        self.announces += 1
+        peers = b''.join(
+            socket.inet_aton(ip) + port.to_bytes(2, 'big') for ip, port in self._peers
+        )
+        return web.Response(body=bencode.dumps({
+            'interval': self.interval,
+            'complete': len(self._peers),
+            'incomplete': 1,
+            'peers': peers,
+        }))
+
+
+class FakeSeeder:
+    """ Peer on loopback that has every piece of a torrent and uploads it
+    following a SeederConfig
+    """
+    def __init__(self, torrent: SyntheticTorrent, config: SeederConfig, seed: int = 0):
+        self.torrent = torrent
+        self.config = config
+        self.uploaded = 0
+        self.corrupted = 0
+
+        self._id = f'-FS0001-{seed:012d}'
+        self._rng = random.Random(seed)
+        self._fd = os.open(torrent.data_path, os.O_RDONLY)
+        self._server: asyncio.Server | None = None
+        self._conns: Set[asyncio.Task] = set()
+
+        total_pieces = -(-torrent.length // torrent.piece_length)
+        self._bitfield = bitarray.bitarray(total_pieces)
+        self._bitfield.setall(1)
+
+
+    async def start(self) -> Tuple[str, int]:
+        """ Start listening, returns the address to reach the seeder at """
+        self._server = await asyncio.start_server(self._serve, '127.0.0.1', 0)
+        return self._server.sockets[0].getsockname()[:2]
+
+
+    async def close(self):
+        if self._server is not None:
+            self._server.close()
+        for task in self._conns:
+            task.cancel()
+        await asyncio.gather(*self._conns, return_exceptions=True)
+        os.close(self._fd)
+
+
+    async def _serve(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        task = asyncio.current_task()
+        self._conns.add(task)
+        try:
+            await _SeederConnection(self, reader, writer).run()
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            self._conns.discard(task)
+            writer.close()
+
+
+    def read_block(self, index: int, offset: int, length: int) -> bytes:
+        block = os.pread(self._fd, length, index * self.torrent.piece_length + offset)
+        if self.config.corrupt_rate and self._rng.random() < self.config.corrupt_rate:
+            self.corrupted += 1
+            block = bytes([block[0] ^ 0xff]) + block[1:]
+
+        return block
+
+
+class _SeederConnection:
+    """ A connection of a FakeSeeder
+
+    Requests are answered in order, each one no sooner than latency after it
+    arrived and no faster than the seeder bandwidth allows. Requests made
+    before a choke are dropped, like real peers do.
+    """
+    def __init__(self, seeder: FakeSeeder, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self._seeder = seeder
+        self._config = seeder.config
+        self._reader = reader
+        self._writer = writer
+
+        self._choking = True
+        self._choked_by_schedule = False # a periodic choke is going on
+        self._interested = False
+        self._choke_epoch = 0 # bumped on every choke
+        self._requests: asyncio.Queue = asyncio.Queue()
+        self._cancelled: Set[Tuple[int, int]] = set()
+        self._send_at = 0.0 # bandwidth limit, next block isn't sent before this
+
+
+    async def run(self):
+        handshake = await self._reader.readexactly(HANDSHAKE_SIZE)
+        info_hash, _ = Handshake.decode(handshake)
+        if info_hash != self._seeder.torrent.info_hash:
+            return
+
+        self._writer.write(Handshake(self._seeder._id, self._seeder.torrent.info_hash))
+        self._writer.write(Bitfield(self._seeder._bitfield))
+
+        tasks = [asyncio.create_task(self._send_blocks())]
+        if self._config.choke_every > 0:
+            tasks.append(asyncio.create_task(self._choke_periodically()))
+
+        try:
+            await self._read_messages()
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+
+    async def _read_messages(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            (length,) = struct.unpack('>I', await self._reader.readexactly(4))
+            if length == 0:
+                continue
+
+            msg = await self._reader.readexactly(length)
+            match msg[0]:
+                case MessageOP.INTERESTED:
+                    self._interested = True
+                    if self._choking and not self._choked_by_schedule:
+                        self._unchoke()
+                case MessageOP.NOT_INTERESTED:
+                    self._interested = False
+                case MessageOP.REQUEST:
+                    if self._choking:
+                        continue
+                    index, offset, size = struct.unpack_from('>III', msg, 1)
+                    self._cancelled.discard((index, offset))
+                    due = loop.time() + self._config.latency
+                    self._requests.put_nowait((due, self._choke_epoch, index, offset, size))
+                case MessageOP.CANCEL:
+                    index, offset, _ = struct.unpack_from('>III', msg, 1)
+                    self._cancelled.add((index, offset))
+                case _:
+                    pass
+
+
+    async def _send_blocks(self):
+        loop = asyncio.get_running_loop()
+        torrent = self._seeder.torrent
+        while True:
+            due, epoch, index, offset, size = await self._requests.get()
+            if epoch != self._choke_epoch:
+                continue
+            if (index, offset) in self._cancelled:
+                self._cancelled.discard((index, offset))
+                continue
+
+            piece_length = min(torrent.piece_length, torrent.length - index * torrent.piece_length)
+            if size <= 0 or offset + size > piece_length:
+                continue
+
+            now = loop.time()
+            send_at = due
+            if self._config.bandwidth:
+                send_at = max(send_at, self._send_at)
+                self._send_at = max(now, send_at) + size / self._config.bandwidth
+            if send_at > now:
+                await asyncio.sleep(send_at - now)
+                # choked or cancelled while waiting
+                if epoch != self._choke_epoch or (index, offset) in self._cancelled:
+                    self._cancelled.discard((index, offset))
+                    continue
+
+            block = self._seeder.read_block(index, offset, size)
+            self._writer.write(PieceMessage.header(index, offset, size))
+            self._writer.write(block)
+            self._seeder.uploaded += size
+            await self._writer.drain()
+
+
+    async def _choke_periodically(self):
+        while True:
+            await asyncio.sleep(self._config.choke_every)
+            self._choked_by_schedule = True
+            if not self._choking:
+                self._choking = True
+                self._choke_epoch += 1
+                self._writer.write(Choke())
+
+            await asyncio.sleep(self._config.choke_for)
+            self._choked_by_schedule = False
+            if self._interested:
+                self._unchoke()
+
+
+    def _unchoke(self):
+        self._choking = False
+        self._writer.write(Unchoke())
@@ -0,0 +1,146 @@
+from typing import Any, Dict, List
+
+import os
+import sys
+import time
+import asyncio
+import resource
+import tempfile
+import contextlib
+
+from session import Session
+
+from .swarm import (
+    FakeTracker,
+    FakeSeeder,
+    SeederConfig,
+    SyntheticTorrent,
+    make_torrent
+)
+
+
+class SwarmBenchmark:
+    """ Downloads a synthetic torrent from fake seeders on loopback with a
+    Session, the way main.py runs it, and measures how it went
+
+    Tracker and seeders run on the same event loop as the client so the
+    benchmark needs nothing but loopback. Their CPU time is counted in
+    cpu_s_per_gb too, it is a small constant per byte next to the client's.
+    """
+    PROBE_INTERVAL = 0.005
+
+    def __init__(
+        self,
+        directory: str,
+        length: int,
+        piece_length: int,
+        seeders: int,
+        config: SeederConfig,
+        session_args: Dict[str, Any] | None = None,
+        torrent_args: Dict[str, Any] | None = None,
+        seed: int = 0
+    ):
+        self.directory = directory
+        self.length = length
+        self.piece_length = piece_length
+        self.n_seeders = seeders
+        self.config = config
+        self.session_args = session_args or {}
+        self.torrent_args = torrent_args or {}
+        self.seed = seed
+
+        self._tracker = FakeTracker()
+        self._seeders: List[FakeSeeder] = []
+        self._torrent: SyntheticTorrent | None = None
+
+
+    async def start(self):
+        """ Start the tracker and the seeders of a new synthetic torrent """
+        await self._tracker.start()
+        self._torrent = make_torrent(
+            self.directory,
+            self._tracker.announce_url,
+            self.length,
+            self.piece_length,
+            seed=self.seed
+        )
+
+        for n in range(self.n_seeders):
+            seeder = FakeSeeder(self._torrent, self.config, seed=self.seed + n)
+            self._tracker.add_peer(await seeder.start())
+            self._seeders.append(seeder)
+
+
+    async def close(self):
+        for seeder in self._seeders:
+            await seeder.close()
+        await self._tracker.close()
+
+
+    async def run(self, timeout: float | None = None, quiet: bool = True) -> Dict[str, Any]:
+        """ Download the torrent once into a new directory and return the
+        measurements
+        """
+        download_dir = tempfile.mkdtemp(prefix='run-', dir=self.directory)
+        cwd = os.getcwd()
+        uploaded = sum(seeder.uploaded for seeder in self._seeders)
+        corrupted = sum(seeder.corrupted for seeder in self._seeders)
+
+        # the client prints every piece, it would be measured too
+        out = open(os.devnull, 'w') if quiet else sys.stdout
+        os.chdir(download_dir)
+        try:
+            with contextlib.redirect_stdout(out):
+                result = await self._download(timeout)
+        finally:
+            os.chdir(cwd)
+            if quiet:
+                out.close()
+
+        result['wasted_bytes'] = (
+            sum(seeder.uploaded for seeder in self._seeders) - uploaded - self.length
+        )
+        result['corrupt_blocks'] = sum(seeder.corrupted for seeder in self._seeders) - corrupted
+        return result
+
+
+    async def _download(self, timeout: float | None) -> Dict[str, Any]:
+        session = Session(**self.session_args)
+        torrent = session.add_torrent(self._torrent.path, **self.torrent_args)
+        manager = torrent.torrent_manager
+
+        first_piece: float | None = None
+        endgame: float | None = None
+
+        started = time.perf_counter()
+        cpu_started = time.process_time()
+
+        run = asyncio.create_task(session.run(listen=False))
+        while not run.done():
+            now = time.perf_counter()
+            if timeout is not None and now - started > timeout:
+                run.cancel()
+                break
+
+            if first_piece is None and manager.pieces.any():
+                first_piece = now - started
+            if endgame is None and not manager.seeding and manager.endgame:
+                endgame = now
+            await asyncio.wait({run}, timeout=self.PROBE_INTERVAL)
+
+        await asyncio.gather(run, return_exceptions=True)
+        elapsed = time.perf_counter() - started
+        cpu = time.process_time() - cpu_started
+        complete = manager.pieces.all()
+
+        return {
+            'complete': bool(complete),
+            'bytes': self.length,
+            'seconds': elapsed,
+            'mb_per_s': self.length / elapsed / 1e6 if complete else 0.0,
+            'cpu_s_per_gb': cpu / (self.length / 1e9),
+            'time_to_first_piece_s': first_piece,
+            'endgame_s': started + elapsed - endgame if endgame is not None else None,
+            # of the whole process so far, KiB on Linux
+            'peak_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        }
@@ -0,0 +1,3 @@
+from .connection_manager import ConnectionManager
+from .connection_limit import ConnectionLimit
+from .peer_db import PeerDB, PeerRecord, PeerFlag
@@ -0,0 +1,48 @@
+from __future__ import annotations
+
+from typing import Set
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from .connection_manager import ConnectionManager
+
+
+class ConnectionLimit:
+    """ Connections shared by the connection managers of every torrent
+
+    A slot is taken for every dial and every connected peer. When one is
+    given back the managers are woken up so whichever has room dials again.
+    """
+    def __init__(self, max_connections: int):
+        self.max_connections = max_connections
+        self.used = 0
+
+        self._managers: Set[ConnectionManager] = set()
+
+
+    @property
+    def free(self) -> int:
+        return max(0, self.max_connections - self.used)
+
+
+    def register(self, manager: ConnectionManager):
+        self._managers.add(manager)
+
+
+    def unregister(self, manager: ConnectionManager):
+        self._managers.discard(manager)
+
+
+    def take(self, n: int = 1) -> bool:
+        """ Take n slots, False (and none taken) if there aren't as many free """
+        if n > self.free:
+            return False
+
+        self.used += n
+        return True
+
+
+    def give_back(self, n: int = 1):
+        self.used = max(0, self.used - n)
+        for manager in self._managers:
+            manager.wake()
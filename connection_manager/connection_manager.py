@@ -0,0 +1,171 @@
+from typing import Dict, List, Set
+
+import time
+import asyncio
+
+from client import Client
+from torrent import TorrentFile
+from tracker import CompactPeer, peer_from_compact
+from torrent_manager import TorrentManager
+
+from peer import Peer, PeerConnectionError
+
+from .peer_db import PeerDB
+from .connection_limit import ConnectionLimit
+
+
+class ConnectionManager:
+    """ Dials peers from the peer database and hands connected ones to workers
+
+    No more than max_dials connection attempts are in flight and no more are
+    started than it takes to have max_peers connected, or than the limit
+    shared with other torrents allows. Connected peers are put on a queue
+    bounded to max_peers.
+    """
+    def __init__(
+        self,
+        torrent: TorrentFile,
+        client: Client,
+        torrent_manager: TorrentManager,
+        max_peers: int,
+        max_dials: int = 8,
+        limit: ConnectionLimit | None = None
+    ):
+        self.max_peers = max_peers
+        self.max_dials = max_dials
+        self.limit = limit or ConnectionLimit(max_peers)
+        self.limit.register(self)
+
+        self.peer_db = PeerDB()
+        self.active: Set[Peer] = set() # connected peers, incoming ones too
+        self._dialed: Dict[Peer, CompactPeer] = {} # peer database key of outgoing peers
+        self.connected: asyncio.Queue = asyncio.Queue(maxsize=max(1, max_peers))
+
+        self._torrent = torrent
+        self._client = client
+        self._torrent_manager = torrent_manager
+
+        self._dials: Set[asyncio.Task] = set()
+        self._wake = asyncio.Event()
+
+
+    def wake(self):
+        """ Look for peers to dial again """
+        self._wake.set()
+
+
+    def add_peers(self, peers: List[CompactPeer]):
+        """ Peers from the tracker """
+        self.peer_db.add(peers)
+        self._wake.set()
+
+
+    def add_incoming(self, peer: Peer) -> bool:
+        """ Queue a peer that connected to us, False if we are full """
+        if len(self.active) + len(self._dials) >= self.max_peers:
+            return False
+
+        if not self.limit.take():
+            return False
+
+        try:
+            self.connected.put_nowait(peer)
+        except asyncio.QueueFull:
+            self.limit.give_back()
+            return False
+
+        return True
+
+
+    def peer_started(self, peer: Peer):
+        self.active.add(peer)
+
+
+    def peer_done(self, peer: Peer):
+        """ A peer a worker was running went away """
+        self.active.discard(peer)
+        compact = self._dialed.pop(peer, None)
+        if compact is not None:
+            self.peer_db.disconnected(compact, peer.downloaded)
+        self.limit.give_back()
+
+
+    async def run(self):
+        """ Dial the best candidates whenever there is room for more peers """
+        try:
+            while not self._torrent_manager.end.is_set():
+                self._wake.clear()
+
+                room = min(
+                    self.max_peers - len(self.active) - self.connected.qsize() - len(self._dials),
+                    self.max_dials - len(self._dials),
+                    self.limit.free
+                )
+                candidates = self.peer_db.candidates(room)
+                self.limit.take(len(candidates))
+                for compact in candidates:
+                    task = asyncio.create_task(self._dial(compact))
+                    self._dials.add(task)
+                    task.add_done_callback(self._dial_done)
+
+                # until something changes or, if there is still room, a peer
+                # in backoff can be retried
+                timeout = None
+                retry_at = self.peer_db.next_retry()
+                if len(candidates) < room and retry_at is not None:
+                    timeout = max(retry_at - time.monotonic(), 0.1)
+
+                waiter = asyncio.create_task(self._wake.wait())
+                try:
+                    await asyncio.wait({waiter}, timeout=timeout)
+                finally:
+                    waiter.cancel()
+
+        finally:
+            self.limit.unregister(self)
+            for task in self._dials:
+                task.cancel()
+
+
+    async def close(self):
+        """ Drop the peers no worker took, once the workers are stopped """
+        while not self.connected.empty():
+            peer = self.connected.get_nowait()
+            await peer.end()
+            self.limit.give_back()
+
+
+    async def _dial(self, compact: CompactPeer):
+        peer = Peer(peer_from_compact(compact), self._torrent, self._client, self._torrent_manager)
+        started = time.monotonic()
+        try:
+            await peer.initialize()
+        except PeerConnectionError as e:
+            print(str(e))
+            self.peer_db.failed(compact)
+            self.limit.give_back()
+            await peer.end()
+            return
+        except asyncio.CancelledError:
+            self.limit.give_back()
+            await peer.end()
+            raise
+
+        self.peer_db.connected(compact, time.monotonic() - started)
+
+        # dials are only started for free slots, but an incoming connection
+        # may have taken ours. Never awaited, a cancel can't leave it half done
+        try:
+            self.connected.put_nowait(peer)
+        except asyncio.QueueFull:
+            self.peer_db.disconnected(compact, 0)
+            self.limit.give_back()
+            await peer.end()
+            return
+
+        self._dialed[peer] = compact
+
+
+    def _dial_done(self, task: asyncio.Task):
+        self._dials.discard(task)
+        self._wake.set()
@@ -0,0 +1,163 @@
+from typing import Dict, Iterable, List
+
+import time
+import random
+
+from dataclasses import dataclass
+
+from tracker import CompactPeer
+
+
+class PeerFlag:
+    DIALING = 1
+    CONNECTED = 2
+    IN_USE = DIALING | CONNECTED
+
+
+@dataclass(slots=True)
+class PeerRecord:
+    """ What we know about a peer the tracker gave us """
+    last_seen: float # last time a tracker gave it to us
+    flags: int = 0 # PeerFlag
+    failures: int = 0 # consecutive failed dials
+    retry_at: float = 0.0 # not dialed again before this
+    rtt: float | None = None # connect + handshake time, smoothed
+    downloaded: int = 0 # bytes it sent us over all connections
+    connected_time: float = 0.0 # seconds connected over all connections
+    connected_at: float | None = None
+
+    @property
+    def rate(self) -> float:
+        """ Average bytes per second it delivered while connected """
+        if self.connected_time <= 0:
+            return 0.0
+
+        return self.downloaded / self.connected_time
+
+
+class PeerDB:
+    """ Peers known for a torrent and their history
+
+    Peers are keyed on the compact form trackers send them in, so the peers
+    of an announce are merged without decoding any of them.
+
+    A peer that can't be dialed is retried after an exponential backoff
+    instead of being dropped, transient errors are common. Dial candidates
+    are ranked by the throughput they delivered before, then by handshake
+    RTT, peers never dialed sit in the middle with DEFAULT_RTT.
+    """
+    BACKOFF_BASE = 30
+    MAX_BACKOFF = 3600
+    # a peer that left is dialed again after this, it may just be busy
+    RECONNECT_DELAY = 60
+    # peers no tracker gave us for this long and that keep failing are forgotten
+    FORGET_AFTER = 6 * 3600
+    DEFAULT_RTT = 0.5
+    RTT_WEIGHT = 0.3
+
+    def __init__(self):
+        self._peers: Dict[CompactPeer, PeerRecord] = {}
+
+
+    def __len__(self) -> int:
+        return len(self._peers)
+
+
+    def __contains__(self, peer: CompactPeer) -> bool:
+        return peer in self._peers
+
+
+    def get(self, peer: CompactPeer) -> PeerRecord | None:
+        return self._peers.get(peer)
+
+
+    def add(self, peers: Iterable[CompactPeer]):
+        """ Peers from a tracker response """
+        now = time.monotonic()
+        for peer in peers:
+            record = self._peers.get(peer)
+            if record is None:
+                self._peers[peer] = PeerRecord(last_seen=now)
+            else:
+                record.last_seen = now
+
+
+    def candidates(self, n: int) -> List[CompactPeer]:
+        """ Up to n of the best peers that can be dialed now, they are marked
+        in use until failed or disconnected is called
+        """
+        if n <= 0:
+            return []
+
+        now = time.monotonic()
+        ready = [
+            (peer, record) for peer, record in self._peers.items()
+            if not record.flags & PeerFlag.IN_USE and record.retry_at <= now
+        ]
+        ready.sort(key=lambda item: self._rank(item[1]))
+
+        picked = []
+        for peer, record in ready[:n]:
+            record.flags |= PeerFlag.DIALING
+            picked.append(peer)
+
+        return picked
+
+
+    def next_retry(self) -> float | None:
+        """ time.monotonic() at which a peer in backoff can be dialed again """
+        waiting = [r.retry_at for r in self._peers.values() if not r.flags & PeerFlag.IN_USE]
+        return min(waiting) if waiting else None
+
+
+    def connected(self, peer: CompactPeer, rtt: float):
+        record = self._peers.get(peer)
+        if record is None:
+            return
+
+        record.flags = PeerFlag.CONNECTED
+        record.failures = 0
+        record.connected_at = time.monotonic()
+        if record.rtt is None:
+            record.rtt = rtt
+        else:
+            record.rtt += self.RTT_WEIGHT * (rtt - record.rtt)
+
+
+    def failed(self, peer: CompactPeer):
+        record = self._peers.get(peer)
+        if record is None:
+            return
+
+        now = time.monotonic()
+        record.flags = 0
+        record.failures += 1
+        if record.failures > 1 and now - record.last_seen > self.FORGET_AFTER:
+            del self._peers[peer]
+            return
+
+        backoff = min(self.BACKOFF_BASE * 2 ** (record.failures - 1), self.MAX_BACKOFF)
+        # jitter spreads out the retries of peers that failed together
+        record.retry_at = now + backoff * random.uniform(0.8, 1.2)
+
+
+    def disconnected(self, peer: CompactPeer, downloaded: int):
+        """ A connected peer went away, downloaded is what it sent us """
+        record = self._peers.get(peer)
+        if record is None:
+            return
+
+        now = time.monotonic()
+        if record.connected_at is not None:
+            record.connected_time += now - record.connected_at
+            record.connected_at = None
+
+        record.downloaded += downloaded
+        record.flags = 0
+        record.retry_at = now + self.RECONNECT_DELAY
+
+
+    def _rank(self, record: PeerRecord):
+        """ Sort key, lower is better """
+        rtt = record.rtt if record.rtt is not None else self.DEFAULT_RTT
+        return (-record.rate, rtt, record.failures)
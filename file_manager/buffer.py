@@ -0,0 +1,51 @@
+from typing import Dict, List, Iterator, Tuple
+
+class FileWriteBuffer:
+    """ This is a class that is used to buffer and coalesce writes to a file """
+    def __init__(self):
+        self._buffer: Dict[int, bytes] = {} # offset -> data
+        self._size = 0
+
+
+    def __len__(self) -> int:
+        """ Buffered bytes """
+        return self._size
+
+
+    def has(self, offset: int) -> bool:
+        return offset in self._buffer
+
+
+    def get(self, offset: int) -> bytes:
+        return self._buffer[offset]
+
+
+    def add(self, offset: int, data: bytes) -> int:
+        """ Buffer data at offset, replacing what was there. Returns by how
+        many bytes the buffer grew
+        """
+        old = self._buffer.get(offset)
+        delta = len(data) - (len(old) if old is not None else 0)
+
+        self._buffer[offset] = data
+        self._size += delta
+        return delta
+
+
+    def runs(self, max_buffers: int) -> Iterator[Tuple[int, List[bytes]]]:
+        """ Yields the buffered data as (offset, buffers) runs of adjacent writes
+        sorted by offset, this saves seeks and lets a run go in a single pwritev
+        """
+        run_offset, run, run_end = 0, [], -1
+        for offset in sorted(self._buffer):
+            data = self._buffer[offset]
+            if offset != run_end or len(run) >= max_buffers:
+                if run:
+                    yield run_offset, run
+                run_offset, run, run_end = offset, [], offset
+
+            run.append(data)
+            run_end += len(data)
+
+        if run:
+            yield run_offset, run
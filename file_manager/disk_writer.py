@@ -0,0 +1,253 @@
+from typing import Dict, List, Set
+
+import os
+import asyncio
+import threading
+
+from enum import Enum
+
+from .buffer import FileWriteBuffer
+
+
+class FsyncPolicy(Enum):
+    NEVER = 'never' # leave it to the kernel
+    ON_FLUSH = 'flush' # fsync on explicit flushes (and shutdown)
+    ALWAYS = 'always' # fsync after every batch of writes
+
+
+class DiskWriter:
+    """ Dedicated thread that writes pieces to disk
+
+    Writes are queued per file descriptor and the thread merges adjacent ones
+    into a single `os.pwritev`. Queued data is bounded by `high_water` bytes,
+    `drain` waits until the queue goes below it so downloading slows down
+    instead of the event loop blocking on disk IO.
+    """
+    IOV_MAX = os.sysconf('SC_IOV_MAX') if hasattr(os, 'sysconf') else 1024
+
+    def __init__(self, high_water: int = 64 * 1024 * 1024, fsync: FsyncPolicy = FsyncPolicy.ON_FLUSH):
+        self._high_water = high_water
+        self._fsync = fsync
+
+        self._lock = threading.Condition()
+        self._queued: Dict[int, FileWriteBuffer] = {} # fd -> writes waiting for the thread
+        self._writing: Dict[int, FileWriteBuffer] = {} # fd -> writes the thread is doing
+        self._queued_bytes = 0 # queued + writing
+        self._flush_requests: List[asyncio.Future] = []
+        self._resizes: Dict[int, int] = {} # fd -> size to set before its writes
+        self._closes: List[int] = [] # fds to close once their writes are done
+        self._close_tickets: Dict[int, int] = {} # fd -> ticket of its close_fd, until it is closed
+        self._tickets = 0
+        self._dirty: Set[int] = set() # fds written to but not fsynced
+        self._error: OSError | None = None
+        self._closing = False
+
+        self._loop: asyncio.AbstractEventLoop | None = None
+        self._writable = asyncio.Event()
+        self._writable.set()
+
+        self._thread = threading.Thread(target=self._run, name='pybt-disk-writer', daemon=True)
+        self._thread.start()
+
+
+    @property
+    def queue_bytes(self) -> int:
+        """ Bytes waiting to be written """
+        return self._queued_bytes
+
+
+    def write(self, fd: int, offset: int, data: bytes) -> None:
+        """ Queue a write, data must not be modified afterwards """
+        if self._error is not None:
+            raise self._error
+
+        self._loop = self._loop or asyncio.get_running_loop()
+
+        with self._lock:
+            # a write replacing a queued one only adds the difference
+            self._queued_bytes += self._queued.setdefault(fd, FileWriteBuffer()).add(offset, data)
+            if self._queued_bytes >= self._high_water:
+                self._writable.clear()
+            self._lock.notify_all()
+
+
+    def read(self, fd: int, offset: int, ticket: int | None = None) -> bytes | None:
+        """ Data of a write at offset that hasn't reached the disk yet. With the
+        ticket close_fd returned for fd, None once fd is closed (the number may
+        belong to another file by then)
+        """
+        with self._lock:
+            if ticket is not None and self._close_tickets.get(fd) != ticket:
+                return None
+
+            for pending in (self._queued, self._writing):
+                buffer = pending.get(fd)
+                if buffer is not None and buffer.has(offset):
+                    return buffer.get(offset)
+
+        return None
+
+
+    async def drain(self) -> None:
+        """ Wait until queued data is below the high water mark """
+        await self._writable.wait()
+
+
+    async def flush(self) -> None:
+        """ Wait until everything queued so far is written (and fsynced if the
+        policy says so)
+        """
+        self._loop = self._loop or asyncio.get_running_loop()
+        fut = self._loop.create_future()
+
+        with self._lock:
+            self._flush_requests.append(fut)
+            self._lock.notify_all()
+
+        await fut
+
+
+    def pending(self, fd: int) -> bool:
+        """ Whether fd has writes that haven't reached the disk yet """
+        with self._lock:
+            return fd in self._queued or fd in self._writing
+
+
+    def resize(self, fd: int, length: int) -> None:
+        """ Set the size of fd on the thread before any of its queued writes,
+        left alone if it already has that size
+        """
+        with self._lock:
+            self._resizes[fd] = length
+            self._lock.notify_all()
+
+
+    def close_fd(self, fd: int) -> int:
+        """ Close fd on the thread once everything queued for it is written,
+        fsynced first if the policy says so. fd must not be used afterwards,
+        except for read and closing with the ticket returned
+        """
+        with self._lock:
+            self._tickets += 1
+            self._close_tickets[fd] = self._tickets
+            self._closes.append(fd)
+            self._lock.notify_all()
+
+        return self._tickets
+
+
+    def closing(self, fd: int, ticket: int) -> bool:
+        """ Whether fd, handed to close_fd with ticket, isn't closed yet """
+        with self._lock:
+            return self._close_tickets.get(fd) == ticket
+
+
+    def close(self) -> None:
+        """ Write out everything queued and stop the thread """
+        with self._lock:
+            self._closing = True
+            self._lock.notify_all()
+
+        self._thread.join()
+
+
+    def _run(self):
+        while True:
+            with self._lock:
+                while not self._has_work() and not self._closing:
+                    self._lock.wait()
+
+                if not self._has_work() and self._closing:
+                    return
+
+                self._writing, self._queued = self._queued, {}
+                flush_requests, self._flush_requests = self._flush_requests, []
+                resizes, self._resizes = self._resizes, {}
+                closes, self._closes = self._closes, []
+
+                sync = self._fsync == FsyncPolicy.ALWAYS
+                if flush_requests and self._fsync == FsyncPolicy.ON_FLUSH:
+                    # files written in previous batches are synced as well
+                    for fd in self._dirty:
+                        self._writing.setdefault(fd, FileWriteBuffer())
+                    self._dirty.clear()
+                    sync = True
+
+            for fd, length in resizes.items():
+                try:
+                    # sparse until written, keeps data already there
+                    if os.fstat(fd).st_size != length:
+                        os.ftruncate(fd, length)
+                except OSError as e:
+                    self._error = e
+
+            written, dirty = 0, []
+            for fd, buffer in self._writing.items():
+                try:
+                    self._write_buffer(fd, buffer)
+                    if sync:
+                        os.fsync(fd)
+                    else:
+                        dirty.append(fd)
+                except OSError as e:
+                    self._error = e
+                written += len(buffer)
+
+            with self._lock:
+                self._dirty.update(dirty)
+                closing_dirty = [fd for fd in closes if fd in self._dirty]
+                self._dirty.difference_update(closes)
+                # their writes are on disk, reads don't need them anymore
+                for fd in closes:
+                    del self._close_tickets[fd]
+
+            for fd in closes:
+                try:
+                    if fd in closing_dirty and self._fsync != FsyncPolicy.NEVER:
+                        os.fsync(fd)
+                    os.close(fd)
+                except OSError as e:
+                    self._error = e
+
+            with self._lock:
+                self._writing = {}
+                self._queued_bytes -= written
+
+            try:
+                if self._loop is not None:
+                    self._loop.call_soon_threadsafe(self._written, flush_requests)
+            except RuntimeError:
+                # loop is closed, no one is waiting anymore
+                pass
+
+
+    def _has_work(self) -> bool:
+        return bool(self._queued or self._flush_requests or self._resizes or self._closes)
+
+
+    def _write_buffer(self, fd: int, buffer: FileWriteBuffer):
+        for offset, buffers in buffer.runs(self.IOV_MAX):
+            views = [memoryview(b) for b in buffers]
+            while views:
+                n = os.pwritev(fd, views, offset)
+                offset += n
+                # drop what was written, pwritev may write less than asked
+                while views and n >= len(views[0]):
+                    n -= len(views[0])
+                    views.pop(0)
+                if views and n:
+                    views[0] = views[0][n:]
+
+
+    def _written(self, flush_requests: List[asyncio.Future]):
+        """ Runs on the event loop after a batch is written """
+        if self._queued_bytes < self._high_water:
+            self._writable.set()
+
+        for fut in flush_requests:
+            if fut.done():
+                continue
+            if self._error is not None:
+                fut.set_exception(self._error)
+            else:
+                fut.set_result(None)
@@ -1,4 +1,4 @@
-from typing import Protocol, List
+from typing import BinaryIO, Protocol, List, Tuple
 
 class FileManager(Protocol):
     """ The class that is responsible for reading and writting data to/from the desired
@@ -9,6 +9,27 @@ class FileManager(Protocol):
 
     def write_piece(self, index: int, piece: bytes) -> None:
         raise NotImplementedError
+
+    def piece_buffer(self, index: int) -> memoryview | None:
+        """ Buffer a piece can be downloaded into directly, None to download it
+        into memory and hand it to write_piece
+        """
+        return None
+
+    def block_files(self, index: int, offset: int, length: int) -> List[Tuple[BinaryIO, int, int]] | None:
+        """ (file, offset in file, length) spans a block can be sent from with
+        sendfile, None if it must be read with read_piece. The caller closes the
+        files once done
+        """
+        return None
+
+    async def drain(self) -> None:
+        """ Wait until pending writes are below the memory limit """
+        raise NotImplementedError
+
+    async def flush(self) -> None:
+        """ Wait until every piece written so far reached the files """
+        raise NotImplementedError
     
     def end(self):
         """ Perform shutdown logic """
@@ -0,0 +1 @@
+from .mmap_file_manager import MmapFileManager
\ No newline at end of file
@@ -0,0 +1,96 @@
+from typing import BinaryIO, List, Tuple
+
+import os
+import mmap
+import asyncio
+
+from torrent import InfoDict 
+from file_manager import FileManager
+
+
+class MmapFileManager(FileManager): 
+    """ Manager for single file torrents backed by a memory mapped file
+
+    The file is preallocated and mapped once, pieces are downloaded straight
+    into the mapped region (see piece_buffer) so there is no intermediate buffer
+    and the kernel page cache does the buffering. Reads return zero copy views.
+    """
+    def __init__(self, meta_info: InfoDict):
+        self._file: str       = meta_info['name']
+        self._piece_size: int = meta_info['piece length']
+        self._length: int     = meta_info['length']
+
+        self._fd = os.open(self._file, os.O_RDWR | os.O_CREAT, 0o644)
+        self._preallocate()
+
+        self._map = mmap.mmap(self._fd, self._length)
+        self._view = memoryview(self._map)
+
+
+    def piece_buffer(self, index: int) -> memoryview:
+        """ Region of the file a piece is downloaded into """
+        offset = index * self._piece_size
+        return self._view[offset: offset + self._piece_size]
+
+
+    def read_piece(self, index: int) -> memoryview:
+        """ Read a piece at index passed as arg (a view into the mapped file) """
+        return self.piece_buffer(index)
+
+
+    def write_piece(self, index: int, piece: bytes) -> None:
+        """ Write piece passed as arg to index passed as arg """
+        # downloaded in place, nothing to copy
+        if isinstance(piece, memoryview) and piece.obj is self._map:
+            return
+
+        offset = index * self._piece_size
+        self._view[offset: offset + len(piece)] = piece
+
+
+    def block_files(self, index: int, offset: int, length: int) -> List[Tuple[BinaryIO, int, int]]:
+        """ The mapping is shared so the file sees every write right away. The
+        descriptor is duplicated, end may close ours while the block is being
+        sent
+        """
+        offset += index * self._piece_size
+        return [(open(os.dup(self._fd), 'rb', buffering=0), offset, length)]
+
+
+    async def drain(self) -> None:
+        # the kernel writes dirty pages back on its own
+        return
+
+
+    async def flush(self) -> None:
+        await asyncio.get_running_loop().run_in_executor(None, self._map.flush)
+
+
+    def end(self):
+        """ Terminate, writting dirty pages to disk """
+        self._map.flush()
+
+        try:
+            self._view.release()
+            self._map.close()
+        except BufferError:
+            # views of pieces still referenced somewhere, unmapped once collected
+            pass
+
+        os.close(self._fd)
+
+
+    def _preallocate(self):
+        """ Reserve the blocks of the whole file up front, falling back to a 
+        sparse file where fallocate isn't supported
+        """
+        size = os.fstat(self._fd).st_size
+        if size > self._length:
+            os.ftruncate(self._fd, self._length)
+        if size >= self._length:
+            return
+
+        try:
+            os.posix_fallocate(self._fd, 0, self._length)
+        except (AttributeError, OSError):
+            os.ftruncate(self._fd, self._length)
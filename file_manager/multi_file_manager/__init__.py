@@ -0,0 +1 @@
+from .multi_file_manager import MultiFileManager
\ No newline at end of file
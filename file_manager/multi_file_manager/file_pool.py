@@ -0,0 +1,93 @@
+from typing import Dict, List, Tuple
+
+import os
+
+from collections import OrderedDict
+
+from file_manager.disk_writer import DiskWriter
+
+
+class FilePool:
+    """ LRU pool of open file descriptors
+
+    Torrents may have far more files than we can (or want to) keep open, the
+    least recently used file without queued writes is closed when the pool is
+    full. Closing (and the fsync before it) and sizing new files happen on the
+    writer thread so the event loop never waits on them. The pool goes over
+    max_open while every file in it is being written to, at twice max_open the
+    least recently used one is closed anyway once its writes are done. Until
+    then `queued` finds them under the descriptor it had.
+    """
+    def __init__(self, paths: List[bytes], lengths: List[int], writer: DiskWriter, max_open: int = 128):
+        self._paths = paths
+        self._lengths = lengths
+        self._writer = writer
+        self._max_open = max_open
+
+        self._open: OrderedDict[int, int] = OrderedDict() # file index -> fd
+        self._sized: set[int] = set() # files already set to their final size
+        # file index -> (fd, close ticket) of files evicted with writes queued
+        self._retired: Dict[int, Tuple[int, int]] = {}
+
+
+    def __len__(self) -> int:
+        return len(self._open)
+
+
+    def get(self, idx: int) -> int:
+        """ File descriptor of file idx, opening it if needed """
+        fd = self._open.get(idx)
+        if fd is not None:
+            self._open.move_to_end(idx)
+            return fd
+
+        if len(self._open) >= self._max_open:
+            self._evict()
+
+        fd = os.open(self._paths[idx], os.O_RDWR | os.O_CREAT, 0o644)
+        if idx not in self._sized:
+            self._writer.resize(fd, self._lengths[idx])
+            self._sized.add(idx)
+
+        self._open[idx] = fd
+        return fd
+
+
+    def queued(self, idx: int, offset: int) -> bytes | None:
+        """ Data of a write to file idx at offset that hasn't reached the disk yet """
+        data = self._writer.read(self.get(idx), offset)
+        if data is None and idx in self._retired:
+            fd, ticket = self._retired[idx]
+            data = self._writer.read(fd, offset, ticket)
+
+        return data
+
+
+    def close(self) -> None:
+        while self._open:
+            _, fd = self._open.popitem()
+            self._writer.close_fd(fd)
+        self._retired.clear()
+
+
+    def _evict(self) -> None:
+        """ Close the least recently used file that has nothing queued """
+        for idx, fd in self._open.items():
+            if not self._writer.pending(fd):
+                del self._open[idx]
+                self._writer.close_fd(fd)
+                return
+
+        if len(self._open) < 2 * self._max_open:
+            return
+
+        self._retired = {
+            idx: (fd, ticket) for idx, (fd, ticket) in self._retired.items()
+            if self._writer.closing(fd, ticket)
+        }
+        # a file evicted twice would have its writes under two descriptors
+        for idx, fd in self._open.items():
+            if idx not in self._retired:
+                del self._open[idx]
+                self._retired[idx] = (fd, self._writer.close_fd(fd))
+                return
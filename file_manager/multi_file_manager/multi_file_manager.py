@@ -0,0 +1,149 @@
+from typing import BinaryIO, Iterator, List, Tuple
+
+import os
+
+from bisect import bisect_right
+
+from torrent import InfoDict
+from file_manager import FileManager
+from file_manager.disk_writer import DiskWriter
+from file_manager.read_cache import ReadCache
+
+from .file_pool import FilePool
+
+
+class MultiFileManager(FileManager):
+    """ Manager for multi file torrents
+
+    The torrent is a single stream of bytes made of its files one after the
+    other. A sorted index of the offset each file starts at maps a piece to the
+    file spans it covers by bisection, and file descriptors come from a LRU pool
+    so torrents with lots of files don't run out of them.
+    """
+    def __init__(
+        self, 
+        meta_info: InfoDict, 
+        writer: DiskWriter | None = None, 
+        max_open_files: int = 128,
+        cache_size: int = 32 * 1024 * 1024
+    ):
+        self._piece_size: int = meta_info['piece length']
+        self._total_pieces: int = meta_info.total_pieces
+
+        self._paths: List[bytes] = []
+        self._lengths: List[int] = []
+        self._offsets: List[int] = [] # torrent offset each file starts at
+
+        offset = 0
+        for path, length in meta_info.file_paths:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+
+            self._paths.append(path)
+            self._lengths.append(length)
+            self._offsets.append(offset)
+            offset += length
+
+        self._own_writer = writer is None
+        self._writer = writer or DiskWriter()
+        self._pool = FilePool(self._paths, self._lengths, self._writer, max_open_files)
+        self.cache = ReadCache(cache_size)
+
+        # empty files are never written to, create them now
+        for idx, length in enumerate(self._lengths):
+            if length == 0:
+                self._pool.get(idx)
+
+
+    def spans(self, offset: int, length: int) -> Iterator[Tuple[int, int, int]]:
+        """ Yields (file index, offset in file, length) of the files covering
+        length bytes at torrent offset
+        """
+        return file_spans(self._offsets, self._lengths, offset, length)
+
+
+    def read_piece(self, index: int) -> bytes:
+        """ Read a piece at index passed as arg (through the read cache) """
+        return self.cache.get(index, self._read_pieces)
+
+
+    def write_piece(self, index: int, piece: bytes) -> None:
+        """ Queue piece passed as arg to be written at index passed as arg """
+        self.cache.discard(index)
+
+        view = memoryview(piece)
+        pos = 0
+        for idx, file_offset, n in self.spans(index * self._piece_size, len(piece)):
+            self._writer.write(self._pool.get(idx), file_offset, view[pos: pos + n])
+            pos += n
+
+
+    def block_files(self, index: int, offset: int, length: int) -> List[Tuple[BinaryIO, int, int]] | None:
+        """ The block straight from the files it spans, unless the piece is cached
+        or not written yet. Descriptors are duplicated, the pool may close its 
+        own while the block is being sent
+        """
+        if index in self.cache:
+            return None
+
+        piece_offset = index * self._piece_size
+        for idx, file_offset, _ in self.spans(piece_offset, self._piece_size):
+            if self._pool.queued(idx, file_offset) is not None:
+                return None
+
+        return [
+            (open(os.dup(self._pool.get(idx)), 'rb', buffering=0), file_offset, n)
+            for idx, file_offset, n in self.spans(piece_offset + offset, length)
+        ]
+
+
+    def _read_pieces(self, first: int, count: int) -> List[bytes]:
+        count = min(count, self._total_pieces - first)
+        return [self._read_piece(index) for index in range(first, first + count)]
+
+
+    def _read_piece(self, index: int) -> bytes:
+        data = bytearray()
+        for idx, file_offset, n in self.spans(index * self._piece_size, self._piece_size):
+            # piece may still be waiting to be written
+            pending = self._pool.queued(idx, file_offset)
+            if pending is not None and len(pending) == n:
+                data += pending
+                continue
+
+            chunk = os.pread(self._pool.get(idx), n, file_offset)
+            # a new file isn't sized until the writer gets to it, it is all
+            # zeros past its end then
+            data += chunk + bytes(n - len(chunk))
+
+        return bytes(data)
+
+
+    async def drain(self) -> None:
+        await self._writer.drain()
+
+
+    async def flush(self) -> None:
+        await self._writer.flush()
+
+
+    def end(self):
+        """ Terminate, writting buffers to disk """
+        self._pool.close()
+
+        if self._own_writer:
+            self._writer.close()
+
+
+def file_spans(offsets: List[int], lengths: List[int], offset: int, length: int) -> Iterator[Tuple[int, int, int]]:
+    """ Yields (file index, offset in file, length) of the files covering length
+    bytes at torrent offset, offsets is the sorted list of where each file starts
+    """
+    idx = bisect_right(offsets, offset) - 1
+    while length > 0 and idx < len(offsets):
+        file_offset = offset - offsets[idx]
+        n = min(length, lengths[idx] - file_offset)
+        if n > 0:
+            yield idx, file_offset, n
+            offset += n
+            length -= n
+        idx += 1
@@ -0,0 +1,92 @@
+from typing import Callable, List
+
+from collections import OrderedDict
+
+
+class ReadCache:
+    """ LRU cache of pieces read from disk, bounded in bytes
+
+    Peers downloading from us often go through pieces in order, when a piece
+    misses and the one before it is cached the next `readahead` pieces are
+    loaded along with it so the following requests are served from memory
+    instead of costing a seek each.
+    """
+    def __init__(self, max_bytes: int = 32 * 1024 * 1024, readahead: int = 4):
+        self._max_bytes = max_bytes
+        self._readahead = readahead
+
+        self._pieces: OrderedDict[int, bytes] = OrderedDict() # index -> data, oldest first
+        self._size = 0
+
+        self.hits = 0
+        self.misses = 0
+        self.readaheads = 0 # pieces loaded before being asked for
+
+
+    def __len__(self) -> int:
+        return len(self._pieces)
+
+
+    def __contains__(self, index: int) -> bool:
+        return index in self._pieces
+
+
+    @property
+    def size(self) -> int:
+        """ Cached bytes """
+        return self._size
+
+
+    def get(self, index: int, load: Callable[[int, int], List[bytes]]) -> bytes:
+        """ Piece at index, on a miss load(first, count) must return up to count
+        pieces starting at first (at least the first one)
+        """
+        data = self._pieces.get(index)
+        if data is not None:
+            self._pieces.move_to_end(index)
+            self.hits += 1
+            return data
+
+        self.misses += 1
+        if self._max_bytes <= 0:
+            return load(index, 1)[0]
+
+        count = 1
+        if index - 1 in self._pieces:
+            # sequential, stop at the first piece we already have
+            while count <= self._readahead and index + count not in self._pieces:
+                count += 1
+
+        pieces = load(index, count)
+        self.readaheads += len(pieces) - 1
+
+        # pieces read ahead are newer, they are the ones about to be asked for
+        for n, data in enumerate(pieces):
+            self._put(index + n, data)
+
+        return pieces[0]
+
+
+    def discard(self, index: int) -> None:
+        """ Drop a piece, it is about to change on disk """
+        data = self._pieces.pop(index, None)
+        if data is not None:
+            self._size -= len(data)
+
+
+    def clear(self) -> None:
+        self._pieces.clear()
+        self._size = 0
+
+
+    def _put(self, index: int, data: bytes) -> None:
+        if len(data) > self._max_bytes:
+            return
+
+        self.discard(index)
+        self._pieces[index] = data
+        self._size += len(data)
+
+        while self._size > self._max_bytes:
+            _, old = self._pieces.popitem(last=False)
+            self._size -= len(old)
@@ -0,0 +1,113 @@
+from typing import List, Tuple
+
+import os
+import mmap
+import bitarray
+
+from hashlib import sha1
+from concurrent.futures import ProcessPoolExecutor
+
+from bitarray.util import zeros
+
+from torrent import InfoDict
+
+from .multi_file_manager.multi_file_manager import file_spans
+
+
+def recheck(meta_info: InfoDict, workers: int | None = None) -> bitarray.bitarray:
+    """ Hash the data already on disk and return the pieces that are good
+
+    Pieces are split in chunks hashed by a pool of processes, each one mapping
+    the files it needs so data is hashed straight from the page cache.
+    """
+    total_pieces = meta_info.total_pieces
+    workers = workers or os.cpu_count() or 1
+    chunk = max(1, total_pieces // (workers * 4))
+
+    files = meta_info.file_paths
+    jobs = [
+        (files, meta_info['piece length'], start, min(start + chunk, total_pieces),
+         meta_info['pieces'][20 * start: 20 * min(start + chunk, total_pieces)])
+        for start in range(0, total_pieces, chunk)
+    ]
+
+    pieces = zeros(total_pieces)
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        for start, result in zip(range(0, total_pieces, chunk), executor.map(_check_range, jobs)):
+            good = bitarray.bitarray()
+            good.frombytes(result)
+            pieces[start: start + chunk] = good[:min(chunk, total_pieces - start)]
+
+    return pieces
+
+
+def has_data(meta_info: InfoDict) -> bool:
+    """ If any file of the torrent exists with some data in it """
+    for path, _ in meta_info.file_paths:
+        try:
+            if os.stat(path).st_size > 0:
+                return True
+        except OSError:
+            pass
+
+    return False
+
+
+def _check_range(job: Tuple[List[Tuple[bytes, int]], int, int, int, bytes]) -> bytes:
+    """ Runs on a worker process, returns the bitfield of good pieces in
+    [start, stop)
+    """
+    files, piece_length, start, stop, hashes = job
+
+    offsets, lengths = [], []
+    offset = 0
+    for _, length in files:
+        offsets.append(offset)
+        lengths.append(length)
+        offset += length
+    total_length = offset
+
+    maps = {}
+    good = zeros(stop - start)
+    try:
+        for n in range(start, stop):
+            piece_offset = n * piece_length
+            length = min(piece_length, total_length - piece_offset)
+
+            h = sha1()
+            ok = True
+            for idx, file_offset, size in file_spans(offsets, lengths, piece_offset, length):
+                region = _map(maps, files[idx][0], lengths[idx])
+                if region is None or file_offset + size > len(region):
+                    ok = False
+                    break
+                # hash the pages in place, released before the map is closed
+                with memoryview(region)[file_offset: file_offset + size] as view:
+                    h.update(view)
+
+            expected = hashes[20 * (n - start): 20 * (n - start) + 20]
+            good[n - start] = ok and h.digest() == expected
+    finally:
+        for region in maps.values():
+            if region is not None:
+                region.close()
+
+    return good.tobytes()
+
+
+def _map(maps: dict, path: bytes, length: int) -> mmap.mmap | None:
+    """ Map a file once per worker, None if it doesn't exist or is empty """
+    if path in maps:
+        return maps[path]
+
+    region = None
+    try:
+        with open(path, 'rb') as fp:
+            size = min(os.fstat(fp.fileno()).st_size, length)
+            if size > 0:
+                region = mmap.mmap(fp.fileno(), size, access=mmap.ACCESS_READ)
+    except OSError:
+        pass
+
+    maps[path] = region
+    return region
@@ -0,0 +1,88 @@
+from typing import List, Tuple
+
+import os
+import bencode
+import bitarray
+
+
+class ResumeData:
+    """ Fast resume file
+
+    Keeps the bitfield of the pieces we have along with the size and mtime of
+    every file when it was saved. Pieces are only saved once their writes
+    reached the files, so while the file sizes match the bitfield is a lower
+    bound of what is on disk even if we wrote more since (a crash mid download),
+    those pieces are simply downloaded again. In strict mode the mtimes must
+    match as well, a file touched since the save means a recheck.
+    """
+    def __init__(self, path: bytes, info_hash: bytes, files: List[Tuple[bytes, int]], strict: bool = False):
+        self._path = path
+        self._info_hash = info_hash
+        self._files = files
+        self._strict = strict
+
+
+    def load(self, total_pieces: int) -> bitarray.bitarray | None:
+        """ Pieces we have, None if there is no resume data or it is stale """
+        try:
+            with open(self._path, 'rb') as fp:
+                data = bencode.load(fp)
+        except (OSError, ValueError):
+            return None
+
+        if not isinstance(data, dict) or data.get('info_hash') != self._info_hash:
+            return None
+
+        files = self._stat_files()
+        saved = data.get('files')
+        if files is None or not isinstance(saved, list) or len(saved) != len(files):
+            return None
+
+        for (size, mtime), stat in zip(files, saved):
+            if not isinstance(stat, list) or len(stat) != 2 or stat[0] != size:
+                return None
+            if self._strict and stat[1] != mtime:
+                return None
+
+        pieces = bitarray.bitarray()
+        try:
+            pieces.frombytes(data['pieces'])
+        except (KeyError, TypeError):
+            return None
+
+        if len(pieces) < total_pieces:
+            return None
+
+        del pieces[total_pieces:]
+        return pieces
+
+
+    def save(self, pieces: bitarray.bitarray) -> None:
+        """ Must be called once every write reached the files """
+        files = self._stat_files()
+        if files is None:
+            return
+
+        data = {
+            'info_hash': self._info_hash,
+            'pieces': pieces.tobytes(),
+            'files': files,
+        }
+
+        # write and rename so a crash never leaves a half written resume file
+        tmp = self._path + b'.tmp'
+        with open(tmp, 'wb') as fp:
+            fp.write(bencode.dumps(data))
+        os.replace(tmp, self._path)
+
+
+    def _stat_files(self) -> List[List[int]] | None:
+        stats = []
+        for path, _ in self._files:
+            try:
+                st = os.stat(path)
+            except OSError:
+                return None
+            stats.append([st.st_size, st.st_mtime_ns])
+
+        return stats
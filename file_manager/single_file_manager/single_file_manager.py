@@ -1,11 +1,13 @@
-from typing import Protocol, Dict, List
+from typing import BinaryIO, Protocol, Dict, List, Tuple
+
+import os
 
 from math import ceil
 
 from torrent import InfoDict 
 from file_manager import FileManager
-
-from .cache import lru_cache
+from file_manager.disk_writer import DiskWriter
+from file_manager.read_cache import ReadCache
 
 
 class SingleFileManager(FileManager): 
@@ -13,29 +15,80 @@ class SingleFileManager(FileManager):
 
     Implementing multi file support will build on top of this. This class is a 
     temporary placeholder before full implementation
+
+    Writes go through a DiskWriter so the event loop never blocks on disk IO, it
+    can be shared between managers. Reads go through a ReadCache of cache_size
+    bytes
     """
-    def __init__(self, meta_info: InfoDict):
+    def __init__(self, meta_info: InfoDict, writer: DiskWriter | None = None, cache_size: int = 32 * 1024 * 1024):
         self._file: str       = meta_info['name']
         self._piece_size: int = meta_info['piece length']
-        self._fp = open(self._file, 'wb')
+        self._total_pieces: int = meta_info.total_pieces
+        # data already there is kept, resume data or a recheck tells what it is worth
+        self._fd = os.open(self._file, os.O_RDWR | os.O_CREAT, 0o644)
+
+        self._own_writer = writer is None
+        self._writer = writer or DiskWriter()
+        self.cache = ReadCache(cache_size)
 
 
-    @lru_cache(cache_size=50)
     def read_piece(self, index: int) -> bytes:
-        """ Read a piece at index passed as arg (wrapped with a LRU cache)"""
-        self._fp.seek(index * self._piece_size, 0)
-        return self._fp.read(self._piece_size)
+        """ Read a piece at index passed as arg (through the read cache) """
+        return self.cache.get(index, self._read_pieces)
 
 
     def write_piece(self, index: int, piece: bytes) -> None:
-        """ Write piece passed as arg to index passed as arg """
-        self._fp.seek(index * self._piece_size, 0)
-        self._fp.write(piece)
+        """ Queue piece passed as arg to be written at index passed as arg """
+        self.cache.discard(index)
+        self._writer.write(self._fd, index * self._piece_size, piece)
+
+
+    def block_files(self, index: int, offset: int, length: int) -> List[Tuple[BinaryIO, int, int]] | None:
+        """ The block straight from the file, unless the piece is cached or not
+        written yet. The descriptor is duplicated, end may close ours while the
+        block is being sent
+        """
+        piece_offset = index * self._piece_size
+        if index in self.cache or self._writer.read(self._fd, piece_offset) is not None:
+            return None
+
+        return [(open(os.dup(self._fd), 'rb', buffering=0), piece_offset + offset, length)]
+
+
+    def _read_pieces(self, first: int, count: int) -> List[bytes]:
+        """ Read count pieces starting at first with a single pread """
+        count = min(count, self._total_pieces - first)
+        offset = first * self._piece_size
+
+        # pieces may still be waiting to be written, check before reading so a
+        # write finishing in between can't be missed
+        pieces: List[bytes | None] = []
+        for n in range(count):
+            pending = self._writer.read(self._fd, offset + n * self._piece_size)
+            pieces.append(None if pending is None else bytes(pending))
+
+        if None in pieces:
+            data = os.pread(self._fd, count * self._piece_size, offset)
+            for n in range(count):
+                if pieces[n] is None:
+                    pieces[n] = data[n * self._piece_size: (n + 1) * self._piece_size]
+
+        return pieces
+
+
+    async def drain(self) -> None:
+        await self._writer.drain()
+
+
+    async def flush(self) -> None:
+        await self._writer.flush()
 
 
-    """ Terminate, writting buffer to disk """
-    def end():
-        self._fp.flush()
-        self._fp.close()
+    def end(self):
+        """ Terminate, the file is closed on the writer thread once its queued
+        writes are done
+        """
+        self._writer.close_fd(self._fd)
 
-        
\ No newline at end of file
+        if self._own_writer:
+            self._writer.close()
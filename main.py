@@ -1,234 +1,9 @@
-from typing import Set
-
 import argparse
 import asyncio
 
-from client import Client
-
-from torrent import TorrentFile
-from tracker import Tracker, PeerAddr, TrackerException
-from torrent_manager import TorrentManager, TorrentStatus
-
-from peer import Peer, PeerConnectionError
-
-# TODO these should be initialized in a different place
-from tracker.http_tracker import HTTPTracker
-from file_manager.single_file_manager import SingleFileManager
-
-
-class Main:
-    def __init__(self, max_peers: int, port: int, path: str):
-        self.max_peers = max_peers 
-        self.bad_peers = set() # peers that are irresponsive
-        self.active_peers = set() # peers currenly connected
-
-        self.pending_peers = asyncio.Queue() # peers ready retrieved from tracker 
-        self.peers_awaiting_connection = asyncio.Queue() # peers awaiting connection
-        self.work_queue = asyncio.Queue() # connected peers to be ran on worker coroutines
-
-        self.need_peers_lock = asyncio.Lock()
-        self.need_peers = asyncio.Condition(self.need_peers_lock)
-
-        self.client = Client(port=port)
-        self.torrent = TorrentFile.from_file(path=path)
-
-        self.file_manager = SingleFileManager(self.torrent['info'])
-        self.torrent_status = TorrentStatus(self.torrent['info'])
-        self.torrent_manager = TorrentManager(self.torrent['info'], self.file_manager, self.torrent_status)
-
-
-    async def run(self):
-        if not self.torrent["announce"].startswith(b"http"):
-            print("Unsupported protocol version! Only HTTP Trackers allowed")
-            exit(0)
-
-        tracker: Tracker = HTTPTracker(
-            client=self.client, torrent=self.torrent, status=self.torrent_status
-        )
-
-        # coroutine that periodically fetches peers from tracker
-        tracker_task = asyncio.create_task(self.tracker_coro(tracker=tracker))
-
-        # coroutines that handles newly fetched peers
-        conn_man_task = asyncio.create_task(
-            self.conn_manager_coro()
-        )
-
-        # coroutines that open connections and enqueue good peers
-        conn_workers = [
-            asyncio.create_task(self.conn_worker()) for _ in range(self.max_peers)
-        ]
-
-        # coroutine listens for incoming peer connections
-        server_task = asyncio.create_task(
-            asyncio.start_server(self.server_cb, port=self.client.port)
-        )
-
-        # workers that talk to peers    
-        workers = [
-            asyncio.create_task(self.worker_coro())
-            for _ in range(self.max_peers)
-        ]
-
-        try:
-            await self.torrent_manager.end.wait()
-        except (KeyboardInterrupt, asyncio.CancelledError):
-            # await self.notify(self.need_peers)
-            print("\nSIGINT received, terminating")
-
-        tracker_task.cancel()
-        conn_man_task.cancel()
-        server_task.cancel()
-
-        for worker in workers:
-            worker.cancel()
-
-        for worker in conn_workers:
-            worker.cancel()
-        
-        await tracker_task
-
-        return
-
-        
-
-    async def tracker_coro(self, tracker: Tracker):
-        """ Coroutine that periodically fetches peers when necessary """
-        try:
-            while not self.torrent_manager.end.is_set():
-                # TODO
-                # We use >= because incoming connections are not accounted
-                # since this was only tested behind a NAT
-                while len(self.active_peers) >= self.max_peers:
-                    await self.wait(cond=self.need_peers)
-
-                try:
-                    peers, interval = await tracker.get_peers()
-                except TrackerException as e:
-                    print(str(e))
-                    return
-
-                if peers is not None:
-                    await self.pending_peers.put(peers)
-                    
-                # NOTE we simply don't wait on interval because we are behind a NAT
-                # so peers can't connect to us and we need to fetch them at a constant rate
-                # because some trackers would make us wait 15 minutes which is a bit much
-                await asyncio.sleep(60)
-    
-        except asyncio.CancelledError:
-            await tracker.close()
-    
-
-    async def conn_manager_coro(self):
-        """ Coroutine responsible for managing new peers """
-        try:
-            while not self.torrent_manager.end.is_set():
-                pending_peers = await self.pending_peers.get()
-
-                if len(self.active_peers) >= self.max_peers:
-                    continue
-
-                for peer_addr in pending_peers:
-                    # peer marked as bad or already active 
-                    if not {peer_addr} - self.bad_peers - self.active_peers:
-                        continue
-
-                    # new_peer = Peer(peer, self.torrent, self.client)
-                    await self.peers_awaiting_connection.put(peer_addr)
-
-        except asyncio.CancelledError:
-            pass
-
-
-    async def conn_worker(self):
-        """ Coroutines that connect to peers and enqueue good ones to workers """
-        try:
-            while not self.torrent_manager.end.is_set():
-                peer_addr = await self.peers_awaiting_connection.get()
-                new_peer = Peer(peer_addr, self.torrent, self.client, self.torrent_manager)
-                try:
-                    await new_peer.initialize()
-                except PeerConnectionError as e:
-                    print(str(e))
-                    self.bad_peers.add(peer_addr)
-                    continue
-                
-                await self.work_queue.put(new_peer)
-        
-        except asyncio.CancelledError:
-            pass
-
-            
-    async def server_cb(
-        self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter
-    ):
-        """ Coroutine that accepts incoming peer connections """
-        peer_name = reader._transport.get_extra_info('peername') # IP and port
-
-        new_peer = Peer.from_incoming_conn(
-            PeerAddr(peer_name[0], peer_name[1]),
-            self.torrent,
-            self.client,
-            reader,
-            writer
-        )
-
-        try:
-            await new_peer.handshake()
-        except PeerConnectionError:
-            self.bad_peers.add(new_peer)
-            await new_peer.end()
-            return
-        
-        await self.work_queue.put(new_peer)
-
-
-    async def worker_coro(self):
-        """ Worker coroutine that talks to a peer """
-        try:
-            while not self.torrent_manager.end.is_set():
-                peer: Peer = await self.work_queue.get()
-                self.active_peers.add(peer)
-                try:
-                    await peer.run()
-                except PeerConnectionError as e:
-                    print(str(e))
-                    self.active_peers.remove(peer)
-                    if (len(self.active_peers) < self.max_peers):
-                        await self.notify(self.need_peers)
-                except asyncio.CancelledError:
-                    return
-
-                finally:
-                    await peer.end()
-
-
-        except asyncio.CancelledError:
-            pass
-
-
-    async def wait(self, cond: asyncio.Condition):
-        """ Wait on a condition atomically """
-        try:
-            await cond.acquire()
-            await cond.wait()
-        except asyncio.CancelledError:
-            if cond.locked():
-                cond.release() 
-            raise
-    
-    async def notify(self, cond: asyncio.Condition):
-        """ Atomically notify of a condition """
-        try:
-            await cond.acquire()
-            cond.notify()
-            cond.release()
-        except asyncio.CancelledError:
-            if cond.locked():
-                cond.release()
-            raise
-
+from session import Session, Supervisor
+from profiler import Profiler
+from file_manager.disk_writer import FsyncPolicy
 
 
 if __name__ == '__main__':
@@ -237,7 +12,7 @@ if __name__ == '__main__':
                         description ='A tiny BitTorrent 1.0 client implementation in Python'
     )
 
-    parser.add_argument('torrentfile', help='absolute or relative path to torrent file')
+    parser.add_argument('torrentfile', nargs='+', help='absolute or relative paths to torrent files')
     parser.add_argument('-p', '--port', type = int,
                             default=6881,
                             help='Port where the client will be accepting connections (default: %(default)s)'
@@ -245,7 +20,88 @@ if __name__ == '__main__':
 
     parser.add_argument('--max-peer', type = int, 
                             default=30, 
-                            help='Max number of peers (default: %(default)s)'
+                            help='Max number of peers per torrent (default: %(default)s)'
+    )
+
+    parser.add_argument('--max-connections', type = int,
+                            default=200,
+                            help='Max number of peer connections of all torrents (default: %(default)s)'
+    )
+
+    parser.add_argument('--workers', type = int,
+                            default=1,
+                            help='Number of processes the torrents are spread over, they share the port (default: %(default)s)'
+    )
+
+    parser.add_argument('--max-dials', type = int,
+                            default=8,
+                            help='Max number of connection attempts in flight (default: %(default)s)'
+    )
+
+    parser.add_argument('--hash-workers', type = int,
+                            default=2,
+                            help='Number of threads verifying piece hashes (default: %(default)s)'
+    )
+
+    parser.add_argument('--write-buffer', type = int,
+                            default=64,
+                            help='MiB of verified pieces waiting to be written before downloading slows down (default: %(default)s)'
+    )
+
+    parser.add_argument('--fsync', choices=[p.value for p in FsyncPolicy],
+                            default=FsyncPolicy.ON_FLUSH.value,
+                            help='When written data is fsynced (default: %(default)s)'
+    )
+
+    parser.add_argument('--storage', choices=['file', 'mmap'],
+                            default='file',
+                            help='Storage backend for single file torrents, mmap downloads straight into a memory mapped file (default: %(default)s)'
+    )
+
+    parser.add_argument('--recheck', action='store_true',
+                            help='Hash existing data even if resume data is up to date'
+    )
+
+    parser.add_argument('--strict-resume', action='store_true',
+                            help='Recheck when files were modified after resume data was saved'
+    )
+
+    parser.add_argument('--check-workers', type = int,
+                            default=None,
+                            help='Number of processes hashing existing data (default: number of CPUs)'
+    )
+
+    parser.add_argument('--read-cache', type = int,
+                            default=32,
+                            help='MiB of pieces kept in memory to serve peers, 0 disables it (default: %(default)s)'
+    )
+
+    parser.add_argument('--seed', action='store_true',
+                            help='Keep running and uploading once the download is finished'
+    )
+
+    parser.add_argument('--upload-slots', type = int,
+                            default=4,
+                            help='Number of peers of all torrents unchoked by upload or download rate, plus an optimistic one (default: %(default)s)'
+    )
+
+    parser.add_argument('--metrics-port', type = int,
+                            default=None,
+                            help='Serve metrics in Prometheus format on this localhost port, worker n of --workers on port + n (default: off)'
+    )
+
+    parser.add_argument('--profile', choices=['sample', 'cprofile'],
+                            default=None,
+                            help='Profile the client, sample is a low overhead stack sampler, cprofile counts every call (default: off)'
+    )
+
+    parser.add_argument('--profile-duration', type = float,
+                            default=60,
+                            help='Seconds profiled from the start, results are written when they are over or on exit (default: %(default)s)'
+    )
+
+    parser.add_argument('--profile-output', default='pybt-profile',
+                            help='Prefix of the profile files, a collapsed stack file (flamegraph) or pstats file and a span summary (default: %(default)s)'
     )
 
     args = parser.parse_args()
@@ -256,5 +112,80 @@ if __name__ == '__main__':
         print("Invalid port")
         exit(0)
 
-    obj = Main(int(args.max_peer), args.port, args.torrentfile)
-    asyncio.run(obj.run(), debug=False)
+    if (args.max_connections < 1):
+        print("Invalid max number of connections")
+        exit(0)
+
+    if (args.workers < 1):
+        print("Invalid number of workers")
+        exit(0)
+
+    if (args.max_dials < 1):
+        print("Invalid number of connection attempts")
+        exit(0)
+
+    if (args.hash_workers < 1):
+        print("Invalid number of hash workers")
+        exit(0)
+
+    if (args.write_buffer < 1):
+        print("Invalid write buffer size")
+        exit(0)
+
+    if (args.read_cache < 0):
+        print("Invalid read cache size")
+        exit(0)
+
+    if (args.upload_slots < 0):
+        print("Invalid number of upload slots")
+        exit(0)
+
+    if args.profile is not None and args.workers > 1:
+        print("Profiling runs with a single worker")
+        exit(0)
+
+    if (args.profile_duration <= 0):
+        print("Invalid profile duration")
+        exit(0)
+
+    if args.metrics_port is not None and (args.metrics_port < 0 or args.metrics_port + args.workers > 2**16):
+        print("Invalid metrics port")
+        exit(0)
+
+    session_args = dict(
+        port=args.port,
+        max_connections=args.max_connections,
+        upload_slots=args.upload_slots,
+        hash_workers=args.hash_workers,
+        write_buffer=args.write_buffer * 1024 * 1024,
+        fsync=FsyncPolicy(args.fsync),
+        check_workers=args.check_workers,
+        metrics_port=args.metrics_port
+    )
+    torrent_args = dict(
+        max_peers=int(args.max_peer),
+        max_dials=args.max_dials,
+        storage=args.storage,
+        force_recheck=args.recheck,
+        strict_resume=args.strict_resume,
+        read_cache=args.read_cache * 1024 * 1024,
+        seed=args.seed
+    )
+
+    if args.workers > 1:
+        # limits apply to each worker
+        supervisor = Supervisor(args.workers, args.torrentfile, session_args, torrent_args)
+        supervisor.start()
+        asyncio.run(supervisor.run(), debug=False)
+        exit(0)
+
+    session = Session(**session_args)
+    for path in args.torrentfile:
+        session.add_torrent(path, **torrent_args)
+
+    if args.profile is not None:
+        profiler = Profiler(args.profile, args.profile_duration, args.profile_output)
+        asyncio.run(profiler.run(session.run()), debug=False)
+        exit(0)
+
+    asyncio.run(session.run(), debug=False)
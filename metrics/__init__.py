@@ -0,0 +1,2 @@
+from .metrics import Histogram, RateMeter, LoopLagMonitor, RTT_BOUNDS, LAG_BOUNDS
+from .exporter import snapshot, render, MetricsServer
@@ -0,0 +1,187 @@
+from __future__ import annotations
+
+from typing import Any, Dict, List, Tuple
+from typing import TYPE_CHECKING
+
+import time
+
+from aiohttp import web
+
+if TYPE_CHECKING:
+    from session import Session
+
+
+def snapshot(session: Session) -> Dict[str, Any]:
+    """ Every counter of a session as plain Python values, nothing is computed
+    but the sums over the connected peers
+    """
+    torrents = []
+    for torrent in session.torrents.values():
+        status = torrent.torrent_status
+        peers = [
+            {
+                'peer': f'{peer.ip}:{peer.port}',
+                'downloaded_bytes': peer.downloaded,
+                'uploaded_bytes': peer.uploaded,
+                'download_rate': peer.download_rate.rate,
+                'upload_rate': peer.upload_rate.rate,
+                'outstanding_requests': peer.pipeline.outstanding,
+                'request_depth': peer.pipeline.depth,
+                'rtt': peer.pipeline.rtt,
+            }
+            for peer in torrent.connections.active
+        ]
+
+        torrents.append({
+            'info_hash': torrent.info_hash.hex(),
+            'name': torrent.torrent['info']['name'].decode('utf-8', 'replace'),
+            'pieces': status.pieces.count(),
+            'total_pieces': len(status.pieces),
+            'left_bytes': status.left,
+            'received_bytes': status.received,
+            'wasted_bytes': status.wasted,
+            'uploaded_bytes': status.uploaded,
+            'hash_failures': status.hash_failures,
+            'download_rate': status.download_rate.rate,
+            'upload_rate': status.upload_rate.rate,
+            'idle_seconds': time.monotonic() - status.last_received,
+            'outstanding_requests': sum(peer['outstanding_requests'] for peer in peers),
+            'block_rtt': status.block_rtt.snapshot(),
+            'seeding': torrent.torrent_manager.seeding,
+            'peers': peers,
+        })
+
+    return {
+        'disk_queue_bytes': session.disk_writer.queue_bytes,
+        'hash_queue_pieces': session.verifier.queue_depth,
+        'connections': sum(len(torrent['peers']) for torrent in torrents),
+        'loop_lag_seconds': session.loop_lag.last,
+        'loop_lag_max_seconds': session.loop_lag.max,
+        'loop_lag': session.loop_lag.histogram.snapshot(),
+        'torrents': torrents,
+    }
+
+
+# (metric, type, help, snapshot key), per torrent and per peer
+TORRENT_METRICS: List[Tuple[str, str, str, str | None]] = [
+    ('pybt_torrent_pieces', 'gauge', 'Pieces we have', 'pieces'),
+    ('pybt_torrent_pieces_total', 'gauge', 'Pieces of the torrent', 'total_pieces'),
+    ('pybt_torrent_left_bytes', 'gauge', 'Bytes left to download', 'left_bytes'),
+    ('pybt_torrent_received_bytes_total', 'counter', 'Block payload bytes received', 'received_bytes'),
+    ('pybt_torrent_wasted_bytes_total', 'counter', 'Received bytes that were of no use', 'wasted_bytes'),
+    ('pybt_torrent_uploaded_bytes_total', 'counter', 'Block payload bytes uploaded', 'uploaded_bytes'),
+    ('pybt_torrent_hash_failures_total', 'counter', 'Pieces that failed their hash check', 'hash_failures'),
+    ('pybt_torrent_download_rate_bytes', 'gauge', 'Download rate in bytes per second', 'download_rate'),
+    ('pybt_torrent_upload_rate_bytes', 'gauge', 'Upload rate in bytes per second', 'upload_rate'),
+    ('pybt_torrent_idle_seconds', 'gauge', 'Seconds since a useful block was received', 'idle_seconds'),
+    ('pybt_torrent_outstanding_requests', 'gauge', 'Block requests waiting for an answer', 'outstanding_requests'),
+    ('pybt_torrent_peers', 'gauge', 'Connected peers', None),
+]
+PEER_METRICS: List[Tuple[str, str, str, str]] = [
+    ('pybt_peer_downloaded_bytes_total', 'counter', 'Useful bytes received from the peer', 'downloaded_bytes'),
+    ('pybt_peer_uploaded_bytes_total', 'counter', 'Bytes uploaded to the peer', 'uploaded_bytes'),
+    ('pybt_peer_download_rate_bytes', 'gauge', 'Download rate from the peer in bytes per second', 'download_rate'),
+    ('pybt_peer_upload_rate_bytes', 'gauge', 'Upload rate to the peer in bytes per second', 'upload_rate'),
+    ('pybt_peer_outstanding_requests', 'gauge', 'Block requests waiting for an answer', 'outstanding_requests'),
+    ('pybt_peer_request_depth', 'gauge', 'Block requests allowed in flight', 'request_depth'),
+]
+
+
+def render(snap: Dict[str, Any]) -> str:
+    """ Prometheus text exposition format (0.0.4) of a snapshot """
+    lines: List[str] = []
+
+    def header(name: str, kind: str, help: str):
+        lines.append(f'# HELP {name} {help}')
+        lines.append(f'# TYPE {name} {kind}')
+
+    def histogram(name: str, hist: Dict[str, Any], labels: str):
+        sep = ',' if labels else ''
+        for bound, count in zip(hist['bounds'], hist['cumulative']):
+            lines.append(f'{name}_bucket{{{labels}{sep}le="{bound}"}} {count}')
+        lines.append(f'{name}_bucket{{{labels}{sep}le="+Inf"}} {hist["cumulative"][-1]}')
+        braces = f'{{{labels}}}' if labels else ''
+        lines.append(f'{name}_sum{braces} {hist["sum"]}')
+        lines.append(f'{name}_count{braces} {hist["count"]}')
+
+    header('pybt_disk_queue_bytes', 'gauge', 'Bytes waiting to be written to disk')
+    lines.append(f'pybt_disk_queue_bytes {snap["disk_queue_bytes"]}')
+    header('pybt_hash_queue_pieces', 'gauge', 'Pieces waiting for or being hashed')
+    lines.append(f'pybt_hash_queue_pieces {snap["hash_queue_pieces"]}')
+    header('pybt_connections', 'gauge', 'Connected peers of every torrent')
+    lines.append(f'pybt_connections {snap["connections"]}')
+    header('pybt_event_loop_lag_seconds', 'histogram', 'How late the event loop runs a timer')
+    histogram('pybt_event_loop_lag_seconds', snap['loop_lag'], '')
+
+    torrent_labels = [
+        f'info_hash="{t["info_hash"]}",torrent="{_escape(t["name"])}"' for t in snap['torrents']
+    ]
+
+    for name, kind, help, key in TORRENT_METRICS:
+        header(name, kind, help)
+        for labels, torrent in zip(torrent_labels, snap['torrents']):
+            value = len(torrent['peers']) if key is None else torrent[key]
+            lines.append(f'{name}{{{labels}}} {_number(value)}')
+
+    header('pybt_block_rtt_seconds', 'histogram', 'Time from a block request to the block')
+    for labels, torrent in zip(torrent_labels, snap['torrents']):
+        histogram('pybt_block_rtt_seconds', torrent['block_rtt'], labels)
+
+    for name, kind, help, key in PEER_METRICS:
+        header(name, kind, help)
+        for labels, torrent in zip(torrent_labels, snap['torrents']):
+            for peer in torrent['peers']:
+                lines.append(f'{name}{{{labels},peer="{peer["peer"]}"}} {_number(peer[key])}')
+
+    return '\n'.join(lines) + '\n'
+
+
+def _escape(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _number(value: Any) -> str:
+    if isinstance(value, bool):
+        return str(int(value))
+    if isinstance(value, float):
+        return f'{value:.6g}'
+
+    return str(value)
+
+
+class MetricsServer:
+    """ Serves the metrics of a session over HTTP on localhost, /metrics in
+    Prometheus text format and /metrics.json as the snapshot itself
+    """
+    def __init__(self, session: Session, port: int, host: str = '127.0.0.1'):
+        self._session = session
+        self._port = port
+        self._host = host
+        self._runner: web.AppRunner | None = None
+
+
+    async def start(self):
+        app = web.Application()
+        app.router.add_get('/metrics', self._metrics)
+        app.router.add_get('/metrics.json', self._metrics_json)
+
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, self._host, self._port).start()
+
+
+    async def close(self):
+        if self._runner is not None:
+            await self._runner.cleanup()
+
+
+    async def _metrics(self, request: web.Request) -> web.Response:
+        return web.Response(
+            text=render(snapshot(self._session)),
+            content_type='text/plain',
+            charset='utf-8'
+        )
+
+
+    async def _metrics_json(self, request: web.Request) -> web.Response:
+        return web.json_response(snapshot(self._session))
@@ -0,0 +1,116 @@
+from typing import Any, Dict, List, Sequence
+
+import time
+import asyncio
+
+from bisect import bisect_left
+
+
+class Histogram:
+    """ Counts of observed values by fixed upper bounds, the way Prometheus
+    histograms are exported. Observing is a bisect and two additions
+    """
+    def __init__(self, bounds: Sequence[float]):
+        self.bounds = tuple(bounds)
+        self.counts = [0] * (len(self.bounds) + 1) # the last one is +Inf
+        self.sum = 0.0
+        self.count = 0
+
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+    def quantile(self, q: float) -> float | None:
+        """ Upper bound of the bucket the q quantile falls in, None if nothing
+        was observed (or it is past the last bound)
+        """
+        if not self.count:
+            return None
+
+        rank, seen = q * self.count, 0
+        for bound, count in zip(self.bounds, self.counts):
+            seen += count
+            if seen >= rank:
+                return bound
+
+        return None
+
+
+    def snapshot(self) -> Dict[str, Any]:
+        cumulative, seen = [], 0
+        for count in self.counts:
+            seen += count
+            cumulative.append(seen)
+
+        return {
+            'bounds': list(self.bounds),
+            'cumulative': cumulative,
+            'sum': self.sum,
+            'count': self.count,
+        }
+
+
+class RateMeter:
+    """ Bytes per second over the last WINDOW seconds, counted in one second
+    slots so adding is O(1)
+    """
+    WINDOW = 5
+
+    def __init__(self):
+        self._slots: List[int] = [0] * self.WINDOW
+        self._second = int(time.monotonic())
+
+
+    def add(self, n: int) -> None:
+        now = int(time.monotonic())
+        if now != self._second:
+            self._advance(now)
+        self._slots[now % self.WINDOW] += n
+
+
+    @property
+    def rate(self) -> float:
+        self._advance(int(time.monotonic()))
+        return sum(self._slots) / self.WINDOW
+
+
+    def _advance(self, now: int) -> None:
+        """ Clear the slots of the seconds nothing was added in """
+        if now - self._second >= self.WINDOW:
+            self._slots = [0] * self.WINDOW
+        else:
+            for second in range(self._second + 1, now + 1):
+                self._slots[second % self.WINDOW] = 0
+        self._second = now
+
+
+# seconds, from loopback to slow peers far away
+RTT_BOUNDS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+# seconds the event loop is late by
+LAG_BOUNDS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0)
+
+
+class LoopLagMonitor:
+    """ Measures how late the event loop wakes up a coroutine sleeping for
+    INTERVAL seconds, a loop busy with callbacks delays everything else by
+    as much
+    """
+    INTERVAL = 0.1
+
+    def __init__(self):
+        self.histogram = Histogram(LAG_BOUNDS)
+        self.last = 0.0
+        self.max = 0.0
+
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            started = loop.time()
+            await asyncio.sleep(self.INTERVAL)
+            self.last = max(0.0, loop.time() - started - self.INTERVAL)
+            self.max = max(self.max, self.last)
+            self.histogram.observe(self.last)
@@ -1,2 +1,3 @@
 from .peer import Peer
-from .peer_exceptions import PeerConnectionError
\ No newline at end of file
+from .peer_exceptions import PeerConnectionError
+from .peer_protocol import PeerWireProtocol, InPlaceBlock
\ No newline at end of file
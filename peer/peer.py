@@ -5,11 +5,14 @@ import struct
 import bitarray
 import math
 
+from typing import BinaryIO, List, Tuple
+
 from torrent import TorrentFile
 from client import Client
 from tracker import PeerAddr 
 from torrent_manager import TorrentManager
 from protocol import MessageOP, FormatStrings
+from metrics import RateMeter
 
 from protocol import (
     Handshake,
@@ -17,11 +20,17 @@ from protocol import (
     Unchoke,
     Interested,
     NotInterested,
+    Have,
+    Bitfield,
     Request,
-    Cancel
+    PieceMessage,
+    Cancel,
+    ExtendedHandshake
 )
 
 from .peer_state import PeerState, ChokedNotInterested 
+from .peer_protocol import PeerWireProtocol
+from .request_pipeline import RequestPipeline
 from .peer_exceptions import (
     PeerConnectionError,
     PeerConnectionOpenError,
@@ -39,12 +48,21 @@ class Peer:
         torrent_manager: TorrentManager
     ):
         self.addr = address 
-        self.bitfield = bitarray.bitarray(
-            math.ceil(torrent['info']['length'] / torrent['info']['piece length'])
-        )
+        self.bitfield = bitarray.bitarray(torrent['info'].total_pieces)
+        self.bitfield.setall(0)
 
         self.am_choking = 1
         self.is_interested = 0
+        self.supports_extensions = False
+        self.pipeline = RequestPipeline(torrent_manager.status.block_rtt)
+
+        # bytes received from and sent to the peer, the choker ranks peers by them
+        self.downloaded = 0
+        self.uploaded = 0
+        self.download_rate = RateMeter()
+        self.upload_rate = RateMeter()
+        # (downloaded, uploaded) at the last rechoke, kept by the choker
+        self.choke_snapshot = (0, 0)
 
         self.torrent = torrent 
         self.client  = client
@@ -61,12 +79,10 @@ class Peer:
         torrent: TorrentFile, 
         client: Client, 
         torrent_manager: TorrentManager,
-        reader: asyncio.StreamReader, 
-        writer: asyncio.StreamWriter
+        protocol: PeerWireProtocol
     ):
         p = cls(peer, torrent, client, torrent_manager) 
-        p._conn._reader = reader
-        p._conn._writer = writer
+        p._conn.attach(protocol)
         
         return p
 
@@ -84,23 +100,106 @@ class Peer:
         await self._conn.initialize()
     
 
-    async def handshake(self):
-        """ Handshake peer """
-        await self._conn._handshake()
+    async def accept(self, handshake: bytes):
+        """ Answer the handshake of an incoming connection, already routed to
+        our torrent by its info hash
+        """
+        await self._conn._accept(handshake)
 
 
     def change_state(self, new_state: PeerState):
         self._state = new_state 
 
 
+    def block_buffer(self, index: int, offset: int, length: int) -> memoryview | None:
+        """ Where to receive a block body in place, if we are waiting for it """
+        return self._state.block_buffer(index, offset, length)
+
+
     async def send_message(self, msg: bytes):
         await self._conn._send(msg)
 
 
+    def cancel_request(self, index: int, offset: int, length: int):
+        """ Cancel a block request (someone else delivered it first) """
+        if not self.pipeline.is_requested(index, offset):
+            return
+
+        self.pipeline.cancel(index, offset)
+        self._send_control(Cancel(index, offset, length))
+
+
+    def choke(self):
+        if self.am_choking:
+            return
+
+        self.am_choking = 1
+        self._send_control(Choke())
+
+
+    def unchoke(self):
+        if not self.am_choking:
+            return
+
+        self.am_choking = 0
+        self._send_control(Unchoke())
+
+
+    def block_received(self, length: int, wasted: bool = False):
+        """ Account the payload of a PIECE, wasted if we had no use for it """
+        self.torrent_manager.status.add_received(length, wasted)
+        if not wasted:
+            self.downloaded += length
+            self.download_rate.add(length)
+
+
+    def discard_block(self, index: int, offset: int):
+        """ A block we are receiving in place is no longer wanted there """
+        self._conn._discard_block(index, offset)
+
+
+    def wake(self):
+        """ Re-evaluate interest and requests now, there is new work the peer
+        won't tell us about (a piece failed its hash)
+        """
+        self._conn._nudge()
+
+
+    def send_have(self, index: int):
+        self._send_control(Have(index))
+
+
+    async def upload_block(self, index: int, offset: int, length: int):
+        """ Serve a block REQUEST, ignored if we are choking the peer """
+        if self.am_choking:
+            return
+
+        block = self.torrent_manager.upload_block(index, offset, length)
+        if block is None:
+            return
+
+        header = PieceMessage.header(index, offset, length)
+        if isinstance(block, memoryview):
+            await self._conn._send_block(header, block)
+        else:
+            await self._conn._send_files(header, block)
+        self.uploaded += length
+        self.upload_rate.add(length)
+        self.torrent_manager.status.add_uploaded(length)
+
+
     async def run(self):
         """ Peer event loop """
         print(f'Connected to peer {self.ip}:{self.port}')
+        self.torrent_manager.add_peer(self)
         try:
+            pieces = self.torrent_manager.pieces
+            if pieces.any():
+                await self.send_message(Bitfield(pieces))
+
+            if self.supports_extensions:
+                await self.send_message(ExtendedHandshake(RequestPipeline.MAX_DEPTH))
+
             # iterator returns message op code and payload
             async for op_code, payload in PeerMessageStreamIter(self._conn):
                 if self.torrent_manager.end.is_set():
@@ -108,6 +207,10 @@ class Peer:
 
                 await self._state.handle_message(op_code, payload)
                 await self._state.do_work()
+
+                # neither of us has anything to give
+                if self.torrent_manager.seeding and self.bitfield.all():
+                    return
             
         
         except PeerConnectionError as e:
@@ -120,54 +223,73 @@ class Peer:
     
 
     async def end(self):
+        self._state.release_pieces()
+
+        # peer no longer counts towards piece availability
+        self.torrent_manager.peer_gone(self.bitfield)
+        self.bitfield.setall(0)
+        self.torrent_manager.remove_peer(self)
+
+        await self._conn.close()
+
+
+    def _send_control(self, msg: bytes):
+        """ Send a small message from outside the peer loop """
         try:
-            if self._state._scheduled_piece is not None:
-                self.torrent_manager.put_pieces(self._state._scheduled_piece)
-        except AttributeError:
+            self._conn._send_nowait(msg)
+        except PeerConnectionError:
             pass
-        await self._conn.close()
 
 
     def __hash__(self):
-        return self.addr.__hash__()
+        # the same peer may be connected to us for several torrents
+        return hash((self.addr, self.torrent.info_hash))
     
 
     def __eq__(self, obj):
-        if not isinstance(obj, Peer) and not isinstance(obj, PeerAddr):
-            return False
-        
-        return obj == self.addr
+        if isinstance(obj, Peer):
+            return obj.addr == self.addr and obj.torrent.info_hash == self.torrent.info_hash
+
+        if isinstance(obj, PeerAddr):
+            return obj == self.addr
+
+        return False
 
 
 class PeerConnection:
-    """ Wrapper to asyncio.reader and writer wrappers """
+    """ Wrapper to the PeerWireProtocol transport """
     def __init__(self, ctx: Peer):
         self._ctx = ctx
-        self._reader = None
-        self._writer = None
+        self._protocol: PeerWireProtocol | None = None
 
 
     async def initialize(self) -> None:
         """ Open connection to peer and complete handshake """
-        self._reader, self._writer = await self._open_conn()
+        self._protocol = await self._open_conn()
+        self._protocol.block_sink = self._ctx.block_buffer
         await self._handshake()
 
 
+    def attach(self, protocol: PeerWireProtocol) -> None:
+        """ Use an already open connection (incoming connections) """
+        self._protocol = protocol
+        self._protocol.block_sink = self._ctx.block_buffer
+
+
     async def close(self):
-        if self._writer:
-            self._writer.close()
-            try:
-                await self._writer.wait_closed()
-            except:
-                pass
+        if self._protocol:
+            self._protocol.close()
 
 
-    async def _open_conn(self):
-        """ Opens connection to peer, returning StreamReader and StreamWritter instances """
-        open_conn_task = asyncio.open_connection(host=self._ctx.ip, port=self._ctx.port)
+    async def _open_conn(self) -> PeerWireProtocol:
+        """ Opens connection to peer, returning the connection PeerWireProtocol """
+        loop = asyncio.get_running_loop()
+        open_conn_task = loop.create_connection(
+            PeerWireProtocol, host=self._ctx.ip, port=self._ctx.port
+        )
 
         try:
-            reader, writer = await asyncio.wait_for(
+            _, protocol = await asyncio.wait_for(
                 open_conn_task,
                 timeout=5.0
             ) 
@@ -176,45 +298,82 @@ class PeerConnection:
         except ConnectionRefusedError:
             raise PeerConnectionOpenError(f'Connection refused from {self._ctx.ip}:{self._ctx.port}')
         except Exception as e:
-            raise PeerConnectionOpenError(f'Failed connecting to peer {self._ctx.ip}:{ßelf._ctx.port}')
+            raise PeerConnectionOpenError(f'Failed connecting to peer {self._ctx.ip}:{self._ctx.port}')
         
-        return reader, writer 
+        return protocol
     
 
     async def _handshake(self):
         await self._send(Handshake(self._ctx.client.id, self._ctx.torrent.info_hash))
 
-        response = await self._recv(struct.calcsize(FormatStrings.HANDSHAKE))
+        try:
+            response = await asyncio.wait_for(self._protocol.read_handshake(), timeout=20.0)
+        except TimeoutError:
+            raise PeerConnectionReadError(f'Timed out peer {self._ctx.ip}:{self._ctx.port}')
 
         info_hash, client_id = Handshake.decode(response)
         if info_hash != self._ctx.torrent.info_hash:
             raise PeerConnectionHandshakeError(f'Bad handshake from peer {self._ctx.ip}:{self._ctx.port}') 
-    
 
-    async def _send(self, msg: str):
-        """ Write to StreamWriter """
-        self._writer.write(msg)
-        await self._writer.drain()
+        self._ctx.supports_extensions = Handshake.supports_extensions(response)
+
+
+    async def _accept(self, handshake: bytes):
+        self._ctx.supports_extensions = Handshake.supports_extensions(handshake)
+        await self._send(Handshake(self._ctx.client.id, self._ctx.torrent.info_hash))
     
-        
-    async def _recv(self, size: int):
-        """ Read from stream """
-        read_task = self._reader.read(size)
 
+    async def _send(self, msg: bytes):
+        """ Write to transport """
+        self._protocol.write(msg)
+        await self._protocol.drain()
+
+
+    def _discard_block(self, index: int, offset: int):
+        if self._protocol:
+            self._protocol.discard_block(index, offset)
+
+
+    def _nudge(self):
+        if self._protocol:
+            self._protocol.nudge()
+
+
+    def _send_nowait(self, msg: bytes):
+        """ Write to transport without waiting for it to drain (small messages) """
+        self._protocol.write(msg)
+
+
+    async def _send_block(self, header: bytes, block: memoryview):
+        """ Write a PIECE message, the block goes out without being copied into
+        the message first
+        """
+        self._protocol.write(header)
+        self._protocol.write(block)
+        await self._protocol.drain()
+
+
+    async def _send_files(self, header: bytes, files: List[Tuple[BinaryIO, int, int]]):
+        """ Write a PIECE message with the block sent straight from the files """
         try:
-            data = await asyncio.wait_for(read_task, timeout=20.0)
-        except TimeoutError:
-            raise PeerConnectionReadError(f'Timed out peer {self._ctx.ip}:{self._ctx.port}')
-        except ConnectionResetError:
-            raise PeerConnectionReadError(f'Connection closed from peer {self._ctx.ip}:{self._ctx.port}')
-        except Exception as e:
-            raise PeerConnectionReadError(repr(e))
+            self._protocol.write(header)
+            for file, offset, length in files:
+                await self._protocol.sendfile(file, offset, length)
+        finally:
+            for file, _, _ in files:
+                file.close()
+    
         
-        return data 
+    async def _recv(self) -> Tuple[int, memoryview | None] | None:
+        """ Read next message from the transport """
+        try:
+            return await self._protocol.read_message()
+        except PeerConnectionError as e:
+            raise PeerConnectionReadError(f'{e} ({self._ctx.ip}:{self._ctx.port})')
 
 
 class PeerMessageStreamIter:
-    """ Asyncio.StreamReader Iterator """
+    """ PeerWireProtocol message iterator """
     def __init__(self, ctx: PeerConnection):
         self._ctx = ctx
 
@@ -223,31 +382,12 @@ class PeerMessageStreamIter:
         return self 
 
 
-    async def __anext__(self) -> Tuple[int, bytes]:
-        """ Returns the message code and payload """
-
-        # first 4B in messages indicate the length of the message
-        msg_length = await self._ctx._recv(struct.calcsize(">I"))
+    async def __anext__(self) -> Tuple[int, memoryview | None]:
+        """ Returns the message code and payload (valid until the next message) """
+        message = await self._ctx._recv()
 
         # connection was closed    
-        if msg_length == b'':
+        if message is None:
             raise StopAsyncIteration
 
-        msg_length = struct.unpack('>I', msg_length)[0]
-
-        # keep alive messages identified with <len = 0>
-        if msg_length == 0:
-            return MessageOP.KEEP_ALIVE, None
-
-        # read entire message from stream
-        message = b''
-        while msg_length > 0:
-            buff = await self._ctx._recv(msg_length)
-            message += buff
-            msg_length -= len(buff)
-        
-        op_code: int = message[0]
-        payload: bytes = message[1:]
-
-        return op_code, payload
-
+        return message
@@ -12,3 +12,7 @@ class PeerConnectionReadError(PeerConnectionError):
 
 class PeerConnectionHandshakeError(PeerConnectionError):
     """ Error when we fail to open a connection to the peer """
+
+
+class PeerConnectionWriteError(PeerConnectionError):
+    """ Error when sending data to peer """
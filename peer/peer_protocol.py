@@ -0,0 +1,417 @@
+from __future__ import annotations
+
+from typing import BinaryIO, Callable, Deque, List, Optional, Tuple
+
+import asyncio
+import struct
+
+from collections import deque
+
+from protocol import MessageOP, FormatStrings
+
+from .peer_exceptions import (
+    PeerConnectionError,
+    PeerConnectionReadError,
+    PeerConnectionWriteError
+)
+
+
+# called with (piece index, block offset, block length), returns the memoryview
+# the block body should be received into or None if the block isn't expected
+BlockSink = Callable[[int, int, int], Optional[memoryview]]
+
+
+class InPlaceBlock(bytes):
+    """ Payload of a PIECE whose body was received in place, the 8 byte index
+    and offset header, dst the view the body was received into and length its
+    size. A PIECE with an empty body is a plain payload, not one of these
+    """
+    def __new__(cls, header: bytes, dst: memoryview):
+        block = super().__new__(cls, header)
+        block.dst = dst
+        block.length = len(dst)
+        return block
+
+
+class PeerWireProtocol(asyncio.BufferedProtocol):
+    """ Peer wire transport that parses frames straight out of a reusable receive
+    buffer
+
+    Messages are handed to the consumer as memoryviews into the receive buffer,
+    a view is only valid until the consumer asks for the next message. PIECE
+    bodies are received directly into the memoryview returned by `block_sink`,
+    in which case the message payload is an InPlaceBlock. `discard_block` sends
+    the rest of such a body to a scratch buffer, the PIECE is then handed over
+    as a plain payload
+
+    Blocks we upload can be sent with `sendfile`, straight from the page cache
+    to the socket
+    """
+    RECV_BUFFER_SIZE = 256 * 1024
+    MAX_MESSAGE_SIZE = 8 * 1024 * 1024
+    MIN_FREE_SPACE = 32 * 1024 # always offer at least this much to the socket
+    MAX_QUEUED_MESSAGES = 64 # stop reading when the consumer lags behind
+
+    HANDSHAKE_SIZE = struct.calcsize(FormatStrings.HANDSHAKE)
+
+    def __init__(
+        self,
+        timeout: float = 20.0,
+        connected_cb: Callable[[PeerWireProtocol], None] | None = None
+    ):
+        self.block_sink: BlockSink | None = None
+
+        self._timeout = timeout
+        self._connected_cb = connected_cb
+        self._loop = asyncio.get_running_loop()
+        self._transport: asyncio.Transport | None = None
+
+        self._buf = bytearray(self.RECV_BUFFER_SIZE)
+        self._view = memoryview(self._buf)
+        self._start = 0 # first unparsed byte
+        self._end = 0 # end of received data
+
+        # in place PIECE body being received
+        self._block_dst: memoryview | None = None
+        self._block_got = 0
+        self._block_header = b''
+        # header and body of a discarded in place PIECE, _block_dst is its body
+        self._block_scratch: bytearray | None = None
+
+        self._handshake = self._loop.create_future()
+        self._messages: Deque[Tuple[int, memoryview | InPlaceBlock | None]] = deque()
+        self._in_use = False # consumer holds a view from the last message
+        self._waiter: asyncio.Future | None = None
+        self._exc: Exception | None = None
+        self._eof = False
+        self._paused = False
+
+        self._drain_waiter: asyncio.Future | None = None
+        self._write_paused = False
+        # writes made while a sendfile is in progress, None if there is none
+        self._sendfile_queue: List[bytes] | None = None
+
+        self._last_recv = self._loop.time()
+        self._timeout_handle: asyncio.TimerHandle | None = None
+
+
+    @property
+    def peername(self) -> Tuple[str, int]:
+        return self._transport.get_extra_info('peername')[:2]
+
+
+    #--------------------****------------------#
+    #             asyncio callbacks            #
+    #--------------------****------------------#
+    def connection_made(self, transport: asyncio.Transport):
+        self._transport = transport
+        self._last_recv = self._loop.time()
+        self._timeout_handle = self._loop.call_later(self._timeout, self._check_timeout)
+
+        if self._connected_cb is not None:
+            self._connected_cb(self)
+
+
+    def connection_lost(self, exc: Exception | None):
+        if self._timeout_handle is not None:
+            self._timeout_handle.cancel()
+
+        if exc is not None:
+            self._set_exception(PeerConnectionReadError(f'Connection closed from peer {exc!r}'))
+        else:
+            self._eof = True
+            self._fail_handshake(PeerConnectionReadError('Connection closed before handshake'))
+            self._wakeup()
+
+        # unblock writers
+        if self._drain_waiter is not None and not self._drain_waiter.done():
+            self._drain_waiter.set_exception(PeerConnectionWriteError('Connection closed'))
+
+
+    def pause_writing(self):
+        self._write_paused = True
+
+
+    def resume_writing(self):
+        self._write_paused = False
+        if self._drain_waiter is not None and not self._drain_waiter.done():
+            self._drain_waiter.set_result(None)
+
+
+    def get_buffer(self, sizehint: int) -> memoryview:
+        if self._block_dst is not None:
+            return self._block_dst[self._block_got:]
+
+        if len(self._buf) - self._end < self.MIN_FREE_SPACE:
+            self._make_room(self.MIN_FREE_SPACE)
+
+        return self._view[self._end:]
+
+
+    def buffer_updated(self, nbytes: int):
+        self._last_recv = self._loop.time()
+
+        if self._block_dst is not None:
+            self._block_got += nbytes
+            if self._block_got == len(self._block_dst):
+                if self._block_scratch is not None:
+                    self._push(MessageOP.PIECE, memoryview(self._block_scratch))
+                    self._block_scratch = None
+                else:
+                    self._push(MessageOP.PIECE, InPlaceBlock(self._block_header, self._block_dst))
+                self._block_dst = None
+            return
+
+        self._end += nbytes
+        try:
+            self._parse()
+        except PeerConnectionError as e:
+            self._set_exception(e)
+            self._transport.abort()
+
+
+    def eof_received(self):
+        # let the transport close itself
+        return False
+
+
+    #--------------------****------------------#
+    #               Consumer API               #
+    #--------------------****------------------#
+    async def read_handshake(self) -> bytes:
+        """ Wait for the peer handshake """
+        return await self._handshake
+
+
+    async def read_message(self) -> Tuple[int, memoryview | None] | None:
+        """ Returns the next message op code and payload, None when the peer
+        closed the connection
+        """
+        # the consumer is done with the previous view
+        self._in_use = False
+
+        while not self._messages:
+            if self._exc is not None:
+                raise self._exc
+            if self._eof:
+                return None
+
+            if self._start == self._end and self._block_dst is None:
+                self._start = self._end = 0
+
+            self._waiter = self._loop.create_future()
+            try:
+                await self._waiter
+            finally:
+                self._waiter = None
+
+        msg = self._messages.popleft()
+        self._in_use = True
+
+        if self._paused and len(self._messages) < self.MAX_QUEUED_MESSAGES // 2:
+            self._paused = False
+            self._transport.resume_reading()
+
+        return msg
+
+
+    def discard_block(self, index: int, offset: int) -> None:
+        """ Stop receiving the body of that block in place if it is being
+        received, what is left goes to a scratch buffer along with what was
+        already received and the PIECE is handed over as a plain payload
+        """
+        if self._block_dst is None or self._block_scratch is not None:
+            return
+        if self._block_header != struct.pack('>II', index, offset):
+            return
+
+        scratch = bytearray(8 + len(self._block_dst))
+        scratch[:8] = self._block_header
+        scratch[8: 8 + self._block_got] = self._block_dst[:self._block_got]
+        self._block_scratch = scratch
+        self._block_dst = memoryview(scratch)[8:]
+
+
+    def nudge(self) -> None:
+        """ Hand the consumer a keep alive so it looks for work again without
+        waiting for the peer to send something
+        """
+        if not self._messages:
+            self._push(MessageOP.KEEP_ALIVE, None)
+
+
+    def write(self, data: bytes) -> None:
+        if self._transport is None or self._transport.is_closing():
+            raise PeerConnectionWriteError('Connection closed')
+
+        # the transport refuses writes until sendfile is done
+        if self._sendfile_queue is not None:
+            self._sendfile_queue.append(bytes(data))
+            return
+
+        self._transport.write(data)
+
+
+    async def sendfile(self, file: BinaryIO, offset: int, count: int) -> None:
+        """ Send count bytes of file at offset, with os.sendfile when the
+        transport supports it (asyncio falls back to reading the file otherwise)
+        """
+        if self._transport is None or self._transport.is_closing():
+            raise PeerConnectionWriteError('Connection closed')
+
+        self._sendfile_queue = []
+        try:
+            await self._loop.sendfile(self._transport, file, offset, count)
+        except (OSError, RuntimeError) as e:
+            raise PeerConnectionWriteError(f'Failed sending file {e!r}')
+        finally:
+            queued, self._sendfile_queue = self._sendfile_queue, None
+            if queued and not self._transport.is_closing():
+                self._transport.writelines(queued)
+
+
+    async def drain(self) -> None:
+        if self._exc is not None:
+            raise self._exc
+
+        if not self._write_paused:
+            return
+
+        self._drain_waiter = self._loop.create_future()
+        try:
+            await self._drain_waiter
+        finally:
+            self._drain_waiter = None
+
+
+    def close(self) -> None:
+        if self._transport is not None and not self._transport.is_closing():
+            self._transport.close()
+
+
+    #--------------------****------------------#
+    #                 Framing                  #
+    #--------------------****------------------#
+    def _parse(self):
+        buf, view = self._buf, self._view
+
+        if not self._handshake.done():
+            if self._end - self._start < self.HANDSHAKE_SIZE:
+                return
+            self._handshake.set_result(bytes(view[self._start:self._start + self.HANDSHAKE_SIZE]))
+            self._start += self.HANDSHAKE_SIZE
+
+        while True:
+            avail = self._end - self._start
+            if avail < 4:
+                break
+
+            start = self._start
+            (msg_length,) = struct.unpack_from('>I', buf, start)
+
+            # keep alive messages identified with <len = 0>
+            if msg_length == 0:
+                self._push(MessageOP.KEEP_ALIVE, None)
+                self._start += 4
+                continue
+
+            if msg_length > self.MAX_MESSAGE_SIZE:
+                raise PeerConnectionReadError(f'Message too big ({msg_length}B)')
+
+            # PIECE body goes straight to its destination
+            if (
+                self.block_sink is not None
+                and avail >= 13
+                and buf[start + 4] == MessageOP.PIECE
+                and msg_length > 9
+            ):
+                idx, offset = struct.unpack_from('>II', buf, start + 5)
+                block_len = msg_length - 9
+                dst = self.block_sink(idx, offset, block_len)
+                if dst is not None:
+                    header = bytes(view[start + 5: start + 13])
+                    got = min(avail - 13, block_len)
+                    dst[:got] = view[start + 13: start + 13 + got]
+                    self._start += 13 + got
+
+                    if got == block_len:
+                        self._push(MessageOP.PIECE, InPlaceBlock(header, dst))
+                        continue
+
+                    # rest of the body is received in place
+                    self._block_dst = dst
+                    self._block_got = got
+                    self._block_header = header
+                    break
+
+            if avail < 4 + msg_length:
+                if len(buf) - start < 4 + msg_length:
+                    self._make_room(4 + msg_length - avail)
+                break
+
+            self._push(buf[start + 4], view[start + 5: start + 4 + msg_length])
+            self._start += 4 + msg_length
+
+
+    def _make_room(self, needed: int):
+        """ Make sure there are at least `needed` free bytes after the received data """
+        pending = self._end - self._start
+
+        # we can reuse the buffer in place if no one holds a view into it
+        if not self._messages and not self._in_use and pending + needed <= len(self._buf):
+            self._buf[:pending] = self._buf[self._start:self._end]
+        else:
+            # views handed out keep the old buffer alive
+            size = max(self.RECV_BUFFER_SIZE, pending + needed)
+            new_buf = bytearray(size)
+            new_buf[:pending] = self._view[self._start:self._end]
+            self._buf = new_buf
+            self._view = memoryview(new_buf)
+
+        self._start, self._end = 0, pending
+
+
+    #--------------------****------------------#
+    #                 Helpers                  #
+    #--------------------****------------------#
+    def _push(self, op_code: int, payload: memoryview | InPlaceBlock | None):
+        self._messages.append((op_code, payload))
+
+        if not self._paused and len(self._messages) >= self.MAX_QUEUED_MESSAGES:
+            self._paused = True
+            self._transport.pause_reading()
+
+        self._wakeup()
+
+
+    def _wakeup(self):
+        if self._waiter is not None and not self._waiter.done():
+            self._waiter.set_result(None)
+
+
+    def _set_exception(self, exc: Exception):
+        self._exc = exc
+        self._fail_handshake(exc)
+        self._wakeup()
+
+
+    def _fail_handshake(self, exc: Exception):
+        if not self._handshake.done():
+            self._handshake.set_exception(exc)
+            # we may never await the handshake
+            self._handshake.exception()
+
+
+    def _check_timeout(self):
+        """ Abort connection when nothing is received for a while (instead of a
+        wait_for per read)
+        """
+        idle = self._loop.time() - self._last_recv
+        if idle >= self._timeout and not self._paused:
+            self._set_exception(PeerConnectionReadError('Timed out'))
+            self._transport.abort()
+            return
+
+        self._timeout_handle = self._loop.call_later(
+            max(self._timeout - idle, 1.0), self._check_timeout
+        )
@@ -1,11 +1,13 @@
-from typing import Protocol
+from __future__ import annotations
 
+from typing import Protocol, Dict, Set
+
+import math
 import bitarray
 import asyncio
 
-from hashlib import sha1
-
 from torrent import InfoDict
+from torrent_manager.piece_download import PieceDownload
 from protocol import MessageOP 
 from protocol import (
     Handshake,
@@ -16,9 +18,13 @@ from protocol import (
     Have,
     Request,
     PieceMessage,
-    Cancel
+    Cancel,
+    ExtendedHandshake
 )
 
+from .peer_exceptions import PeerConnectionError
+from .peer_protocol import InPlaceBlock
+
 
 
 
@@ -36,7 +42,19 @@ class PeerState:
         raise NotImplementedError
 
 
-    async def handle_message(self, op_code: str, payload: bytes):
+    def block_buffer(self, index: int, offset: int, length: int) -> memoryview | None:
+        """ Buffer a PIECE block body can be received into, None if we aren't 
+        waiting for it
+        """
+        return None
+
+
+    def release_pieces(self):
+        """ Give back the pieces scheduled to this peer """
+        pass
+
+
+    async def handle_message(self, op_code: int, payload: memoryview | None):
         match op_code:
             case MessageOP.KEEP_ALIVE:
                 pass # simply resets timeout counter
@@ -52,46 +70,75 @@ class PeerState:
                 self.handle_have(payload)
             case MessageOP.BITFIELD:
                 self.handle_bitfield(payload)
+            case MessageOP.REQUEST:
+                await self.handle_request(payload)
             case MessageOP.PIECE:
                 await self.handle_piece(payload)
             case MessageOP.CANCEL:
                 self.handle_cancel(payload)
+            case MessageOP.EXTENDED:
+                self.handle_extended(payload)
             case default:
                 pass
     
 
     def handle_interested(self):
-        pass
+        self._ctx.is_interested = 1
+        self._ctx.torrent_manager.choker.peer_interested(self._ctx)
 
 
     def handle_not_interested(self):
-        pass
+        self._ctx.is_interested = 0
+
 
+    def handle_have(self, payload: memoryview):
+        idx = Have.decode(payload)
+        if idx >= len(self._ctx.bitfield) or self._ctx.bitfield[idx]:
+            return
 
-    def handle_have(self, payload: int):
-        try:
-            self._ctx.bitfield[payload] = 1
-        except IndexError:
-            pass
+        self._ctx.bitfield[idx] = 1
+        self._ctx.torrent_manager.peer_has(idx)
 
 
-    def handle_bitfield(self, payload: bytes):
-        if (len(payload) * 8) != len(self._ctx.bitfield):
+    def handle_bitfield(self, payload: memoryview):
+        total_pieces = len(self._ctx.bitfield)
+        if len(payload) != math.ceil(total_pieces / 8):
             raise PeerConnectionError("Invalid Bitfield received, connection dropped")
 
         new_bitfield = bitarray.bitarray()
+        new_bitfield.frombytes(payload)
+        # drop spare bits
+        del new_bitfield[total_pieces:]
+
+        self._ctx.torrent_manager.peer_gone(self._ctx.bitfield)
         self._ctx.bitfield = new_bitfield
-        self._ctx.bitfield.frombytes(payload)
+        self._ctx.torrent_manager.peer_bitfield(new_bitfield)
 
 
-    def handle_piece(self, payload: bytes):
-        pass
+    async def handle_request(self, payload: memoryview):
+        index, offset, length = Request.decode(payload)
+        await self._ctx.upload_block(index, offset, length)
+
+
+    async def handle_piece(self, payload: memoryview):
+        # we didn't ask for it (or not anymore)
+        size = payload.length if isinstance(payload, InPlaceBlock) else max(len(payload) - 8, 0)
+        self._ctx.block_received(size, wasted=True)
         
 
-    def handle_cancel(self, payload: bytes):
+    def handle_cancel(self, payload: memoryview):
         pass
 
 
+    def handle_extended(self, payload: memoryview):
+        handshake = ExtendedHandshake.decode(payload)
+        if handshake is None:
+            return
+
+        if isinstance(handshake.get('reqq'), int):
+            self._ctx.pipeline.set_reqq(handshake['reqq'])
+
+
 class ChokedNotInterested(PeerState):
     def change_state(self, state):
         if state == 'interested':
@@ -101,9 +148,7 @@ class ChokedNotInterested(PeerState):
     
     async def do_work(self):
         # check if we have interest
-        piece = self._ctx.torrent_manager.get_pieces(self._ctx.bitfield)
-        if piece is not None:
-            self._ctx.torrent_manager.put_pieces(piece)
+        if self._ctx.torrent_manager.has_interest(self._ctx.bitfield):
             self.change_state('interested')
             await self._ctx.send_message(Interested())
         
@@ -129,9 +174,7 @@ class UnchokedNotInterested(PeerState):
     
     async def do_work(self):
         # check if we have interest
-        piece = self._ctx.torrent_manager.get_pieces(self._ctx.bitfield)
-        if piece:
-            self._ctx.torrent_manager.put_pieces(piece)
+        if self._ctx.torrent_manager.has_interest(self._ctx.bitfield):
             self.change_state('interested')
             # do the work right after we change our internal state
             await self._ctx.send_message(Interested())
@@ -141,106 +184,141 @@ class UnchokedNotInterested(PeerState):
 class UnchokedInterested(PeerState):
     def __init__(self, ctx):
         super().__init__(ctx)
-        self._scheduled_piece = None
-        self._piece_handler = None
+        # pieces we requested blocks of from this peer
+        self._downloads: Dict[int, PieceDownload] = {}
 
 
     def change_state(self, state):
         if state == 'not interested':
             self._ctx.change_state(UnchokedNotInterested(self._ctx))
         elif state == 'choked':
+            # peer discards our outstanding requests when choking
+            self._ctx.pipeline.reset()
+            self.release_pieces()
             self._ctx.change_state(ChokedInterested(self._ctx))
 
 
     async def do_work(self):
-        # if we are already waiting for pieces
-        if self._scheduled_piece is not None:
-            return
-
-        # get piece to request to peer
-        self._scheduled_piece = self._ctx.torrent_manager.get_pieces(self._ctx.bitfield)
-        # print(f"Got piece {self._scheduled_piece}")
-        if self._scheduled_piece is None:
+        pipeline = self._ctx.pipeline
+        expired = pipeline.timed_out()
+        if expired:
+            # the peer may still send them, tell it not to bother
+            info = self._ctx.torrent['info']
+            for idx, offset in expired:
+                length = min(PieceDownload.BLOCK_SIZE, info.get_piece_length(idx) - offset)
+                self._ctx.cancel_request(idx, offset, length)
+            self._drop_pieces({idx for idx, _ in expired})
+
+        endgame = self._ctx.torrent_manager.endgame
+        while pipeline.can_request():
+            download = self._next_download(endgame)
+            if download is None:
+                break
+
+            await self._request_blocks(download, endgame)
+
+        # stay interested while there is something we could ask later, like
+        # UnchokedNotInterested would become again
+        if not self._downloads and not self._ctx.torrent_manager.has_interest(self._ctx.bitfield):
             self.change_state('not interested')
-            return
-        
-        # enqueue block requests
-        self._piece_handler = PieceHandler(self._ctx, self._scheduled_piece, self._ctx.torrent['info'])
-        await self._piece_handler.enqueue_requests()
-    
+            await self._ctx.send_message(NotInterested())
 
-    async def handle_piece(self, payload):
-        # we are not waiting for pieces
-        if self._scheduled_piece is None:
-            return
-        
-        await self._piece_handler.receive_block(payload)
-    
 
-    def _reset(self):
-        self._scheduled_piece = None
-        self._piece_handler = None
-        
+    def release_pieces(self):
+        for download in self._downloads.values():
+            self._ctx.torrent_manager.release(download, self._ctx)
+        self._downloads.clear()
 
-class PieceHandler:
-    BLOCK_SIZE = 16384 # 16 KiB
 
-    def __init__(self, ctx, piece_nr: int, meta_info: InfoDict):
-        self._ctx = ctx
+    def _drop_pieces(self, pieces: Set[int]):
+        """ Stop downloading pieces whose requests timed out, the blocks left
+        are released for other peers to request
+        """
+        for idx in pieces:
+            download = self._downloads.pop(idx, None)
+            if download is None:
+                continue
 
-        self._piece_nr = piece_nr
-        self._buff = bytearray(meta_info['piece length'])
-        self._retr_offset = 0
-        self._hash = meta_info.get_hash(piece_nr)
+            for offset in range(0, download.length, PieceDownload.BLOCK_SIZE):
+                self._ctx.cancel_request(idx, offset, download.block_length(offset))
+            self._ctx.torrent_manager.release(download, self._ctx)
 
-        self._piece_len = meta_info['piece length']
-        self._total_blocks = meta_info['piece length'] / self.BLOCK_SIZE
-        self._retr_blocks = 0
-        self._enqueued = 0
-        
 
-    async def enqueue_requests(self):
-        """ Enqueue block requests for a piece """
-        offset = self._retr_offset 
-        for _ in range(5): # enqueue 5 requests
-            # if all blocks are requested
-            if offset >= self._piece_len:
-                return
+    def block_buffer(self, index: int, offset: int, length: int) -> memoryview | None:
+        download = self._downloads.get(index)
+        if download is None:
+            return None
 
-            await self._ctx.send_message(Request(self._piece_nr, offset, self.BLOCK_SIZE))
-            self._enqueued += 1
-            offset += self.BLOCK_SIZE
+        return download.block_buffer(offset, length, self._ctx)
+    
 
-   
-    async def receive_block(self, payload):
+    async def handle_piece(self, payload):
         idx, offset, data = PieceMessage.decode(payload)
-
-        if idx != self._piece_nr:
+        in_place = isinstance(payload, InPlaceBlock)
+        if in_place:
+            data = payload.dst
+        size = len(data)
+
+        download = self._downloads.get(idx)
+        # we are not waiting for this piece
+        if download is None:
+            self._ctx.block_received(size, wasted=True)
             return
-        
-        self._buff[offset: offset + self.BLOCK_SIZE] = data
 
-        self._retr_blocks += 1
-        if self._retr_blocks == self._total_blocks:
-            self.save_piece()
-            await asyncio.sleep(.1)
+        others = download.receive_block(offset, data, self._ctx, in_place)
+        if others is None:
+            self._ctx.block_received(size, wasted=True)
             return
 
-        self._retr_offset += self.BLOCK_SIZE
-        self._enqueued -= 1
+        length = download.block_length(offset)
+        self._ctx.pipeline.received(idx, offset, length)
+        self._ctx.block_received(length)
+        # endgame duplicates
+        for peer in others:
+            peer.cancel_request(idx, offset, length)
 
-        if self._enqueued == 0:
-            await self.enqueue_requests()
-            
+        if download.is_complete():
+            del self._downloads[idx]
+            await self._ctx.torrent_manager.finish_piece(download)
 
-    def save_piece(self):
-        self._ctx._state._reset()
 
-        if sha1(self._buff).digest() != self._hash:
-            self._ctx.torrent_manager.put_pieces(self._piece_nr)
-            return
+    def _next_download(self, endgame: bool) -> PieceDownload | None:
+        """ Piece with blocks left to request, scheduling a new one if needed """
+        for idx, download in list(self._downloads.items()):
+            if download.done:
+                del self._downloads[idx]
+            elif download.next_block(self._ctx, endgame) is not None:
+                return download
 
-        self._ctx.torrent_manager.save_piece(self._piece_nr, self._buff)
+        if len(self._downloads) >= self._max_pieces():
+            return None
+
+        download = self._ctx.torrent_manager.schedule(self._ctx.bitfield, self._downloads)
+        if download is None:
+            return None
+
+        self._downloads[download.piece_nr] = download
+        return download
+
+
+    async def _request_blocks(self, download: PieceDownload, endgame: bool):
+        """ Fill the request pipeline with blocks of a piece """
+        pipeline = self._ctx.pipeline
+        while pipeline.can_request():
+            offset = download.next_block(self._ctx, endgame)
+            if offset is None:
+                return
 
+            download.block_requested(offset, self._ctx)
+            pipeline.sent(download.piece_nr, offset)
+            await self._ctx.send_message(
+                Request(download.piece_nr, offset, download.block_length(offset))
+            )
 
 
+    def _max_pieces(self) -> int:
+        """ Pieces in flight, enough to fill the request pipeline (which follows
+        the peer download rate) plus one
+        """
+        piece_len = self._ctx.torrent['info']['piece length']
+        return math.ceil(self._ctx.pipeline.depth * PieceDownload.BLOCK_SIZE / piece_len) + 1
@@ -0,0 +1,134 @@
+from typing import Dict, List, Tuple
+
+import math
+import time
+
+from metrics import Histogram
+
+
+class RequestPipeline:
+    """ Per peer block request queue
+
+    Keeps track of the requests sent to a peer and how many of them should be
+    outstanding at once. The depth follows the measured download rate times the
+    base round trip time (with some headroom so it can keep growing while the
+    pipe is the bottleneck) and never exceeds the `reqq` the peer advertised.
+
+    Every round trip sample also goes to `rtt_histogram` when there is one.
+
+    Requests a peer leaves unanswered for REQUEST_TIMEOUT seconds are reported
+    by timed_out for the caller to cancel (the peer is snubbing us) and the
+    depth falls back to MIN_DEPTH.
+    """
+    BLOCK_SIZE = 16384 # 16 KiB
+    MIN_DEPTH = 4
+    MAX_DEPTH = 500
+    DEFAULT_REQQ = 250 # libtorrent default, used when the peer doesn't tell
+    RATE_WINDOW = 0.5 # seconds between depth updates
+    HEADROOM = 2.0 # keep this many bandwidth delay products requested
+    REQUEST_TIMEOUT = 30.0 # seconds
+
+    def __init__(self, rtt_histogram: Histogram | None = None):
+        self.depth = self.MIN_DEPTH
+        self.max_depth = self.DEFAULT_REQQ
+        self.rate = 0.0 # bytes/s
+
+        self._sent: Dict[Tuple[int, int], float] = {} # (index, offset) -> time sent
+        self._base_rtt: float | None = None
+        self._rtt_histogram = rtt_histogram
+
+        self._window_start = time.monotonic()
+        self._window_bytes = 0
+
+
+    @property
+    def outstanding(self) -> int:
+        return len(self._sent)
+
+
+    @property
+    def rtt(self) -> float | None:
+        return self._base_rtt
+
+
+    def set_reqq(self, reqq: int) -> None:
+        """ Honour the max number of outstanding requests advertised by the peer """
+        self.max_depth = max(1, min(reqq, self.MAX_DEPTH))
+        self.depth = min(self.depth, self.max_depth)
+
+
+    def can_request(self) -> bool:
+        return len(self._sent) < self.depth
+
+
+    def is_requested(self, index: int, offset: int) -> bool:
+        return (index, offset) in self._sent
+
+
+    def sent(self, index: int, offset: int) -> None:
+        # a request sent again goes to the end, timed_out relies on send order
+        self._sent.pop((index, offset), None)
+        self._sent[(index, offset)] = time.monotonic()
+
+
+    def received(self, index: int, offset: int, length: int) -> bool:
+        """ Account a received block, returns False if we didn't request it """
+        sent_at = self._sent.pop((index, offset), None)
+        if sent_at is None:
+            return False
+
+        now = time.monotonic()
+        sample = now - sent_at
+        if self._rtt_histogram is not None:
+            self._rtt_histogram.observe(sample)
+        if self._base_rtt is None or sample < self._base_rtt:
+            self._base_rtt = sample
+
+        self._window_bytes += length
+        if now - self._window_start >= self.RATE_WINDOW:
+            self._update(now)
+
+        return True
+
+
+    def timed_out(self) -> List[Tuple[int, int]]:
+        """ (index, offset) of the requests outstanding for too long, they
+        stay outstanding until cancelled
+        """
+        deadline = time.monotonic() - self.REQUEST_TIMEOUT
+        expired = []
+        # requests are kept in the order they were sent
+        for request, sent_at in self._sent.items():
+            if sent_at > deadline:
+                break
+            expired.append(request)
+
+        if expired:
+            self.depth = self.MIN_DEPTH
+            self.rate = 0.0
+
+        return expired
+
+
+    def cancel(self, index: int, offset: int) -> None:
+        self._sent.pop((index, offset), None)
+
+
+    def reset(self) -> None:
+        """ Peer dropped every outstanding request (we got choked) """
+        self._sent.clear()
+
+
+    def _update(self, now: float) -> None:
+        window_rate = self._window_bytes / (now - self._window_start)
+        self.rate = window_rate if not self.rate else (self.rate + window_rate) / 2
+
+        self._window_start = now
+        self._window_bytes = 0
+
+        # queueing inflates samples so let the base rtt drift up slowly
+        self._base_rtt *= 1.05
+
+        bdp = self.rate * self._base_rtt * self.HEADROOM
+        depth = math.ceil(bdp / self.BLOCK_SIZE) + 1
+        self.depth = max(self.MIN_DEPTH, min(depth, self.max_depth))
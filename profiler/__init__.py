@@ -0,0 +1,3 @@
+from .profiler import Profiler
+from .spans import Spans, HOT_PATHS
+from .sampler import StackSampler
@@ -0,0 +1,89 @@
+from typing import Any, Coroutine
+
+import io
+import pstats
+import asyncio
+import cProfile
+
+from .spans import Spans
+from .sampler import StackSampler
+
+
+class Profiler:
+    """ Profiles a run for at most `duration` seconds from its start
+
+    mode is 'sample' for the stack sampler, cheap enough to leave on a busy
+    node, or 'cprofile' for exact call counts at a much higher overhead
+    (only the event loop thread is seen). Hot path spans are timed in both.
+
+    Once the window is over, or the run ends before it, the results go to
+    files starting with output: output.collapsed (sample) or output.pstats
+    (cprofile) and output.spans.txt, the span summary is printed as well.
+    """
+    def __init__(self, mode: str = 'sample', duration: float = 60.0, output: str = 'pybt-profile'):
+        if mode not in ('sample', 'cprofile'):
+            raise ValueError(f'Unknown profiling mode {mode}')
+
+        self.mode = mode
+        self.duration = duration
+        self.output = output
+
+        self.spans = Spans()
+        self._sampler = StackSampler() if mode == 'sample' else None
+        self._cprofile = cProfile.Profile() if mode == 'cprofile' else None
+        self._running = False
+
+
+    async def run(self, coro: Coroutine) -> Any:
+        """ Run coro, profiling the start of it """
+        loop = asyncio.get_running_loop()
+        self.start()
+        window = loop.call_later(self.duration, self.stop)
+        try:
+            return await coro
+        finally:
+            window.cancel()
+            self.stop()
+
+
+    def start(self):
+        self._running = True
+        self.spans.install()
+        if self._sampler is not None:
+            self._sampler.start()
+        if self._cprofile is not None:
+            self._cprofile.enable()
+
+
+    def stop(self):
+        """ End the window and write the results, once """
+        if not self._running:
+            return
+        self._running = False
+
+        if self._cprofile is not None:
+            self._cprofile.disable()
+        if self._sampler is not None:
+            self._sampler.stop()
+        self.spans.uninstall()
+
+        self._write()
+
+
+    def _write(self):
+        if self._sampler is not None:
+            with open(self.output + '.collapsed', 'w') as fp:
+                fp.write(self._sampler.collapsed())
+            print(f'{self._sampler.samples} stack samples written to {self.output}.collapsed')
+
+        if self._cprofile is not None:
+            self._cprofile.dump_stats(self.output + '.pstats')
+            out = io.StringIO()
+            pstats.Stats(self._cprofile, stream=out).sort_stats('cumulative').print_stats(25)
+            print(out.getvalue())
+            print(f'Profile written to {self.output}.pstats')
+
+        summary = self.spans.summary()
+        with open(self.output + '.spans.txt', 'w') as fp:
+            fp.write(summary + '\n')
+        print(summary, flush=True)
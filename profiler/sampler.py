@@ -0,0 +1,74 @@
+from typing import Dict
+
+import os
+import sys
+import threading
+
+from types import FrameType
+from collections import Counter
+
+
+class StackSampler:
+    """ Sampling profiler, a thread that looks at the stack of every other
+    thread every `interval` seconds
+
+    Nothing runs in the profiled threads so the overhead is the sampler
+    taking the GIL now and then. Stacks are kept collapsed, one line per
+    distinct stack with frames separated by ';' and the thread name as the
+    root, which is what flamegraph.pl and speedscope read.
+    """
+    def __init__(self, interval: float = 0.005):
+        self.interval = interval
+        self.samples = 0
+        self._stacks: Counter = Counter()
+        self._labels: Dict[object, str] = {} # code object -> frame label
+        self._stop = threading.Event()
+        self._thread: threading.Thread | None = None
+
+
+    def start(self):
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='pybt-sampler', daemon=True)
+        self._thread.start()
+
+
+    def stop(self):
+        if self._thread is None:
+            return
+
+        self._stop.set()
+        self._thread.join()
+        self._thread = None
+
+
+    def collapsed(self) -> str:
+        return ''.join(f'{stack} {count}\n' for stack, count in self._stacks.most_common())
+
+
+    def _run(self):
+        own = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident == own:
+                    continue
+
+                self._stacks[self._collapse(names.get(ident, str(ident)), frame)] += 1
+            self.samples += 1
+
+
+    def _collapse(self, thread: str, frame: FrameType | None) -> str:
+        labels = []
+        while frame is not None:
+            code = frame.f_code
+            label = self._labels.get(code)
+            if label is None:
+                path = code.co_filename.split(os.sep)
+                label = f'{code.co_name} ({os.path.join(*path[-2:])}:{code.co_firstlineno})'
+                self._labels[code] = label.replace(';', ':')
+                label = self._labels[code]
+            labels.append(label)
+            frame = frame.f_back
+
+        labels.append(thread.replace(';', ':'))
+        return ';'.join(reversed(labels))
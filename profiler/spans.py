@@ -0,0 +1,131 @@
+from typing import Any, Callable, Dict, List, Tuple
+
+import time
+import inspect
+import functools
+
+from metrics import Histogram
+
+from peer.peer_state import PeerState
+from torrent_manager import TorrentManager
+from torrent_manager.piece_download import PieceDownload
+from tracker.http_tracker import HTTPTracker
+from tracker.udp_tracker import UDPTracker
+
+
+# seconds, a span is anything from a dict lookup to a tracker timing out
+SPAN_BOUNDS = (
+    1e-6, 5e-6, 1e-5, 5e-5, 1e-4, 5e-4, 1e-3, 5e-3, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0, 30.0
+)
+
+# span name, class, method
+HOT_PATHS: List[Tuple[str, type, str]] = [
+    ('peer.handle_message', PeerState, 'handle_message'),
+    ('piece.receive_block', PieceDownload, 'receive_block'),
+    ('torrent.save_piece', TorrentManager, 'save_piece'),
+    ('torrent.get_pieces', TorrentManager, 'get_pieces'),
+    ('tracker.http.announce', HTTPTracker, 'get_peers'),
+    ('tracker.http.scrape', HTTPTracker, 'scrape'),
+    ('tracker.udp.announce', UDPTracker, 'get_peers'),
+    ('tracker.udp.scrape', UDPTracker, 'scrape'),
+]
+
+
+class SpanStats:
+    """ Latencies of the calls of a span """
+    def __init__(self):
+        self.histogram = Histogram(SPAN_BOUNDS)
+        self.max = 0.0
+
+
+    def add(self, elapsed: float):
+        self.histogram.observe(elapsed)
+        if elapsed > self.max:
+            self.max = elapsed
+
+
+class Spans:
+    """ Times the HOT_PATHS methods while installed
+
+    The methods are wrapped on their classes when installed and put back when
+    uninstalled, so code runs untouched unless we are profiling. Coroutines
+    are timed until they return, waiting included.
+    """
+    def __init__(self, hot_paths: List[Tuple[str, type, str]] = HOT_PATHS):
+        self.stats: Dict[str, SpanStats] = {name: SpanStats() for name, _, _ in hot_paths}
+        self._hot_paths = hot_paths
+        self._originals: List[Tuple[type, str, Callable]] = []
+
+
+    def install(self):
+        if self._originals:
+            return
+
+        for name, cls, method in self._hot_paths:
+            original = cls.__dict__[method]
+            self._originals.append((cls, method, original))
+            setattr(cls, method, self._wrap(original, self.stats[name]))
+
+
+    def uninstall(self):
+        for cls, method, original in self._originals:
+            setattr(cls, method, original)
+        self._originals.clear()
+
+
+    def summary(self) -> str:
+        """ Table of the latency of every span that was called """
+        lines = [
+            f'{"span":<24} {"calls":>9} {"total":>10} {"mean":>10} {"p50":>10} {"p99":>10} {"max":>10}'
+        ]
+        for name, stats in self.stats.items():
+            hist = stats.histogram
+            if not hist.count:
+                continue
+
+            # a bucket bound may be past the slowest call
+            p50, p99 = (min(hist.quantile(q) or stats.max, stats.max) for q in (0.5, 0.99))
+            lines.append(
+                f'{name:<24} {hist.count:>9} {_secs(hist.sum):>10} {_secs(hist.sum / hist.count):>10} '
+                f'{_secs(p50):>10} {_secs(p99):>10} {_secs(stats.max):>10}'
+            )
+
+        return '\n'.join(lines)
+
+
+    @staticmethod
+    def _wrap(fn: Callable, stats: SpanStats) -> Callable:
+        if inspect.iscoroutinefunction(fn):
+            @functools.wraps(fn)
+            async def timed_coro(*args: Any, **kwargs: Any) -> Any:
+                started = time.perf_counter()
+                try:
+                    return await fn(*args, **kwargs)
+                finally:
+                    stats.add(time.perf_counter() - started)
+
+            return timed_coro
+
+        @functools.wraps(fn)
+        def timed(*args: Any, **kwargs: Any) -> Any:
+            started = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                stats.add(time.perf_counter() - started)
+
+        return timed
+
+
+def _secs(value: float | None) -> str:
+    """ Seconds with a unit that keeps them readable, percentiles are bucket
+    upper bounds
+    """
+    if value is None:
+        return '-'
+    if value < 1e-3:
+        return f'{value * 1e6:.1f}us'
+    if value < 1:
+        return f'{value * 1e3:.2f}ms'
+
+    return f'{value:.2f}s'
@@ -1,4 +1,6 @@
 import struct
+import bencode
+import bitarray
 
 from typing import Tuple
 
@@ -19,6 +21,7 @@ class MessageOP(IntEnum):
     REQUEST = 6 
     PIECE = 7
     CANCEL = 8
+    EXTENDED = 20 # BEP 10
     KEEP_ALIVE = -1 # this is not part of the spec
 
 class FormatStrings(StrEnum):
@@ -29,31 +32,40 @@ class FormatStrings(StrEnum):
         - > | < identifies endianness, big | little respectively
         - B = 1 byte (representing length of following string)
         - 19s = 19 bytes string
-        - 8x = 8 pad bytes
+        - 8s = 8 reserved bytes (flags of supported extensions)
         - 20s = 20 byte string (always 20, because it's the info hash)
         - 20s = 20 byte string (always 20, because it s the client id)
         - I = 4 byte int (not used in Handshake)
     """
-    HANDSHAKE = '>B19s8x20s20s'
-    CHOKE = '>I'
-    UNCHOKE = '>I'
+    HANDSHAKE = '>B19s8s20s20s'
+    CHOKE = '>IB'
+    UNCHOKE = '>IB'
     INTERESTED = '>IB'
     NOT_INTERESTED = '>IB'
     HAVE = '>IBI'
+    BITFIELD = '>IB'
     REQUEST = '>IBIII'
-    CANCEL = '>IBII'
+    PIECE = '>IBII'
+    CANCEL = '>IBIII'
 
 #--------------------****------------------#
 #                  Messages                #
 #--------------------****------------------#
 class Handshake:
+    # we support the extension protocol (BEP 10)
+    RESERVED = bytes([0, 0, 0, 0, 0, 0x10, 0, 0])
+
     def __new__(self, client_id: str, info_hash: bytes) -> bytes:
-        return struct.pack(FormatStrings.HANDSHAKE, 19, b'BitTorrent protocol', info_hash, client_id.encode())
+        return struct.pack(FormatStrings.HANDSHAKE, 19, b'BitTorrent protocol', Handshake.RESERVED, info_hash, client_id.encode())
     
     @staticmethod
     def decode(payload) -> Tuple[str, str]:
         return payload[28:48], payload[48:68]
 
+    @staticmethod
+    def supports_extensions(payload) -> bool:
+        return bool(payload[25] & 0x10)
+
 
 class Choke:
     def __new__(self) -> bytes:
@@ -80,25 +92,61 @@ class Have:
         return struct.pack(FormatStrings.HAVE, 5, MessageOP.HAVE, n)
     
     @staticmethod
-    def decode(payload: bytes) -> int:
+    def decode(payload: memoryview) -> int:
         return struct.unpack(">I", payload)[0]
 
 
+class Bitfield:
+    def __new__(self, pieces: bitarray.bitarray) -> bytes:
+        payload = pieces.tobytes()
+        return struct.pack(FormatStrings.BITFIELD, 1 + len(payload), MessageOP.BITFIELD) + payload
+
+
 class Request:
     def __new__(self, index: int, offset: int, block_size: int) -> bytes:
         return struct.pack(FormatStrings.REQUEST, 13, MessageOP.REQUEST, index, offset, block_size)
 
+    @staticmethod
+    def decode(payload: memoryview) -> Tuple[int, int, int]:
+        """ Returns piece index, block offset and block length """
+        return struct.unpack(">III", payload)
+
 
 class PieceMessage:
     @staticmethod
-    def decode(payload: bytes) -> Tuple[int, int, bytes]:
-        piece_nr = struct.unpack(">I", payload[0:4])[0]
-        block_nr = struct.unpack(">I", payload[4:8])[0] 
+    def header(index: int, offset: int, length: int) -> bytes:
+        """ Message up to the block, which is sent right after it """
+        return struct.pack(FormatStrings.PIECE, 9 + length, MessageOP.PIECE, index, offset)
+
+    @staticmethod
+    def decode(payload: memoryview) -> Tuple[int, int, memoryview]:
+        """ Returns piece index, block offset and the block (a view, not a copy) """
+        piece_nr, block_nr = struct.unpack_from(">II", payload)
 
         return piece_nr, block_nr, payload[8:]
 
 
 
 class Cancel:
-    def __new__(self, index: int, offset: int) -> bytes:
-        return struct.pack(FormatStrings.CANCEL, 13, CANCEL, index, offset * size, BLOCK_SIZE)
+    def __new__(self, index: int, offset: int, block_size: int) -> bytes:
+        return struct.pack(FormatStrings.CANCEL, 13, MessageOP.CANCEL, index, offset, block_size)
+
+
+class ExtendedHandshake:
+    """ BEP 10 handshake, extended message id 0 """
+    def __new__(self, reqq: int) -> bytes:
+        payload = bencode.dumps({'m': {}, 'reqq': reqq, 'v': b'pybt'})
+        return struct.pack('>IBB', 2 + len(payload), MessageOP.EXTENDED, 0) + payload
+
+    @staticmethod
+    def decode(payload: memoryview) -> dict | None:
+        """ Returns the handshake dictionary, None if it isn't an extended handshake """
+        if len(payload) < 1 or payload[0] != 0:
+            return None
+
+        try:
+            msg = bencode.loads(bytes(payload[1:]))
+        except Exception:
+            return None
+
+        return msg if isinstance(msg, dict) else None
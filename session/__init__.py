@@ -0,0 +1,3 @@
+from .session import Session
+from .torrent_session import TorrentSession
+from .supervisor import Supervisor
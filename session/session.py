@@ -0,0 +1,196 @@
+from typing import Any, Dict, List
+
+import socket
+import asyncio
+import aiohttp
+
+from client import Client
+
+from protocol import Handshake
+from torrent_manager import PieceVerifier, Choker
+
+from peer import PeerWireProtocol, PeerConnectionError
+from connection_manager import ConnectionLimit
+
+from file_manager.disk_writer import DiskWriter, FsyncPolicy
+from metrics import LoopLagMonitor, MetricsServer, snapshot
+
+from .torrent_session import TorrentSession
+
+
+class Session:
+    """ Runs many torrents on one event loop
+
+    Torrents share a single listening socket, incoming connections are routed
+    by the info hash of their handshake. They also share the disk writer, the
+    hash verifier, the tracker HTTP session, the upload slots (one choker for
+    all peers) and a limit on the number of connections.
+
+    Counters of every torrent and peer can be read with `metrics`, or from
+    localhost:metrics_port in Prometheus format if there is one.
+    """
+    HANDSHAKE_TIMEOUT = 20.0
+
+    def __init__(
+        self,
+        port: int,
+        max_connections: int = 200,
+        upload_slots: int = 4,
+        hash_workers: int = 2,
+        write_buffer: int = 64 * 1024 * 1024,
+        fsync: FsyncPolicy = FsyncPolicy.ON_FLUSH,
+        check_workers: int | None = None,
+        metrics_port: int | None = None
+    ):
+        self.client = Client(port=port)
+        self.torrents: Dict[bytes, TorrentSession] = {} # info hash -> torrent
+
+        self.disk_writer = DiskWriter(high_water=write_buffer, fsync=fsync)
+        self.verifier = PieceVerifier(workers=hash_workers)
+        self.choker = Choker(upload_slots)
+        self.limit = ConnectionLimit(max_connections)
+        self.check_workers = check_workers
+        self.metrics_port = metrics_port
+        self.loop_lag = LoopLagMonitor()
+
+
+    def add_torrent(
+        self,
+        path: str,
+        max_peers: int = 30,
+        max_dials: int = 8,
+        storage: str = 'file',
+        force_recheck: bool = False,
+        strict_resume: bool = False,
+        read_cache: int = 32 * 1024 * 1024,
+        seed: bool = False
+    ) -> TorrentSession:
+        """ Add a torrent, before the session runs """
+        torrent = TorrentSession(
+            path,
+            self.client,
+            self.disk_writer,
+            self.verifier,
+            self.choker,
+            self.limit,
+            max_peers=max_peers,
+            max_dials=max_dials,
+            storage=storage,
+            force_recheck=force_recheck,
+            strict_resume=strict_resume,
+            check_workers=self.check_workers,
+            read_cache=read_cache,
+            seed=seed
+        )
+        self.torrents[torrent.info_hash] = torrent
+
+        return torrent
+
+
+    def stats(self) -> List[Dict[str, Any]]:
+        """ Progress of every torrent """
+        return [
+            {
+                'name': torrent.torrent['info']['name'].decode('utf-8', 'replace'),
+                'downloaded': torrent.torrent_status.downloaded,
+                'uploaded': torrent.torrent_status.uploaded,
+                'left': torrent.torrent_status.left,
+                'peers': len(torrent.connections.active),
+            }
+            for torrent in self.torrents.values()
+        ]
+
+
+    def metrics(self) -> Dict[str, Any]:
+        """ Snapshot of the counters of the session, its torrents and peers """
+        return snapshot(self)
+
+
+    async def run(self, listen: bool = True):
+        """ Run every torrent until all of them are done or we are cancelled
+
+        Without listen incoming connections only come through adopt
+        """
+        http_session = aiohttp.ClientSession()
+
+        # listens for incoming peer connections of every torrent
+        loop = asyncio.get_running_loop()
+        server = None
+        if listen:
+            try:
+                server = await loop.create_server(
+                    lambda: PeerWireProtocol(connected_cb=self.on_incoming_conn),
+                    port=self.client.port
+                )
+            except OSError as e:
+                # we can still download from the peers we dial
+                print(f'Not accepting connections {e!r}')
+
+        metrics_server = None
+        if self.metrics_port is not None:
+            metrics_server = MetricsServer(self, self.metrics_port)
+            try:
+                await metrics_server.start()
+            except OSError as e:
+                print(f'Not serving metrics {e!r}')
+                metrics_server = None
+
+        # coroutine that picks the peers we upload to
+        choker_task = asyncio.create_task(self.choker.run())
+        lag_task = asyncio.create_task(self.loop_lag.run())
+
+        tasks: List[asyncio.Task] = [
+            asyncio.create_task(torrent.run(http_session))
+            for torrent in self.torrents.values()
+        ]
+
+        try:
+            await asyncio.wait(tasks)
+        except (KeyboardInterrupt, asyncio.CancelledError):
+            print("\nSIGINT received, terminating")
+            for task in tasks:
+                task.cancel()
+            await asyncio.wait(tasks)
+
+        if server is not None:
+            server.close()
+        choker_task.cancel()
+        lag_task.cancel()
+        if metrics_server is not None:
+            await metrics_server.close()
+
+        self.verifier.close()
+        self.disk_writer.close()
+        await http_session.close()
+
+
+    def adopt(self, sock: socket.socket):
+        """ Take an incoming connection accepted somewhere else, its handshake
+        must still be unread
+        """
+        loop = asyncio.get_running_loop()
+        loop.create_task(loop.connect_accepted_socket(
+            lambda: PeerWireProtocol(connected_cb=self.on_incoming_conn), sock
+        ))
+
+
+    def on_incoming_conn(self, protocol: PeerWireProtocol):
+        """ Called by the transport once an incoming connection is accepted """
+        asyncio.create_task(self.server_cb(protocol))
+
+
+    async def server_cb(self, protocol: PeerWireProtocol):
+        """ Route an incoming connection to the torrent it handshakes for """
+        try:
+            handshake = await asyncio.wait_for(protocol.read_handshake(), self.HANDSHAKE_TIMEOUT)
+        except (asyncio.TimeoutError, PeerConnectionError):
+            protocol.close()
+            return
+
+        info_hash, _ = Handshake.decode(handshake)
+        torrent = self.torrents.get(bytes(info_hash))
+        if torrent is None or torrent.torrent_manager.end.is_set():
+            protocol.close()
+            return
+
+        await torrent.accept(protocol, handshake)
@@ -0,0 +1,336 @@
+from typing import Any, Dict, List
+
+import os
+import signal
+import socket
+import struct
+import asyncio
+import multiprocessing
+
+from multiprocessing.connection import Connection
+
+from protocol import FormatStrings
+from torrent import TorrentFile
+
+from .session import Session
+
+
+HANDSHAKE_SIZE = struct.calcsize(FormatStrings.HANDSHAKE)
+
+
+class Supervisor:
+    """ Spreads torrents over worker processes, each running its own Session
+
+    Torrents are sharded by size so every worker gets about the same amount
+    of data. The supervisor owns the listening socket, it peeks at the
+    handshake of every incoming connection and hands the socket over to the
+    worker running the torrent of its info hash, which reads the handshake as
+    if it had accepted the connection itself. Workers report their stats
+    back every STATS_INTERVAL seconds and the supervisor prints the totals.
+    """
+    HANDSHAKE_TIMEOUT = 20.0
+    STATS_INTERVAL = 5
+
+    def __init__(
+        self,
+        workers: int,
+        paths: List[str],
+        session_args: Dict[str, Any],
+        torrent_args: Dict[str, Any]
+    ):
+        self._port = session_args['port']
+        self._session_args = session_args
+        self._torrent_args = torrent_args
+
+        torrents = {path: TorrentFile.from_file(path=path) for path in paths}
+        self._shards = _shard(torrents, workers)
+        self._worker_of: Dict[bytes, int] = {} # info hash -> worker index
+        for n, shard in enumerate(self._shards):
+            for path in shard:
+                self._worker_of[torrents[path].info_hash] = n
+
+        self._processes: List[multiprocessing.Process] = []
+        self._handoff: List[socket.socket] = [] # sockets are passed to worker n through n
+        self._handoff_locks: List[asyncio.Lock] = []
+        self._stats_conns: List[Connection] = []
+        self._stats: List[List[Dict[str, Any]]] = [[] for _ in self._shards]
+
+
+    def start(self):
+        """ Fork the workers, before any event loop or thread exists here """
+        ctx = multiprocessing.get_context('fork')
+        for n, shard in enumerate(self._shards):
+            session_args = self._session_args
+            if session_args.get('metrics_port') is not None:
+                # one port per worker
+                session_args = dict(session_args, metrics_port=session_args['metrics_port'] + n)
+
+            ours, theirs = socket.socketpair(socket.AF_UNIX, socket.SOCK_STREAM)
+            stats_recv, stats_send = ctx.Pipe(duplex=False)
+            # a worker doesn't keep the supervisor ends of the workers before it
+            inherited = self._handoff + self._stats_conns + [ours, stats_recv]
+            process = ctx.Process(
+                target=_worker_main,
+                # not a daemon, rechecks run on a process pool
+                args=(shard, session_args, self._torrent_args, theirs, stats_send, inherited)
+            )
+            process.start()
+            theirs.close()
+            stats_send.close()
+
+            self._processes.append(process)
+            self._handoff.append(ours)
+            self._handoff_locks.append(asyncio.Lock())
+            self._stats_conns.append(stats_recv)
+
+
+    async def run(self):
+        """ Run the started workers until all of them exit or we are cancelled """
+        loop = asyncio.get_running_loop()
+        stats_conns = self._stats_conns
+        for n, conn in enumerate(stats_conns):
+            loop.add_reader(conn.fileno(), self._read_stats, n, conn)
+
+        accept_task = asyncio.create_task(self._accept())
+        stats_task = asyncio.create_task(self._print_stats())
+
+        for sock in self._handoff:
+            sock.setblocking(False)
+
+        exited = [loop.create_future() for _ in self._processes]
+        for process, fut in zip(self._processes, exited):
+            loop.add_reader(process.sentinel, _set_done, fut)
+
+        try:
+            await asyncio.gather(*exited)
+        except (KeyboardInterrupt, asyncio.CancelledError):
+            # a Ctrl-C already reached the workers too, they stop only once
+            # whichever signal comes first
+            print("\nTerminating workers")
+            for process in self._processes:
+                if process.is_alive():
+                    os.kill(process.pid, signal.SIGTERM)
+            await loop.run_in_executor(None, self._join)
+
+        accept_task.cancel()
+        stats_task.cancel()
+        for process in self._processes:
+            loop.remove_reader(process.sentinel)
+        for conn in stats_conns:
+            loop.remove_reader(conn.fileno())
+            conn.close()
+        for sock in self._handoff:
+            sock.close()
+
+        self._report()
+
+
+    def _join(self):
+        for process in self._processes:
+            process.join()
+
+
+    async def _accept(self):
+        loop = asyncio.get_running_loop()
+        try:
+            if socket.has_dualstack_ipv6():
+                server = socket.create_server(
+                    ('', self._port), family=socket.AF_INET6, dualstack_ipv6=True
+                )
+            else:
+                server = socket.create_server(('', self._port))
+        except OSError as e:
+            # workers still download from the peers they dial
+            print(f'Not accepting connections {e!r}')
+            return
+
+        server.setblocking(False)
+        try:
+            while True:
+                conn, _ = await loop.sock_accept(server)
+                asyncio.create_task(self._route(conn))
+        finally:
+            server.close()
+
+
+    async def _route(self, conn: socket.socket):
+        """ Hand a connection to the worker running the torrent it wants """
+        try:
+            handshake = await asyncio.wait_for(_peek(conn, HANDSHAKE_SIZE), self.HANDSHAKE_TIMEOUT)
+            worker = self._worker_of.get(handshake[28:48])
+            if worker is not None and self._processes[worker].is_alive():
+                # one sender per socket, a writer callback per fd
+                async with self._handoff_locks[worker]:
+                    await _send_fd(self._handoff[worker], conn.fileno())
+        except (asyncio.TimeoutError, OSError):
+            pass
+        finally:
+            # the worker has its own copy
+            conn.close()
+
+
+    def _read_stats(self, n: int, conn: Connection):
+        try:
+            self._stats[n] = conn.recv()
+        except (EOFError, OSError):
+            asyncio.get_running_loop().remove_reader(conn.fileno())
+
+
+    async def _print_stats(self):
+        while True:
+            await asyncio.sleep(self.STATS_INTERVAL)
+            self._report()
+
+
+    def _report(self):
+        torrents = [stats for worker in self._stats for stats in worker]
+        done = sum(1 for t in torrents if t['left'] == 0)
+        downloaded = sum(t['downloaded'] for t in torrents) / 2 ** 20
+        size = sum(t['downloaded'] + t['left'] for t in torrents) / 2 ** 20
+        uploaded = sum(t['uploaded'] for t in torrents) / 2 ** 20
+        peers = sum(t['peers'] for t in torrents)
+        print(
+            f'{len(self._processes)} workers, {done}/{len(torrents)} torrents done, '
+            f'{downloaded:.1f}/{size:.1f} MiB, {uploaded:.1f} MiB up, {peers} peers',
+            flush=True
+        )
+
+
+def _shard(torrents: Dict[str, TorrentFile], workers: int) -> List[List[str]]:
+    """ Biggest torrents first, each to the worker with the least data so far """
+    shards: List[List[str]] = [[] for _ in range(min(workers, len(torrents)))]
+    sizes = [0] * len(shards)
+
+    by_size = sorted(
+        torrents.items(), key=lambda item: item[1]['info'].total_length, reverse=True
+    )
+    for path, torrent in by_size:
+        n = sizes.index(min(sizes))
+        shards[n].append(path)
+        sizes[n] += torrent['info'].total_length
+
+    return shards
+
+
+async def _peek(conn: socket.socket, size: int) -> bytes:
+    """ Wait until size bytes can be read without reading them """
+    loop = asyncio.get_running_loop()
+    conn.setblocking(False)
+    # the socket only turns readable once size bytes arrived (or the peer
+    # closed), a part of the handshake doesn't wake us up
+    conn.setsockopt(socket.SOL_SOCKET, socket.SO_RCVLOWAT, size)
+    try:
+        while True:
+            try:
+                data = conn.recv(size, socket.MSG_PEEK)
+            except BlockingIOError:
+                data = None
+
+            if data == b'':
+                raise ConnectionResetError('Connection closed before handshake')
+            if data is not None and len(data) >= size:
+                return data
+
+            readable = loop.create_future()
+            loop.add_reader(conn.fileno(), _set_done, readable)
+            try:
+                await readable
+            finally:
+                loop.remove_reader(conn.fileno())
+    finally:
+        # the worker shares the socket
+        conn.setsockopt(socket.SOL_SOCKET, socket.SO_RCVLOWAT, 1)
+
+
+async def _send_fd(sock: socket.socket, fd: int):
+    """ Pass fd through the non blocking unix socket sock """
+    loop = asyncio.get_running_loop()
+    while True:
+        try:
+            socket.send_fds(sock, [b'\0'], [fd])
+            return
+        except BlockingIOError:
+            pass
+
+        writable = loop.create_future()
+        loop.add_writer(sock.fileno(), _set_done, writable)
+        try:
+            await writable
+        finally:
+            loop.remove_writer(sock.fileno())
+
+
+def _set_done(fut: asyncio.Future):
+    if not fut.done():
+        fut.set_result(None)
+
+
+def _worker_main(
+    paths: List[str],
+    session_args: Dict[str, Any],
+    torrent_args: Dict[str, Any],
+    handoff: socket.socket,
+    stats: Connection,
+    inherited: List[socket.socket | Connection]
+):
+    for sock in inherited:
+        sock.close()
+
+    # the supervisor stops us with SIGTERM, until our loop handles it the same
+    # as a Ctrl-C
+    signal.signal(signal.SIGTERM, signal.default_int_handler)
+
+    session = Session(**session_args)
+    for path in paths:
+        session.add_torrent(path, **torrent_args)
+
+    try:
+        asyncio.run(_worker(session, handoff, stats))
+    except KeyboardInterrupt:
+        pass
+
+
+async def _worker(session: Session, handoff: socket.socket, stats: Connection):
+    loop = asyncio.get_running_loop()
+    main = asyncio.current_task()
+
+    def terminate():
+        # Ctrl-C reaches us along with the SIGTERM of the supervisor, a second
+        # cancel would cut the cleanup short
+        if not main.cancelling():
+            main.cancel()
+
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(signum, terminate)
+
+    def adopt():
+        try:
+            msg, fds, _, _ = socket.recv_fds(handoff, 1, 1)
+        except BlockingIOError:
+            return
+        except OSError:
+            msg, fds = b'', []
+
+        if not msg:
+            # the supervisor is gone
+            loop.remove_reader(handoff.fileno())
+        for fd in fds:
+            session.adopt(socket.socket(fileno=fd))
+
+    async def report():
+        while True:
+            stats.send(session.stats())
+            await asyncio.sleep(Supervisor.STATS_INTERVAL)
+
+    handoff.setblocking(False)
+    loop.add_reader(handoff.fileno(), adopt)
+    report_task = asyncio.create_task(report())
+    try:
+        await session.run(listen=False)
+    finally:
+        report_task.cancel()
+        loop.remove_reader(handoff.fileno())
+        try:
+            stats.send(session.stats())
+        except OSError:
+            pass
@@ -0,0 +1,282 @@
+import time
+import asyncio
+import aiohttp
+
+from client import Client
+
+from torrent import TorrentFile
+from tracker import PeerAddr, TrackerException
+from torrent_manager import TorrentManager, TorrentStatus, PieceVerifier, Choker
+
+from peer import Peer, PeerConnectionError, PeerWireProtocol
+from connection_manager import ConnectionManager, ConnectionLimit
+
+from tracker.multi_tracker import MultiTracker
+from file_manager.single_file_manager import SingleFileManager
+from file_manager.mmap_file_manager import MmapFileManager
+from file_manager.multi_file_manager import MultiFileManager
+from file_manager.disk_writer import DiskWriter
+from file_manager.resume import ResumeData
+from file_manager.recheck import recheck, has_data
+
+
+class TorrentSession:
+    """ A torrent of a Session, its storage, tracker and peers
+
+    Disk writer, hash verifier, choker and connection limit are the ones of
+    the session, shared with the other torrents.
+    """
+    RESUME_INTERVAL = 60 # seconds between resume data saves
+
+    def __init__(
+        self,
+        path: str,
+        client: Client,
+        disk_writer: DiskWriter,
+        verifier: PieceVerifier,
+        choker: Choker,
+        limit: ConnectionLimit,
+        max_peers: int = 30,
+        max_dials: int = 8,
+        storage: str = 'file',
+        force_recheck: bool = False,
+        strict_resume: bool = False,
+        check_workers: int | None = None,
+        read_cache: int = 32 * 1024 * 1024,
+        seed: bool = False
+    ):
+        self.max_peers = max_peers
+
+        self.need_peers_lock = asyncio.Lock()
+        self.need_peers = asyncio.Condition(self.need_peers_lock)
+
+        self.client = client
+        self.torrent = TorrentFile.from_file(path=path)
+
+        # pieces we already have, before storage touches the files
+        self.torrent_status = TorrentStatus(self.torrent['info'])
+        self.resume = ResumeData(
+            self.torrent['info']['name'] + b'.resume',
+            self.torrent.info_hash,
+            self.torrent['info'].file_paths,
+            strict=strict_resume
+        )
+        pieces = None if force_recheck else self.resume.load(self.torrent['info'].total_pieces)
+        if pieces is None and has_data(self.torrent['info']):
+            print("Checking existing data")
+            pieces = recheck(self.torrent['info'], check_workers)
+        if pieces is not None:
+            self.torrent_status.pieces |= pieces
+
+        if self.torrent['info'].is_multi_file:
+            self.file_manager = MultiFileManager(
+                self.torrent['info'], disk_writer, cache_size=read_cache
+            )
+        elif storage == 'mmap':
+            self.file_manager = MmapFileManager(self.torrent['info'])
+        else:
+            self.file_manager = SingleFileManager(
+                self.torrent['info'], disk_writer, cache_size=read_cache
+            )
+        self.torrent_manager = TorrentManager(
+            self.torrent['info'],
+            self.file_manager,
+            self.torrent_status,
+            verifier,
+            seed=seed,
+            choker=choker
+        )
+        # dials peers from the tracker, connected ones are ran on worker coroutines
+        self.connections = ConnectionManager(
+            self.torrent,
+            self.client,
+            self.torrent_manager,
+            max_peers,
+            max_dials=max_dials,
+            limit=limit
+        )
+
+
+    @property
+    def info_hash(self) -> bytes:
+        return self.torrent.info_hash
+
+
+    async def run(self, http_session: aiohttp.ClientSession | None = None):
+        """ Download (and seed) until done or cancelled """
+        tracker = MultiTracker(
+            client=self.client,
+            torrent=self.torrent,
+            status=self.torrent_status,
+            session=http_session,
+            wanted_peers=self.max_peers
+        )
+
+        # coroutine that periodically fetches peers from tracker
+        tracker_task = asyncio.create_task(self.tracker_coro(tracker=tracker))
+
+        # coroutine that connects to the best known peers
+        conn_man_task = asyncio.create_task(self.connections.run())
+
+        # workers that talk to peers
+        workers = [
+            asyncio.create_task(self.worker_coro())
+            for _ in range(self.max_peers)
+        ]
+
+        # coroutine that saves the resume data while we download
+        resume_task = asyncio.create_task(self.resume_coro())
+
+        try:
+            await self.torrent_manager.end.wait()
+        except asyncio.CancelledError:
+            pass
+
+        tracker_task.cancel()
+        conn_man_task.cancel()
+        resume_task.cancel()
+
+        for worker in workers:
+            worker.cancel()
+
+        try:
+            await tracker_task
+        except asyncio.CancelledError:
+            # cancelled before it even started, nothing was left to download
+            await tracker.close()
+
+        # peers are gone once the workers are
+        await asyncio.gather(conn_man_task, resume_task, *workers, return_exceptions=True)
+        await self.connections.close()
+        self.torrent_manager.choker.remove(self.torrent_manager)
+
+        self.file_manager.end()
+        self.resume.save(self.torrent_status.pieces)
+
+
+    async def accept(self, protocol: PeerWireProtocol, handshake: bytes):
+        """ Take an incoming connection whose handshake is for this torrent """
+        peer_name = protocol.peername # IP and port
+
+        new_peer = Peer.from_incoming_conn(
+            PeerAddr(peer_name[0], peer_name[1]),
+            self.torrent,
+            self.client,
+            self.torrent_manager,
+            protocol
+        )
+
+        try:
+            await new_peer.accept(handshake)
+        except PeerConnectionError:
+            await new_peer.end()
+            return
+
+        if not self.connections.add_incoming(new_peer):
+            await new_peer.end()
+
+
+    async def tracker_coro(self, tracker: MultiTracker):
+        """ Coroutine that announces when the schedulers of the tracker tiers say
+        so, waking up when peers go away to check if it's time to ask for more
+        """
+        try:
+            while not self.torrent_manager.end.is_set():
+                while True:
+                    connected = len(self.connections.active)
+                    if tracker.needs_scrape(connected):
+                        await tracker.scrape()
+
+                    deadline = tracker.next_announce(connected, self.torrent_manager.seeding)
+                    delay = deadline - time.monotonic()
+                    if delay <= 0:
+                        break
+
+                    # not wait_for, it may swallow our cancellation if a
+                    # peer leaves just as we are being cancelled
+                    waiter = asyncio.create_task(self.wait(cond=self.need_peers))
+                    try:
+                        await asyncio.wait({waiter}, timeout=delay)
+                    finally:
+                        waiter.cancel()
+
+                # peers of each tier are handled as soon as it answers, each
+                # tier keeps track of when it is due again
+                try:
+                    async for peers in tracker.announce_due(connected, self.torrent_manager.seeding):
+                        self.connections.add_peers(peers)
+                except TrackerException as e:
+                    print(str(e))
+
+        finally:
+            await tracker.close()
+
+
+    async def resume_coro(self):
+        """ Coroutine that saves the resume data every RESUME_INTERVAL seconds,
+        with only the pieces whose writes reached the files
+        """
+        loop = asyncio.get_running_loop()
+        saved = None
+        while True:
+            await asyncio.sleep(self.RESUME_INTERVAL)
+
+            # pieces completed after this may still be queued once flushed
+            pieces = self.torrent_status.pieces.copy()
+            if pieces == saved:
+                continue
+
+            try:
+                await self.file_manager.flush()
+                await loop.run_in_executor(None, self.resume.save, pieces)
+            except OSError as e:
+                print(f'Could not save resume data: {e}')
+                continue
+
+            saved = pieces
+
+
+    async def worker_coro(self):
+        """ Worker coroutine that talks to a peer """
+        try:
+            while not self.torrent_manager.end.is_set():
+                peer: Peer = await self.connections.connected.get()
+                self.connections.peer_started(peer)
+                try:
+                    await peer.run()
+                except PeerConnectionError as e:
+                    print(str(e))
+                except asyncio.CancelledError:
+                    return
+
+                finally:
+                    # the peer is gone however it ended
+                    await peer.end()
+                    self.connections.peer_done(peer)
+
+                if (len(self.connections.active) < self.max_peers):
+                    await self.notify(self.need_peers)
+
+
+        except asyncio.CancelledError:
+            pass
+
+
+    async def wait(self, cond: asyncio.Condition):
+        """ Wait on a condition atomically """
+        await cond.acquire()
+        try:
+            await cond.wait()
+        finally:
+            cond.release()
+
+    async def notify(self, cond: asyncio.Condition):
+        """ Atomically notify of a condition """
+        try:
+            await cond.acquire()
+            cond.notify()
+            cond.release()
+        except asyncio.CancelledError:
+            if cond.locked():
+                cond.release()
+            raise
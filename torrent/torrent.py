@@ -1,7 +1,8 @@
 from __future__ import annotations
 
-from typing import Dict, Any
+from typing import Dict, Any, List, Tuple
 
+import os
 import math
 import bencode
 from hashlib import sha1
@@ -12,7 +13,7 @@ class BadTorrent(KeyError):
 
 class InfoDict:
     __required_keys = {
-        'name', 'length', 'piece length', 'pieces'
+        'name', 'piece length', 'pieces'
     }
 
     def __init__(self, **kwargs):
@@ -22,9 +23,18 @@ class InfoDict:
         if not isinstance(kwargs['name'], bytes):
             raise BadTorrent('Name is not a string')
 
-        if not isinstance(kwargs['length'], int):
+        # single file torrents have length, multi file torrents have files
+        if ('length' in kwargs) == ('files' in kwargs):
+            raise BadTorrent('Expected exactly one of length or files keys')
+
+        if 'length' in kwargs and not isinstance(kwargs['length'], int):
             raise BadTorrent('Length is not an int')
 
+        if 'files' in kwargs:
+            if kwargs['name'] in (b'', b'.', b'..') or b'/' in kwargs['name']:
+                raise BadTorrent('Invalid directory name')
+            self._check_files(kwargs['files'])
+
         if not isinstance(kwargs['piece length'], int):
             raise BadTorrent('Piece length is not an int')
 
@@ -34,20 +44,71 @@ class InfoDict:
         self._inner_dict = kwargs
     
 
+    @property
+    def is_multi_file(self) -> bool:
+        return 'files' in self._inner_dict
+
+
+    @cached_property
+    def total_length(self) -> int:
+        if self.is_multi_file:
+            return sum(f['length'] for f in self['files'])
+
+        return self['length']
+
+
+    @cached_property
+    def file_paths(self) -> List[Tuple[bytes, int]]:
+        """ Path and length of every file of the torrent, in torrent order """
+        if not self.is_multi_file:
+            return [(self['name'], self['length'])]
+
+        return [
+            (os.path.join(self['name'], *f['path']), f['length']) for f in self['files']
+        ]
+
+
     @cached_property
     def total_pieces(self) -> int:
-        return math.ceil(self['length'] / self['piece length'])
+        return math.ceil(self.total_length / self['piece length'])
     
 
     def get_hash(self, n: int) -> bytes:
         return self['pieces'][20 * n: 20 * n + 20]
 
 
+    def get_piece_length(self, n: int) -> int:
+        """ Length of piece n (the last piece may be shorter) """
+        if n == self.total_pieces - 1:
+            return self.total_length - n * self['piece length']
+
+        return self['piece length']
+
+
     def __getitem__(self, key):
         if key in self._inner_dict:
             return self._inner_dict[key]
         
         return None
+
+
+    @staticmethod
+    def _check_files(files: Any):
+        if not isinstance(files, list) or not files:
+            raise BadTorrent('Files is not a list')
+
+        for f in files:
+            if not isinstance(f, dict) or not isinstance(f.get('length'), int):
+                raise BadTorrent('File length is not an int')
+
+            path = f.get('path')
+            if not isinstance(path, list) or not path:
+                raise BadTorrent('File path is not a list')
+
+            # don't let a torrent write outside its directory
+            for part in path:
+                if not isinstance(part, bytes) or part in (b'', b'.', b'..') or b'/' in part:
+                    raise BadTorrent(f'Invalid file path {path}')
         
 
 class TorrentFile:
@@ -82,6 +143,21 @@ class TorrentFile:
         return self._info_hash
 
 
+    @property
+    def announce_tiers(self) -> List[List[bytes]]:
+        """ Tracker URLs by tier (BEP 12), announce-list replaces announce when 
+        present
+        """
+        tiers = []
+        for tier in self['announce-list'] or []:
+            if isinstance(tier, list):
+                urls = [url for url in tier if isinstance(url, bytes)]
+                if urls:
+                    tiers.append(urls)
+
+        return tiers or [[self['announce']]]
+
+
     def __getitem__(self, key: str) -> Any:
         if key in self._inner_dict:
             return self._inner_dict[key]
@@ -1,2 +1,4 @@
 from .torrent_manager import TorrentManager
 from .torrent_status import TorrentStatus
+from .piece_verifier import PieceVerifier
+from .choker import Choker
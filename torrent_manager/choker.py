@@ -0,0 +1,109 @@
+from __future__ import annotations
+
+from typing import Dict, List
+from typing import TYPE_CHECKING
+
+import time
+import random
+import asyncio
+
+if TYPE_CHECKING:
+    from peer import Peer
+    from .torrent_manager import TorrentManager
+
+
+class Choker:
+    """ Tit-for-tat choking
+
+    Every INTERVAL seconds the interested peers that gave us the most are
+    unchoked and every other peer is choked. While downloading the most is
+    what they sent us, while seeding it is what they took from us. One more
+    peer is unchoked optimistically, rotated every OPTIMISTIC_INTERVAL, so new
+    peers get a chance and we keep finding better ones.
+
+    A choker can be shared by several torrents, the slots are then shared by
+    the peers of all of them.
+    """
+    INTERVAL = 10
+    OPTIMISTIC_INTERVAL = 30
+
+    def __init__(self, slots: int = 4):
+        self.slots = slots
+
+        self._torrent_managers: List[TorrentManager] = []
+        self._optimistic: Peer | None = None
+        self._rounds = 0
+
+        # byte counts at the previous round are kept on each peer (see
+        # Peer.choke_snapshot), a peer that reconnects is a new Peer equal to
+        # its old self and starts from zero
+        self._last_time = time.monotonic()
+
+
+    def add(self, torrent_manager: TorrentManager):
+        self._torrent_managers.append(torrent_manager)
+
+
+    def remove(self, torrent_manager: TorrentManager):
+        if torrent_manager in self._torrent_managers:
+            self._torrent_managers.remove(torrent_manager)
+
+
+    @property
+    def peers(self) -> List[Peer]:
+        return [peer for tm in self._torrent_managers for peer in tm.peers]
+
+
+    async def run(self):
+        while True:
+            await asyncio.sleep(self.INTERVAL)
+            self.rechoke()
+
+
+    def peer_interested(self, peer: Peer):
+        """ Unchoke a peer that became interested right away if a slot is free """
+        if not peer.am_choking:
+            return
+
+        unchoked = sum(1 for p in self.peers if not p.am_choking)
+        if unchoked < self.slots + 1:
+            peer.unchoke()
+
+
+    def rechoke(self):
+        peers = self.peers
+
+        now = time.monotonic()
+        elapsed = max(now - self._last_time, 1e-3)
+
+        rates: Dict[Peer, float] = {}
+        for peer in peers:
+            downloaded, uploaded = peer.choke_snapshot
+            # what a peer can give us depends on its torrent
+            if peer.torrent_manager.seeding:
+                rates[peer] = (peer.uploaded - uploaded) / elapsed
+            else:
+                rates[peer] = (peer.downloaded - downloaded) / elapsed
+            peer.choke_snapshot = (peer.downloaded, peer.uploaded)
+
+        self._last_time = now
+
+        interested = sorted(
+            (peer for peer in peers if peer.is_interested), key=rates.get, reverse=True
+        )
+        unchoke = set(interested[:self.slots])
+
+        rotate = self._rounds % (self.OPTIMISTIC_INTERVAL // self.INTERVAL) == 0
+        self._rounds += 1
+        if rotate or self._optimistic not in interested or self._optimistic in unchoke:
+            candidates = [peer for peer in interested if peer not in unchoke]
+            self._optimistic = random.choice(candidates) if candidates else None
+
+        if self._optimistic is not None:
+            unchoke.add(self._optimistic)
+
+        for peer in peers:
+            if peer in unchoke:
+                peer.unchoke()
+            else:
+                peer.choke()
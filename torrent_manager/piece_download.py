@@ -0,0 +1,165 @@
+from __future__ import annotations
+
+from typing import Dict, Set, List, Tuple, TYPE_CHECKING
+
+import math
+import bitarray
+
+from bitarray.util import zeros
+
+from torrent import InfoDict
+
+if TYPE_CHECKING:
+    from peer import Peer
+
+
+class PieceDownload:
+    """ A piece being downloaded, shared by every peer requesting blocks of it
+
+    Blocks are normally requested from a single peer. In endgame the same block
+    may be requested from several peers, whoever delivers first wins and the
+    other requesters are returned so their requests can be cancelled.
+
+    Only one peer at a time receives a block in place (see block_buffer), the
+    others get it through the copy path. Once a block is accepted from someone
+    else, or the receiving peer is released, its body is sent to a scratch
+    buffer so nothing writes into the piece after it was accepted.
+    """
+    BLOCK_SIZE = 16384 # 16 KiB
+
+    def __init__(self, piece_nr: int, meta_info: InfoDict, buff: memoryview | None = None):
+        self.piece_nr = piece_nr
+        self.length = meta_info.get_piece_length(piece_nr)
+        self.hash = meta_info.get_hash(piece_nr)
+        # storage may let us download straight into the file
+        self.buff = buff if buff is not None else bytearray(self.length)
+        self.done = False # verified, saved or dropped
+
+        self._view = memoryview(self.buff)
+        self._total_blocks = math.ceil(self.length / self.BLOCK_SIZE)
+        self._received = zeros(self._total_blocks)
+        # requested from some peer or already received
+        self._taken = zeros(self._total_blocks)
+        # peers with an outstanding request for a block
+        self._requesters: Dict[int, Set[Peer]] = {}
+        # block -> peer receiving it in place and the view it writes into
+        self._receivers: Dict[int, Tuple[Peer, memoryview]] = {}
+
+
+    def block_length(self, offset: int) -> int:
+        return min(self.BLOCK_SIZE, self.length - offset)
+
+
+    def has_untaken(self) -> bool:
+        return not self._taken.all()
+
+
+    def is_complete(self) -> bool:
+        return self._received.all()
+
+
+    def next_block(self, peer: Peer, endgame: bool = False) -> int | None:
+        """ Offset of the next block to request to peer, None if there is none """
+        if self.done:
+            return None
+
+        block = self._taken.find(0)
+        if block != -1:
+            return block * self.BLOCK_SIZE
+
+        if not endgame:
+            return None
+
+        # request blocks in flight from other peers as well
+        for block in self._received.search(0):
+            if peer not in self._requesters.get(block, ()):
+                return block * self.BLOCK_SIZE
+
+        return None
+
+
+    def block_requested(self, offset: int, peer: Peer) -> None:
+        block = offset // self.BLOCK_SIZE
+        self._taken[block] = 1
+        self._requesters.setdefault(block, set()).add(peer)
+
+
+    def block_buffer(self, offset: int, length: int, peer: Peer) -> memoryview | None:
+        """ Slice of the piece buffer where peer receives the block at offset,
+        None if it is received already or someone else is receiving it
+        """
+        if self.done or offset % self.BLOCK_SIZE or offset >= self.length:
+            return None
+
+        block = offset // self.BLOCK_SIZE
+        if length != self.block_length(offset) or self._received[block] or block in self._receivers:
+            return None
+
+        dst = self._view[offset: offset + length]
+        self._receivers[block] = (peer, dst)
+        return dst
+
+
+    def receive_block(self, offset: int, data: memoryview, peer: Peer, in_place: bool = False) -> List[Peer] | None:
+        """ Store a block, returns the other peers that requested it or None if
+        the block wasn't accepted. in_place means the body was already received
+        into data, the view block_buffer handed to peer
+        """
+        if self.done or offset % self.BLOCK_SIZE or offset >= self.length:
+            return None
+
+        block = offset // self.BLOCK_SIZE
+        if self._received[block]:
+            return None
+
+        if in_place:
+            receiver = self._receivers.get(block)
+            if receiver is None or receiver[0] is not peer or receiver[1] is not data:
+                return None
+            del self._receivers[block]
+        else:
+            if len(data) != self.block_length(offset):
+                return None
+            # whoever is still receiving it in place must not write over it
+            self._discard(block)
+            self._view[offset: offset + len(data)] = data
+
+        self._received[block] = 1
+        self._taken[block] = 1
+
+        requesters = self._requesters.pop(block, set())
+        requesters.discard(peer)
+        return list(requesters)
+
+
+    def stop(self) -> None:
+        """ Done with the piece (verified, saved or dropped), nothing is
+        received into it anymore
+        """
+        self.done = True
+        for block in list(self._receivers):
+            self._discard(block)
+
+
+    def release(self, peer: Peer) -> None:
+        """ Forget the requests of a peer, blocks no one else requested can be
+        requested again
+        """
+        for block, (receiver, _) in list(self._receivers.items()):
+            if receiver is peer:
+                self._discard(block)
+
+        for block in list(self._requesters):
+            requesters = self._requesters[block]
+            requesters.discard(peer)
+            if not requesters:
+                del self._requesters[block]
+                if not self._received[block]:
+                    self._taken[block] = 0
+
+
+    def _discard(self, block: int) -> None:
+        """ Send the rest of a block being received in place to a scratch buffer """
+        receiver = self._receivers.pop(block, None)
+        if receiver is not None:
+            receiver[0].discard_block(self.piece_nr, block * self.BLOCK_SIZE)
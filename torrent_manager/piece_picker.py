@@ -0,0 +1,130 @@
+from typing import List
+
+import random
+import bitarray
+
+from bitarray.util import zeros
+
+
+class PiecePicker:
+    """ Rarest first piece picker
+
+    Keeps the swarm availability of every piece and buckets the pieces we still
+    need by availability. Every bucket is a bitarray mask, so a pick is a bitwise
+    AND with the peer bitfield over the rarest non empty buckets followed by a
+    C level search for a set bit. Ties are broken randomly by starting the
+    search at a random position.
+    """
+    def __init__(self, total_pieces: int):
+        self._total_pieces = total_pieces
+        self._availability: List[int] = [0] * total_pieces
+        # _buckets[n] holds the wanted pieces that n peers have
+        self._buckets: List[bitarray.bitarray] = [zeros(total_pieces)]
+        self._sizes: List[int] = [0]
+
+
+    def __len__(self) -> int:
+        """ Number of pieces we still want """
+        return sum(self._sizes)
+
+
+    def availability(self, idx: int) -> int:
+        return self._availability[idx]
+
+
+    def add(self, idx: int) -> None:
+        """ Start tracking piece as wanted """
+        if self._is_wanted(idx):
+            return
+
+        self._bucket_insert(idx, self._availability[idx])
+
+
+    def remove(self, idx: int) -> None:
+        """ Stop tracking piece (it is being downloaded or we have it) """
+        if not self._is_wanted(idx):
+            return
+
+        self._bucket_remove(idx, self._availability[idx])
+
+
+    def peer_has(self, idx: int) -> None:
+        """ A peer announced it has a piece """
+        count = self._availability[idx]
+        wanted = self._is_wanted(idx)
+        self._availability[idx] = count + 1
+
+        if wanted:
+            self._bucket_remove(idx, count)
+            self._bucket_insert(idx, count + 1)
+
+
+    def peer_lost(self, idx: int) -> None:
+        """ A peer that had a piece left """
+        count = self._availability[idx]
+        if count == 0:
+            return
+
+        wanted = self._is_wanted(idx)
+        self._availability[idx] = count - 1
+
+        if wanted:
+            self._bucket_remove(idx, count)
+            self._bucket_insert(idx, count - 1)
+
+
+    def add_bitfield(self, bitfield: bitarray.bitarray) -> None:
+        for idx in bitfield.search(1):
+            self.peer_has(idx)
+
+
+    def remove_bitfield(self, bitfield: bitarray.bitarray) -> None:
+        for idx in bitfield.search(1):
+            self.peer_lost(idx)
+
+
+    def pick(self, bitfield: bitarray.bitarray) -> int | None:
+        """ Rarest wanted piece the peer has, None if there is no such piece """
+        # bucket 0 holds pieces no one has
+        for count in range(1, len(self._buckets)):
+            if self._sizes[count] == 0:
+                continue
+
+            candidates = self._buckets[count] & bitfield
+            idx = random_set_bit(candidates)
+            if idx is not None:
+                return idx
+
+        return None
+
+
+    def _is_wanted(self, idx: int) -> bool:
+        count = self._availability[idx]
+        return count < len(self._buckets) and self._buckets[count][idx]
+
+
+    def _bucket_insert(self, idx: int, count: int) -> None:
+        while len(self._buckets) <= count:
+            self._buckets.append(zeros(self._total_pieces))
+            self._sizes.append(0)
+
+        self._buckets[count][idx] = 1
+        self._sizes[count] += 1
+
+
+    def _bucket_remove(self, idx: int, count: int) -> None:
+        self._buckets[count][idx] = 0
+        self._sizes[count] -= 1
+
+
+def random_set_bit(mask: bitarray.bitarray) -> int | None:
+    """ Index of a set bit of mask picked from a random starting point """
+    if not mask.any():
+        return None
+
+    start = random.randrange(len(mask))
+    idx = mask.find(1, start)
+    if idx == -1:
+        idx = mask.find(1, 0, start)
+
+    return idx
@@ -0,0 +1,56 @@
+from typing import Callable
+
+import asyncio
+
+from hashlib import sha1
+from concurrent.futures import ThreadPoolExecutor
+
+
+def _digest_matches(data: bytes, expected: bytes) -> bool:
+    # hashlib releases the GIL for big buffers so this scales across threads
+    return sha1(data).digest() == expected
+
+
+class PieceVerifier:
+    """ Verifies piece hashes on a bounded thread pool instead of the event loop
+
+    At most `max_queued` pieces wait for (or are being) hashed, `submit` waits
+    for a slot which slows down the peers feeding us when hashing can't keep up.
+    """
+    def __init__(self, workers: int = 2, max_queued: int | None = None):
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='pybt-hash')
+        self._slots = asyncio.Semaphore(max_queued or workers * 4)
+        self._queued = 0
+
+
+    @property
+    def queue_depth(self) -> int:
+        """ Pieces waiting for or being hashed """
+        return self._queued
+
+
+    async def submit(self, data: bytes, expected: bytes, callback: Callable[[bool], None]) -> None:
+        """ Schedule a piece verification, callback is called on the event loop
+        with the result
+        """
+        await self._slots.acquire()
+        self._queued += 1
+
+        loop = asyncio.get_running_loop()
+        fut = loop.run_in_executor(self._executor, _digest_matches, data, expected)
+        fut.add_done_callback(lambda f: self._done(f, callback))
+
+
+    def close(self) -> None:
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+
+    def _done(self, fut: asyncio.Future, callback: Callable[[bool], None]) -> None:
+        self._queued -= 1
+        self._slots.release()
+
+        if fut.cancelled():
+            return
+
+        # an exception would mean a bug, treat it as a bad piece
+        callback(fut.exception() is None and fut.result())
@@ -0,0 +1,148 @@
+from typing import List
+
+import struct
+import unittest
+
+from protocol import MessageOP
+from torrent import InfoDict
+from peer.peer_protocol import PeerWireProtocol, InPlaceBlock
+
+from .piece_download import PieceDownload
+
+
+BLOCK = PieceDownload.BLOCK_SIZE
+
+
+class TransportStandIn:
+    """ The parts of a transport PeerWireProtocol uses while receiving """
+    def pause_reading(self):
+        pass
+
+    def resume_reading(self):
+        pass
+
+    def abort(self):
+        pass
+
+    def is_closing(self) -> bool:
+        return False
+
+
+class PeerStandIn:
+    """ A peer receiving blocks of a download through its own protocol """
+    def __init__(self, download: PieceDownload):
+        self.protocol = PeerWireProtocol()
+        self.protocol.block_sink = lambda idx, offset, length: download.block_buffer(offset, length, self)
+        self.protocol.connection_made(TransportStandIn())
+        self.feed(bytes(PeerWireProtocol.HANDSHAKE_SIZE))
+
+
+    def discard_block(self, index: int, offset: int):
+        self.protocol.discard_block(index, offset)
+
+
+    def feed(self, data: bytes):
+        """ Hand data to the protocol the way the event loop does """
+        view = memoryview(data)
+        while view:
+            buf = self.protocol.get_buffer(len(view))
+            n = min(len(buf), len(view))
+            buf[:n] = view[:n]
+            self.protocol.buffer_updated(n)
+            view = view[n:]
+
+
+    def close(self):
+        self.protocol.connection_lost(None)
+
+
+def piece_message(index: int, offset: int, body: bytes) -> bytes:
+    return struct.pack('>IBII', 9 + len(body), MessageOP.PIECE, index, offset) + body
+
+
+class InPlaceReceiveTest(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        meta_info = InfoDict(**{
+            'name': b'test.bin',
+            'length': 2 * BLOCK,
+            'piece length': 2 * BLOCK,
+            'pieces': bytes(20),
+        })
+        self.download = PieceDownload(0, meta_info)
+        self.a = PeerStandIn(self.download)
+        self.b = PeerStandIn(self.download)
+        for peer in (self.a, self.b):
+            self.download.block_requested(0, peer)
+
+
+    async def asyncTearDown(self):
+        for peer in (self.a, self.b):
+            peer.close()
+
+
+    async def receive(self, peer: PeerStandIn) -> List[PeerStandIn] | None:
+        """ What the peer state does with the next PIECE of peer """
+        op_code, payload = await peer.protocol.read_message()
+        self.assertEqual(op_code, MessageOP.PIECE)
+        if isinstance(payload, InPlaceBlock):
+            return self.download.receive_block(0, payload.dst, peer, in_place=True)
+
+        return self.download.receive_block(0, payload[8:], peer)
+
+
+    async def test_interleaved_in_place_receivers(self):
+        body_a, body_b = b'a' * BLOCK, b'b' * BLOCK
+        msg_a, msg_b = piece_message(0, 0, body_a), piece_message(0, 0, body_b)
+
+        # both headers arrive before either body is complete, only the first
+        # peer gets to receive in place
+        self.a.feed(msg_a[:1000])
+        self.b.feed(msg_b[:1000])
+        self.b.feed(msg_b[1000:])
+
+        self.assertEqual(await self.receive(self.b), [self.a])
+        self.assertEqual(bytes(self.download.buff[:BLOCK]), body_b)
+
+        # the rest of the first body no longer lands in the piece
+        self.a.feed(msg_a[1000:])
+        self.assertIsNone(await self.receive(self.a))
+        self.assertEqual(bytes(self.download.buff[:BLOCK]), body_b)
+
+
+    async def test_released_receiver_writes_to_scratch(self):
+        msg = piece_message(0, 0, b'a' * BLOCK)
+        self.a.feed(msg[:1000])
+
+        self.download.release(self.a)
+        self.a.feed(msg[1000:])
+
+        op_code, payload = await self.a.protocol.read_message()
+        self.assertNotIsInstance(payload, InPlaceBlock)
+        self.assertEqual(bytes(payload[8:]), b'a' * BLOCK)
+        self.assertEqual(bytes(self.download.buff[1000 - 13: BLOCK]), bytes(BLOCK - 987))
+
+
+    async def test_stopped_download_is_left_alone(self):
+        msg = piece_message(0, 0, b'a' * BLOCK)
+        self.a.feed(msg[:1000])
+
+        self.download.stop()
+        self.a.feed(msg[1000:])
+
+        self.assertIsNone(await self.receive(self.a))
+        self.assertEqual(bytes(self.download.buff[1000 - 13: BLOCK]), bytes(BLOCK - 987))
+
+
+    async def test_in_place_block_from_a_released_request(self):
+        # received completely but handled only after the peer was released and
+        # asked for the block again
+        self.a.feed(piece_message(0, 0, b'a' * BLOCK))
+        self.download.release(self.a)
+        self.download.block_requested(0, self.a)
+        self.assertIsNotNone(self.download.block_buffer(0, BLOCK, self.a))
+
+        self.assertIsNone(await self.receive(self.a))
+
+
+if __name__ == '__main__':
+    unittest.main()
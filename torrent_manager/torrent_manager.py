@@ -1,12 +1,14 @@
 from __future__ import annotations
 
-from typing import Protocol, Any, List
+from typing import Protocol, Any, BinaryIO, List, Dict, Set, Container, Tuple
 from typing import TYPE_CHECKING
 
 import math
 import asyncio
 import bitarray
 
+from bitarray.util import zeros, any_and
+
 from enum import Enum
 
 from file_manager.single_file_manager import SingleFileManager 
@@ -14,6 +16,10 @@ if TYPE_CHECKING:
     from peer import Peer
 
 from .torrent_status import TorrentStatus
+from .piece_picker import PiecePicker
+from .piece_download import PieceDownload
+from .piece_verifier import PieceVerifier
+from .choker import Choker
 
 class PieceState(Enum):
     MISSING = 0
@@ -21,64 +27,256 @@ class PieceState(Enum):
     COMPLETE = 2
 
 class TorrentManager:
-    def __init__(self, meta_info: InfoDict, file_manager: SingleFileManager, torrent_status: TorrentStatus):
+    MAX_UPLOAD_BLOCK = 128 * 1024 # bigger requests are refused
+
+    def __init__(
+        self, 
+        meta_info: InfoDict, 
+        file_manager: SingleFileManager, 
+        torrent_status: TorrentStatus,
+        verifier: PieceVerifier | None = None,
+        seed: bool = False,
+        upload_slots: int = 4,
+        choker: Choker | None = None
+    ):
         self._status = torrent_status
         self._meta_info    = meta_info
         self._file_manager = file_manager 
-        self._endgame = False
+        self._verifier     = verifier or PieceVerifier()
+
+        self._total_pieces = meta_info.total_pieces
+
+        # piece state masks, a piece is set in exactly one of them
+        self._missing = zeros(self._total_pieces)
+        self._pending = zeros(self._total_pieces)
+        self._complete = torrent_status.pieces
+        self._missing.setall(1)
+        self._missing &= ~self._complete
 
-        self._total_pieces = math.ceil(meta_info['length'] / meta_info['piece length'])
-        self._pieces_state = [PieceState.MISSING] * self._total_pieces 
-        self._dl_pieces = 0
+        self._picker = PiecePicker(self._total_pieces)
+        for idx in self._missing.search(1):
+            self._picker.add(idx)
 
-        self._first_missing_idx = 0
+        # pieces being downloaded and the ones no peer is requesting blocks of
+        self._downloading: Dict[int, PieceDownload] = {}
+        self._orphans: Set[int] = set()
+
+        # connected peers, we upload to the ones the choker unchokes
+        self.peers: Set[Peer] = set()
+        self.choker = choker or Choker(upload_slots)
+        self.choker.add(self)
+
+        # set once we are done, never when seeding
+        self._seed = seed
         self.end = asyncio.Event()
+        if self._complete.all() and not seed:
+            self.end.set()
+
+
+    def piece_state(self, idx: int) -> PieceState:
+        if self._complete[idx]:
+            return PieceState.COMPLETE
+        if self._pending[idx]:
+            return PieceState.PENDING
+
+        return PieceState.MISSING
+
+
+    @property
+    def pieces(self) -> bitarray.bitarray:
+        """ Pieces we have """
+        return self._complete
+
+
+    @property
+    def status(self) -> TorrentStatus:
+        return self._status
+
+
+    @property
+    def seeding(self) -> bool:
+        return self._complete.all()
+
+
+    @property
+    def endgame(self) -> bool:
+        """ Every block left has been requested from some peer """
+        if self._missing.any() or self._orphans:
+            return False
+
+        return not any(d.has_untaken() for d in self._downloading.values())
+
+
+    def has_interest(self, bitfield: bitarray.bitarray) -> bool:
+        """ If the peer has any piece we could request """
+        if any_and(bitfield, self._missing):
+            return True
+
+        if any(bitfield[idx] for idx in self._orphans):
+            return True
+
+        # pending pieces waiting for their hash check have nothing to request
+        return self.endgame and any(bitfield[idx] for idx in self._downloading)
 
 
     def get_pieces(self, bitfield: bitarray.bitarray) -> int | None:
-        """ Get pieces to request to a peer """
-        for idx in range(self._first_missing_idx, self._total_pieces):
-            if bitfield[idx]:
-                if self._pieces_state[idx] == PieceState.MISSING:
-                    self._pieces_state[idx] = PieceState.PENDING
+        """ Get a new piece to request to a peer """
+        idx = self._picker.pick(bitfield)
+        if idx is not None:
+            self._set_state(idx, PieceState.PENDING)
+
+        return idx
+
+
+    def schedule(self, bitfield: bitarray.bitarray, exclude: Container[int]) -> PieceDownload | None:
+        """ Piece a peer should request blocks of, pieces in exclude are already
+        being requested by it
+        """
+        # finish pieces other peers left behind first
+        for idx in self._orphans:
+            if bitfield[idx] and idx not in exclude:
+                self._orphans.discard(idx)
+                return self._downloading[idx]
+
+        idx = self.get_pieces(bitfield)
+        if idx is not None:
+            download = PieceDownload(idx, self._meta_info, self._file_manager.piece_buffer(idx))
+            self._downloading[idx] = download
+            return download
+
+        # help with blocks of pieces other peers haven't requested yet
+        for idx, download in self._downloading.items():
+            if bitfield[idx] and idx not in exclude and download.has_untaken():
+                return download
+
+        if not self.endgame:
+            return None
+
+        # request blocks already requested from other peers
+        for idx, download in self._downloading.items():
+            if bitfield[idx] and idx not in exclude:
+                return download
 
-                    # enter endgame mode
-                    if idx == self._total_pieces - 1:
-                        self._endgame = True
-                        self._first_missing_idx = 0
+        return None
 
-                    return idx
 
-                if self._endgame and self._pieces_state[idx] != PieceState.COMPLETE:
-                    self._pieces_state[idx] = PieceState.PENDING
-                    return idx
-          
-        return None 
+    def release(self, download: PieceDownload, peer: Peer):
+        """ Peer won't deliver the blocks it requested (choked or disconnected) """
+        download.release(peer)
+        if not download.done and download.has_untaken():
+            self._orphans.add(download.piece_nr)
+
+
+    async def finish_piece(self, download: PieceDownload):
+        """ Verify a piece once all its blocks are received, the piece is saved 
+        or enqueued back once the hash is checked off the event loop
+        """
+        download.stop()
+        self._downloading.pop(download.piece_nr, None)
+        self._orphans.discard(download.piece_nr)
+
+        def verified(ok: bool):
+            if ok:
+                self.save_piece(download.piece_nr, download.buff)
+            else:
+                self._status.add_hash_failure(download.length)
+                self.put_pieces(download.piece_nr)
+
+        # slow down when the disk can't keep up
+        await self._file_manager.drain()
+        await self._verifier.submit(download.buff, download.hash, verified)
 
     
     def put_pieces(self, n: int):
         """ Enqueue back pieces that couldn't be retrieved """
-        self._pieces_state[n] = PieceState.MISSING
+        if self._complete[n]:
+            return
+
+        download = self._downloading.pop(n, None)
+        if download is not None:
+            download.stop()
+        self._orphans.discard(n)
+
+        self._set_state(n, PieceState.MISSING)
+
+        # idle peers only look for work when they get a message
+        for peer in self.peers:
+            if peer.bitfield[n]:
+                peer.wake()
+
+
+    def add_peer(self, peer: Peer):
+        self.peers.add(peer)
+
+
+    def remove_peer(self, peer: Peer):
+        self.peers.discard(peer)
+
+
+    def upload_block(self, index: int, offset: int, length: int) -> List[Tuple[BinaryIO, int, int]] | memoryview | None:
+        """ Block a peer requested, as file spans to sendfile when the storage 
+        allows it or else as a memoryview. None if we don't have it or the 
+        request is invalid. The caller accounts the upload once it is sent
+        """
+        if index >= self._total_pieces or not self._complete[index]:
+            return None
+
+        if length <= 0 or length > self.MAX_UPLOAD_BLOCK:
+            return None
+
+        if offset < 0 or offset + length > self._meta_info.get_piece_length(index):
+            return None
+
+        files = self._file_manager.block_files(index, offset, length)
+        if files is not None:
+            return files
+
+        piece = self._file_manager.read_piece(index)
+        return memoryview(piece)[offset: offset + length]
+
+
+    def peer_has(self, idx: int):
+        """ Update piece availability from a peer HAVE message """
+        self._picker.peer_has(idx)
+
+
+    def peer_bitfield(self, bitfield: bitarray.bitarray):
+        """ Update piece availability from a peer BITFIELD message """
+        self._picker.add_bitfield(bitfield)
+
+
+    def peer_gone(self, bitfield: bitarray.bitarray):
+        """ Update piece availability when a peer disconnects """
+        self._picker.remove_bitfield(bitfield)
     
 
     def save_piece(self, piece_nr:int, piece: bytes):
-        if self._pieces_state[piece_nr] != PieceState.PENDING:
+        if not self._pending[piece_nr]:
             return
 
         self._file_manager.write_piece(piece_nr, piece)
-        self._pieces_state[piece_nr] = PieceState.COMPLETE
-        self._dl_pieces += 1
-        self._status._downloaded += 1
-
-        print(f"({(self._dl_pieces * 100) / self._total_pieces :.2f}%) Got piece {piece_nr}")
-
-        if not self._endgame and self._first_missing_idx == piece_nr:
-            for idx in range(self._first_missing_idx, self._total_pieces):
-                if self._pieces_state[idx] == PieceState.MISSING:
-                    self._first_missing_idx = idx
-                    break
-        
-        if self._dl_pieces == self._total_pieces:
-            print("Download finished")
-            self.end.set()
+        self._set_state(piece_nr, PieceState.COMPLETE)
+
+        for peer in self.peers:
+            peer.send_have(piece_nr)
+
+        dl_pieces = self._complete.count()
+        print(f"({(dl_pieces * 100) / self._total_pieces :.2f}%) Got piece {piece_nr}")
+
+        if dl_pieces == self._total_pieces:
+            if self._seed:
+                print("Download finished, seeding")
+            else:
+                print("Download finished")
+                self.end.set()
+
+
+    def _set_state(self, idx: int, state: PieceState):
+        self._missing[idx] = state == PieceState.MISSING
+        self._pending[idx] = state == PieceState.PENDING
+        self._complete[idx] = state == PieceState.COMPLETE
 
+        if state == PieceState.MISSING:
+            self._picker.add(idx)
+        else:
+            self._picker.remove(idx)
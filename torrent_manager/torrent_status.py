@@ -1,20 +1,63 @@
+import time
+import bitarray
+
+from bitarray.util import zeros
+
 from torrent import InfoDict
+from metrics import Histogram, RateMeter, RTT_BOUNDS
 
 class TorrentStatus:
     def __init__(self, meta_info: InfoDict):
         self._meta_info = meta_info
-        self._downloaded = 0
-        self._uploaded = 0
+        self._uploaded = 0 # bytes
+        # pieces we have, owned by TorrentManager
+        self.pieces: bitarray.bitarray = zeros(meta_info.total_pieces)
+
+        # block payload received, wasted is the part of it that was of no use
+        # (unrequested or duplicate blocks, pieces failing their hash)
+        self.received = 0
+        self.wasted = 0
+        self.hash_failures = 0
+        self.last_received = time.monotonic()
+
+        self.download_rate = RateMeter()
+        self.upload_rate = RateMeter()
+        self.block_rtt = Histogram(RTT_BOUNDS)
 
     @property
     def downloaded(self):
-        return self._downloaded * self._meta_info['piece length']
+        return self._bytes(self.pieces.count())
 
     @property
     def uploaded(self):
-        return self._uploaded * self._meta_info['piece length']
+        return self._uploaded
+
+    def add_uploaded(self, n: int):
+        self._uploaded += n
+        self.upload_rate.add(n)
+
+    def add_received(self, n: int, wasted: bool = False):
+        self.received += n
+        if wasted:
+            self.wasted += n
+        else:
+            self.download_rate.add(n)
+            self.last_received = time.monotonic()
+
+    def add_hash_failure(self, n: int):
+        """ A piece of n bytes didn't match its hash """
+        self.hash_failures += 1
+        self.wasted += n
 
     @property
     def left(self):
-        return (self._meta_info.total_pieces - self._downloaded) * self._meta_info['piece length']
-    
+        return self._bytes(self._meta_info.total_pieces) - self.downloaded
+
+    def _bytes(self, n_pieces: int) -> int:
+        """ Size of n pieces, accounting for the shorter last piece if we have it """
+        size = n_pieces * self._meta_info['piece length']
+        last = self._meta_info.total_pieces - 1
+        if n_pieces and (n_pieces == last + 1 or self.pieces[last]):
+            size -= self._meta_info['piece length'] - self._meta_info.get_piece_length(last)
+
+        return size
@@ -1,2 +1,3 @@
-from .tracker import Tracker, PeerAddr
-from .tracker_exception import TrackerException
\ No newline at end of file
+from .tracker import Tracker, PeerAddr, CompactPeer
+from .tracker_exception import TrackerException
+from .compact import compact_peers, peer_from_compact
@@ -0,0 +1,99 @@
+from typing import Tuple
+
+import time
+import random
+
+
+class AnnounceScheduler:
+    """ Decides when to announce next to a tracker (or a tier of them)
+
+    With as many peers as we want the tracker interval is followed. With less,
+    the next announce comes sooner, down to the min interval when we have no
+    peers at all, unless the swarm counts (from announces or a scrape) say
+    there is nobody there we aren't already connected to. The min interval the
+    tracker gave is never undercut. Failed announces are retried with an
+    exponential backoff.
+    """
+    MIN_INTERVAL = 60 # when the tracker doesn't give one
+    SWARM_TTL = 300 # seconds the swarm counts are trusted for
+    BACKOFF_BASE = 15
+    MAX_BACKOFF = 1800
+
+    def __init__(self, wanted_peers: int):
+        self._wanted_peers = max(1, wanted_peers)
+
+        self._interval = self.MIN_INTERVAL
+        self._min_interval = self.MIN_INTERVAL
+        self._last_announce: float | None = None
+
+        self._failures = 0
+        self._retry_at = 0.0
+
+        self._swarm: Tuple[int, int] | None = None # seeders, leechers
+        self._swarm_at = 0.0
+
+
+    def announced(self, interval: int, min_interval: int | None, swarm: Tuple[int, int] | None):
+        self._last_announce = time.monotonic()
+        if min_interval is None:
+            min_interval = min(max(1, interval), self.MIN_INTERVAL)
+        self._min_interval = min_interval
+        self._interval = max(1, interval, min_interval)
+        self._failures = 0
+
+        if swarm is not None:
+            self.scraped(swarm)
+
+
+    def failed(self):
+        self._failures += 1
+        backoff = min(self.BACKOFF_BASE * 2 ** (self._failures - 1), self.MAX_BACKOFF)
+        # jitter keeps torrents that failed together from retrying together
+        self._retry_at = time.monotonic() + backoff * random.uniform(0.8, 1.2)
+
+
+    def scraped(self, swarm: Tuple[int, int] | None):
+        """ Swarm counts, None if the scrape failed (we won't ask again for a while) """
+        self._swarm = swarm
+        self._swarm_at = time.monotonic()
+
+
+    def needs_scrape(self, connected: int) -> bool:
+        """ If the swarm counts should be refreshed before announcing early """
+        if self._failures or self._last_announce is None or connected >= self._wanted_peers:
+            return False
+
+        return time.monotonic() - self._swarm_at > self.SWARM_TTL
+
+
+    def next_announce(self, connected: int, seeding: bool) -> float:
+        """ time.monotonic() deadline of the next announce """
+        if self._failures:
+            return self._retry_at
+
+        if self._last_announce is None:
+            return 0.0
+
+        delay = self._interval
+        if connected < self._wanted_peers and self._worth_it(connected, seeding):
+            # the fewer peers we have the sooner we ask for more
+            fraction = connected / self._wanted_peers
+            delay = self._min_interval + (self._interval - self._min_interval) * fraction
+
+        return self._last_announce + delay
+
+
+    def _worth_it(self, connected: int, seeding: bool) -> bool:
+        """ If the tracker may know peers we aren't connected to """
+        if self._swarm is None or time.monotonic() - self._swarm_at > self.SWARM_TTL:
+            return True
+
+        seeders, leechers = self._swarm
+        if seeding:
+            # seeds have nothing to give to another seed
+            others = leechers
+        else:
+            # we are one of the leechers
+            others = seeders + leechers - 1
+
+        return others > connected
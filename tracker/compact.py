@@ -0,0 +1,25 @@
+from typing import List
+
+from socket import inet_ntop, AF_INET, AF_INET6
+
+from .tracker import PeerAddr, CompactPeer
+
+# packed IP + 2 byte port
+IPV4_PEER_SIZE = 6
+IPV6_PEER_SIZE = 18
+
+
+def compact_peers(raw: bytes, size: int = IPV4_PEER_SIZE) -> List[CompactPeer]:
+    """ Split a compact peer list (BEP 23, BEP 7 for IPv6) into its entries,
+    ignoring a trailing partial one. Entries are only decoded when dialed
+    """
+    end = len(raw) - len(raw) % size
+    return [raw[i:i + size] for i in range(0, end, size)]
+
+
+def peer_from_compact(peer: CompactPeer) -> PeerAddr:
+    family = AF_INET if len(peer) == IPV4_PEER_SIZE else AF_INET6
+    return PeerAddr(
+        ip = inet_ntop(family, peer[:-2]),
+        port = int.from_bytes(peer[-2:], 'big')
+    )
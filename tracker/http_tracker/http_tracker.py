@@ -1,20 +1,22 @@
-from typing import List, Tuple
+from typing import Any, Dict, List, Tuple
 
 import bencode
 import aiohttp
 
+from bencode.decode import BencodeDecodingError
+
 from urllib.parse import urlencode 
 from hashlib import sha1
-from ipaddress import ip_address
-from struct import unpack
 
 
 from client import Client
 
 from tracker import (
     Tracker, 
-    PeerAddr
+    CompactPeer,
+    compact_peers
 )
+from tracker.compact import IPV6_PEER_SIZE
 
 from torrent_manager import TorrentStatus
 from file_manager import FileManager
@@ -32,44 +34,130 @@ from .http_tracker_exceptions import (
 
 from .http_tracker_response import HTTPTrackerResponse
 
-from .utils import peer_lst_f_raw_str
+class _RawKeysDecoder(bencode.Decoder):
+    """ Decoder that keeps dictionary keys as bytes, the files of a scrape
+    response are keyed by raw info hashes which aren't text
+    """
+    def decode_dict(self) -> Dict[bytes, Any]:
+        # discard 'd' begin token
+        self._index += 1
+        dic = {}
+        while self._current_byte() != b'e':
+            # keys are strings, anything else (or the end of the data) is an error
+            if not self._current_byte().isdigit():
+                raise BencodeDecodingError(f'Invalid key at position {self._index}')
+
+            key = self.decode_str()
+            dic[key] = self.decode()
+        # discard 'e' end token
+        self._index += 1
+        return dic
+
 
 class HTTPTracker(Tracker):
-    def __init__(self, client: Client, torrent: TorrentFile, status: TorrentStatus):
+    """ HTTP tracker client
+
+    announce defaults to the torrent announce URL. A session can be shared 
+    between trackers, it is only closed here if it was created here
+    """
+    def __init__(
+        self, 
+        client: Client, 
+        torrent: TorrentFile, 
+        status: TorrentStatus,
+        announce: bytes | None = None,
+        session: aiohttp.ClientSession | None = None
+    ):
         self._client         = client
         self._torrent        = torrent
-        self._http_session   = aiohttp.ClientSession()
+        self._announce       = announce or torrent['announce']
+        self._own_session    = session is None
+        self._http_session   = session or aiohttp.ClientSession()
         self._event_state    = 'started'
         self._status         = status
     
 
-    async def get_peers(self) -> Tuple[List[PeerAddr], int]:
-        try:
-            raw_response = await self._request_tracker()
-        except HTTPTrackerException:
-            # TODO implement multi announce logic
-            raise
+    async def get_peers(self) -> Tuple[List[CompactPeer], int]:
+        raw_response = await self._request_tracker()
 
         try:
             tracker_response = HTTPTrackerResponse(**bencode.loads(raw_response))
-        except (bencode.BencodeDecodingError, InvalidResponseException) as e:
-            raise HTTPTrackerException
+        except (ValueError, TypeError, InvalidResponseException) as e:
+            raise BadResponseException(f"Can't decode tracker response {e!r}")
 
         if tracker_response['failure reason']:
             self._handle_failure(tracker_response['failure reason'])
-            return None, 10 
 
-        return peer_lst_f_raw_str(tracker_response['peers']), tracker_response['interval']
+        # only the first announce is the started event
+        self._event_state = None
 
+        if isinstance(tracker_response['min interval'], int):
+            self.min_interval = tracker_response['min interval']
+        if isinstance(tracker_response['complete'], int) and isinstance(tracker_response['incomplete'], int):
+            self.swarm = (tracker_response['complete'], tracker_response['incomplete'])
 
-    async def close(self) -> None:
+        peers = compact_peers(tracker_response['peers'] or b'')
+        peers += compact_peers(tracker_response['peers6'] or b'', IPV6_PEER_SIZE)
+        return peers, tracker_response['interval']
+
+
+    async def scrape(self) -> Tuple[int, int] | None:
+        """ Seeders and leechers from the scrape convention URL, None if the 
+        announce URL doesn't follow it
+        """
+        url = self._announce.decode('utf-8')
+        last = url.rfind('/')
+        if not url.startswith('/announce', last):
+            return None
+
+        url = url[:last] + '/scrape' + url[last + len('/announce'):]
+        url += ('&' if '?' in url else '?') + urlencode({'info_hash': self._torrent.info_hash})
         try:
-            resp = await self._http_session.get(self._build_request('stopped'))
-        except Exception as e:
-            # at this point we don't care if we fail
-            print(str(e), flush=True)
+            async with self._http_session.get(url) as resp:
+                if resp.status != 200:
+                    return None
+                raw_response = await resp.read()
+        except Exception:
+            return None
+
+        try:
+            response = _RawKeysDecoder(raw_response).decode()
+        except (ValueError, TypeError, IndexError):
+            return None
+        if not isinstance(response, dict):
+            return None
+
+        if b'failure reason' in response:
+            reason = response[b'failure reason']
+            if isinstance(reason, bytes):
+                reason = reason.decode('utf-8', 'replace')
+            print(f'Tracker refused our scrape: {reason}', flush=True)
+            return None
+
+        files = response.get(b'files')
+        counts = files.get(self._torrent.info_hash) if isinstance(files, dict) else None
+        if not isinstance(counts, dict):
+            return None
+
+        complete, incomplete = counts.get(b'complete'), counts.get(b'incomplete')
+        if not isinstance(complete, int) or not isinstance(incomplete, int):
+            return None
+
+        return complete, incomplete
+
+
+    async def close(self) -> None:
+        # the tracker never heard of us if it didn't answer our first announce
+        if self._event_state is None:
+            try:
+                async with self._http_session.get(self._build_request('stopped')):
+                    pass
+            except Exception as e:
+                # at this point we don't care if we fail
+                print(str(e), flush=True)
         
-        await self._http_session.close()
+        if self._own_session:
+            await self._http_session.close()
         
         return
 
@@ -83,14 +171,18 @@ class HTTPTracker(Tracker):
                 
                 return await resp.read()
 
+        except HTTPTrackerException:
+            raise
         except aiohttp.ClientConnectionError as e:
-            raise DeadTrackerException(e.host)
+            raise DeadTrackerException(str(e))
         except Exception as e:
             raise GeneralException(e)
 
 
-    def _build_request(self, event: str) -> str:
-        """ Build GET request to Tracker with specified event """
+    def _build_request(self, event: str | None) -> str:
+        """ Build GET request to Tracker with specified event (None for regular
+        announces)
+        """
         params = {
             'info_hash':  self._torrent.info_hash,
             'peer_id':    self._client.id,
@@ -99,10 +191,15 @@ class HTTPTracker(Tracker):
             'uploaded':   self._status.uploaded,
             'left':       self._status.left,
             'compact':    1,
-            'event':      event,
         }
+        if event is not None:
+            params['event'] = event
+
+        url = self._announce.decode('utf-8')
+        return url + ('&' if '?' in url else '?') + urlencode(params)
 
-        return self._torrent['announce'].decode('utf-8') + '?' + urlencode(params)
+    def _handle_failure(self, failure_reason: str | bytes):
+        if isinstance(failure_reason, bytes):
+            failure_reason = failure_reason.decode('utf-8', 'replace')
 
-    def _handle_failure(self, failure_reason: str):
-        raise NotImplementedError
+        raise RequestRejectedException(f'Tracker refused our announce: {failure_reason}')
@@ -6,23 +6,26 @@ class InvalidResponseException(KeyError):
     """
 
 class HTTPTrackerResponse:
-    __resp_keys = {'peers', 'interval'}
+    __resp_keys = {'interval'}
+    # one of them at least, peers6 are IPv6 peers (BEP 7)
+    __peers_keys = {'peers', 'peers6'}
     __failure_keys = {'failure reason'}
 
     def __init__(self, **kwargs):
         self._inner_dict = kwargs
 
-        if self.__resp_keys - set(kwargs.keys()):
+        if self.__resp_keys - set(kwargs.keys()) or not self.__peers_keys & set(kwargs.keys()):
             if self.__failure_keys - set(kwargs.keys()):
                 raise InvalidResponseException('Invalid keys in Tracker response')
 
-            if not isinstance(kwargs['failure reason'], str):
+            if not isinstance(kwargs['failure reason'], (str, bytes)):
                 raise InvalidResponseException('Unexpected failure reason')
 
             return
             
-        if not isinstance(kwargs['peers'], bytes):
-            raise InvalidResponseException('Invalid "peers" key')
+        for key in self.__peers_keys & set(kwargs.keys()):
+            if not isinstance(kwargs[key], bytes):
+                raise InvalidResponseException(f'Invalid "{key}" key')
         
         if not isinstance(kwargs['interval'], int):
             raise InvalidResponseException('Invalid "interval" key')
@@ -0,0 +1,111 @@
+from typing import List
+
+import bencode
+import unittest
+
+from types import SimpleNamespace
+from aiohttp import web
+
+from client import Client
+
+from .http_tracker import HTTPTracker
+
+
+class LoopbackScrapeServer:
+    """ Stand-in HTTP tracker on loopback answering scrapes with body """
+    def __init__(self):
+        self.body = b''
+        self.paths: List[str] = [] # path of every request
+
+        self._runner: web.AppRunner | None = None
+
+
+    async def start(self) -> int:
+        """ Start listening, returns the port """
+        app = web.Application()
+        app.router.add_get('/{tail:.*}', self._handle)
+        self._runner = web.AppRunner(app)
+        await self._runner.setup()
+
+        site = web.TCPSite(self._runner, '127.0.0.1', 0)
+        await site.start()
+        return self._runner.addresses[0][1]
+
+
+    async def close(self):
+        await self._runner.cleanup()
+
+
+    async def _handle(self, request: web.Request) -> web.Response:
+        self.paths.append(request.path)
+        return web.Response(body=self.body)
+
+
+class TorrentStandIn(dict):
+    """ The parts of a TorrentFile a tracker uses """
+    def __init__(self, announce: bytes):
+        super().__init__(announce=announce)
+        # not valid utf-8, like most info hashes
+        self.info_hash = bytes(range(236, 256))
+
+
+class HTTPScrapeTest(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.server = LoopbackScrapeServer()
+        self.port = await self.server.start()
+        self.trackers: List[HTTPTracker] = []
+
+
+    async def asyncTearDown(self):
+        for tracker in self.trackers:
+            await tracker.close()
+        await self.server.close()
+
+
+    def tracker(self, path: str = '/announce') -> HTTPTracker:
+        tracker = HTTPTracker(
+            Client(6881),
+            TorrentStandIn(f'http://127.0.0.1:{self.port}{path}'.encode()),
+            SimpleNamespace(downloaded=0, left=1000, uploaded=0)
+        )
+        self.trackers.append(tracker)
+        return tracker
+
+
+    async def test_scrape(self):
+        tracker = self.tracker()
+        other = bytes(range(20))
+        self.server.body = bencode.dumps({'files': {}})[:-2] + (
+            # another torrent with the same counts keys comes first
+            b'20:' + other + b'd8:completei9e10:downloadedi0e10:incompletei9ee'
+            b'20:' + tracker._torrent.info_hash + b'd8:completei5e10:downloadedi7e10:incompletei3ee'
+            b'ee'
+        )
+
+        self.assertEqual(await tracker.scrape(), (5, 3))
+        self.assertEqual(self.server.paths, ['/scrape'])
+
+
+    async def test_failure_reason_is_no_counts(self):
+        tracker = self.tracker()
+        self.server.body = bencode.dumps({'failure reason': b'scrape not supported'})
+
+        self.assertIsNone(await tracker.scrape())
+
+
+    async def test_torrent_missing_from_files(self):
+        tracker = self.tracker()
+        self.server.body = bencode.dumps({'files': {}})
+
+        self.assertIsNone(await tracker.scrape())
+
+
+    async def test_no_scrape_convention(self):
+        tracker = self.tracker('/tracker')
+
+        self.assertIsNone(await tracker.scrape())
+        self.assertEqual(self.server.paths, [])
+
+
+if __name__ == '__main__':
+    unittest.main()
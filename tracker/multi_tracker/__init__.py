@@ -0,0 +1 @@
+from .multi_tracker import MultiTracker
\ No newline at end of file
@@ -0,0 +1,226 @@
+from typing import AsyncIterator, Dict, List, Tuple
+
+import time
+import random
+import asyncio
+import aiohttp
+
+from client import Client
+
+from tracker import (
+    Tracker,
+    CompactPeer,
+    TrackerException
+)
+
+from torrent_manager import TorrentStatus
+from torrent import TorrentFile
+
+from tracker.http_tracker import HTTPTracker
+from tracker.udp_tracker import UDPTracker
+from tracker.announce_scheduler import AnnounceScheduler
+
+
+class MultiTracker(Tracker):
+    """ Announces to every tier of the announce-list at once (BEP 12)
+
+    Within a tier trackers are tried in order until one answers, which is then
+    moved to the front of its tier. Tiers are shuffled once as the BEP says and
+    announced to concurrently, peers are handed out as soon as a tier answers
+    so a dead tracker doesn't hold back the others. HTTP trackers share a
+    single session, which may be shared with other torrents too.
+
+    Each tier has its own AnnounceScheduler following the interval and min
+    interval of the tracker that last answered it, announce_due only
+    announces to the tiers whose time has come.
+    """
+    # a tracker that doesn't answer in time is skipped for the next of its tier
+    ANNOUNCE_TIMEOUT = 60
+    # UDP retransmissions before giving up, 15 + 30 seconds
+    UDP_RETRIES = 1
+
+    def __init__(
+        self,
+        client: Client,
+        torrent: TorrentFile,
+        status: TorrentStatus,
+        session: aiohttp.ClientSession | None = None,
+        wanted_peers: int = 30
+    ):
+        self._client  = client
+        self._torrent = torrent
+        self._status  = status
+
+        self._tiers = torrent.announce_tiers
+        for tier in self._tiers:
+            random.shuffle(tier)
+
+        self._own_session = session is None
+        self._session = session or aiohttp.ClientSession()
+        self._trackers: Dict[bytes, Tracker | None] = {} # url -> tracker, None if unsupported
+        self._schedulers = [AnnounceScheduler(wanted_peers) for _ in self._tiers]
+
+        # for get_peers callers that announce to every tier at once: of the
+        # trackers that answered the last announce, the shortest interval, the
+        # longest min interval and the biggest swarm seen
+        self.interval = 60
+        self.min_interval: int | None = None
+        self.swarm: Tuple[int, int] | None = None
+
+
+    async def get_peers(self) -> Tuple[List[CompactPeer], int]:
+        peers = []
+        async for new_peers in self.announce():
+            peers.extend(new_peers)
+
+        return peers, self.interval
+
+
+    def next_announce(self, connected: int, seeding: bool) -> float:
+        """ time.monotonic() deadline of the first tier to announce to next """
+        return min(scheduler.next_announce(connected, seeding) for scheduler in self._schedulers)
+
+
+    def needs_scrape(self, connected: int) -> bool:
+        """ If the swarm counts should be refreshed before announcing early """
+        return any(scheduler.needs_scrape(connected) for scheduler in self._schedulers)
+
+
+    async def announce_due(self, connected: int, seeding: bool) -> AsyncIterator[List[CompactPeer]]:
+        """ Announce to the tiers whose time has come, see announce """
+        now = time.monotonic()
+        due = [
+            n for n, scheduler in enumerate(self._schedulers)
+            if scheduler.next_announce(connected, seeding) <= now
+        ]
+        if not due:
+            return
+
+        async for peers in self.announce(due):
+            yield peers
+
+
+    async def announce(self, tiers: List[int] | None = None) -> AsyncIterator[List[CompactPeer]]:
+        """ Announce to the tiers at those indexes (every one by default),
+        yielding the peers we didn't get yet as each tier answers. Raises
+        TrackerException if none did
+        """
+        if tiers is None:
+            tiers = list(range(len(self._tiers)))
+        tasks = [asyncio.create_task(self._announce_tier(n)) for n in tiers]
+
+        seen = set()
+        intervals = []
+        answered: List[Tracker] = []
+        error: TrackerException | None = None
+        try:
+            for next_done in asyncio.as_completed(tasks):
+                try:
+                    tracker, peers, interval = await next_done
+                except TrackerException as e:
+                    error = e
+                    continue
+
+                intervals.append(interval)
+                answered.append(tracker)
+                new_peers = [peer for peer in peers if peer not in seen]
+                seen.update(new_peers)
+                if new_peers:
+                    yield new_peers
+        finally:
+            for task in tasks:
+                task.cancel()
+
+        if not intervals:
+            raise error or TrackerException('No supported tracker')
+
+        self.interval = min(intervals)
+        min_intervals = [t.min_interval for t in answered if t.min_interval is not None]
+        self.min_interval = max(min_intervals) if min_intervals else None
+        self.swarm = _biggest([t.swarm for t in answered])
+
+
+    async def scrape(self) -> Tuple[int, int] | None:
+        """ Scrape the first tracker of every tier, the counts are handed to
+        the scheduler of every tier
+        """
+        trackers = [self._tracker(tier[0]) for tier in self._tiers]
+        results = await asyncio.gather(
+            *(tracker.scrape() for tracker in trackers if tracker is not None),
+            return_exceptions=True
+        )
+
+        swarm = _biggest([r for r in results if isinstance(r, tuple)])
+        for scheduler in self._schedulers:
+            scheduler.scraped(swarm)
+
+        return swarm
+
+
+    async def close(self) -> None:
+        trackers = [tracker for tracker in self._trackers.values() if tracker is not None]
+        await asyncio.gather(*(tracker.close() for tracker in trackers))
+        if self._own_session:
+            await self._session.close()
+
+
+    async def _announce_tier(self, n: int) -> Tuple[Tracker, List[CompactPeer], int]:
+        tier = self._tiers[n]
+        error: TrackerException | None = None
+        for url in list(tier):
+            tracker = self._tracker(url)
+            if tracker is None:
+                continue
+
+            try:
+                peers, interval = await asyncio.wait_for(tracker.get_peers(), self.ANNOUNCE_TIMEOUT)
+            except asyncio.TimeoutError:
+                error = TrackerException(f'Timed out announcing to {url.decode("utf-8", "replace")}')
+                continue
+            except TrackerException as e:
+                error = e
+                continue
+
+            # responsive trackers are tried first next time
+            tier.remove(url)
+            tier.insert(0, url)
+            self._schedulers[n].announced(interval, tracker.min_interval, tracker.swarm)
+            return tracker, peers, interval
+
+        self._schedulers[n].failed()
+        raise error or TrackerException('No supported tracker in tier')
+
+
+    def _tracker(self, url: bytes) -> Tracker | None:
+        """ Tracker for an announce URL, created on first use """
+        if url in self._trackers:
+            return self._trackers[url]
+
+        tracker = None
+        try:
+            if url.startswith(b'http'):
+                tracker = HTTPTracker(
+                    self._client, self._torrent, self._status,
+                    announce=url, session=self._session
+                )
+            elif url.startswith(b'udp'):
+                tracker = UDPTracker(
+                    self._client, self._torrent, self._status,
+                    announce=url, max_retries=self.UDP_RETRIES
+                )
+        except TrackerException as e:
+            print(str(e))
+
+        self._trackers[url] = tracker
+        return tracker
+
+
+def _biggest(swarms: List[Tuple[int, int] | None]) -> Tuple[int, int] | None:
+    """ Trackers of a torrent mostly know the same peers, the biggest counts are
+    the closest to the real swarm
+    """
+    swarms = [swarm for swarm in swarms if swarm is not None]
+    if not swarms:
+        return None
+
+    return max(s[0] for s in swarms), max(s[1] for s in swarms)
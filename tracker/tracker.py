@@ -9,8 +9,16 @@ class PeerAddr:
     port: int
 
 
+# a peer as trackers send it, its packed IP (4 or 16 bytes) and port
+CompactPeer = bytes
+
+
 class Tracker(Protocol):
-    async def get_peers(self) -> Tuple[List[PeerAddr], int]:
+    # set by get_peers when the tracker tells, None otherwise
+    min_interval: int | None = None
+    swarm: Tuple[int, int] | None = None # seeders, leechers
+
+    async def get_peers(self) -> Tuple[List[CompactPeer], int]:
         """ This is a function that will be called periodically to retrieve peers
 
         It will also return the Interval time it is expected for a client to wait 
@@ -18,6 +26,10 @@ class Tracker(Protocol):
          """
         raise NotImplementedError
     
+    async def scrape(self) -> Tuple[int, int] | None:
+        """ Number of seeders and leechers, None if the tracker can't tell """
+        return None
+
     async def close(self) -> None:
         """ Perform all logic to end communication with Tracker """
         raise NotImplementedError
@@ -0,0 +1 @@
+from .udp_tracker import UDPTracker
\ No newline at end of file
@@ -0,0 +1,198 @@
+from typing import Dict, List, Tuple
+
+import time
+import socket
+import struct
+import asyncio
+import unittest
+
+from types import SimpleNamespace
+
+from client import Client
+
+from .udp_tracker import UDPTracker, Action, Event
+from .udp_tracker_exceptions import DeadTrackerException, RequestRejectedException
+
+
+class LoopbackUDPTracker(asyncio.DatagramProtocol):
+    """ Stand-in BEP 15 tracker on loopback
+
+    Hands out connection ids valid for id_ttl seconds and answers announces
+    with the peers it was given. It can drop the next datagrams it gets or
+    answer every request with an error.
+    """
+    def __init__(self, peers: bytes = b'', interval: int = 1800, id_ttl: float = 120):
+        self.peers = peers
+        self.interval = interval
+        self.id_ttl = id_ttl
+
+        self.drop = 0 # datagrams to ignore before answering again
+        self.error: str | None = None # answer everything with this error
+
+        self.received = 0
+        self.connects = 0
+        self.events: List[int] = [] # event of every announce answered
+
+        self._ids: Dict[int, float] = {} # connection id -> when it was handed out
+        self._transport: asyncio.DatagramTransport | None = None
+
+
+    async def start(self) -> int:
+        """ Start listening, returns the port """
+        loop = asyncio.get_running_loop()
+        self._transport, _ = await loop.create_datagram_endpoint(
+            lambda: self, local_addr=('127.0.0.1', 0)
+        )
+        return self._transport.get_extra_info('sockname')[1]
+
+
+    def close(self):
+        self._transport.close()
+
+
+    def datagram_received(self, data: bytes, addr: Tuple[str, int]):
+        self.received += 1
+        if self.drop:
+            self.drop -= 1
+            return
+
+        if len(data) < 16:
+            return
+
+        connection_id, action, tid = struct.unpack_from('>QII', data)
+        if self.error is not None:
+            self._reply(struct.pack('>II', Action.ERROR, tid) + self.error.encode(), addr)
+
+        elif action == Action.CONNECT and connection_id == UDPTracker.PROTOCOL_ID:
+            self.connects += 1
+            connection_id = self.connects
+            self._ids[connection_id] = time.monotonic()
+            self._reply(struct.pack('>IIQ', Action.CONNECT, tid, connection_id), addr)
+
+        elif action == Action.ANNOUNCE and len(data) >= 98:
+            given_at = self._ids.get(connection_id)
+            if given_at is None or time.monotonic() - given_at > self.id_ttl:
+                self._reply(struct.pack('>II', Action.ERROR, tid) + b'Connection ID expired', addr)
+                return
+
+            event, = struct.unpack_from('>I', data, 80)
+            self.events.append(event)
+            self._reply(
+                struct.pack('>IIIII', Action.ANNOUNCE, tid, self.interval, 1, 2) + self.peers, addr
+            )
+
+
+    def _reply(self, data: bytes, addr: Tuple[str, int]):
+        self._transport.sendto(data, addr)
+
+
+class TorrentStandIn(dict):
+    """ The parts of a TorrentFile a tracker uses """
+    def __init__(self, announce: bytes):
+        super().__init__(announce=announce)
+        self.info_hash = bytes(range(20))
+
+
+PEERS = bytes([10, 0, 0, 1]) + (6881).to_bytes(2, 'big') + bytes([10, 0, 0, 2]) + (6882).to_bytes(2, 'big')
+
+
+class UDPTrackerTest(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.server = LoopbackUDPTracker(PEERS, interval=900)
+        self.port = await self.server.start()
+        self.trackers: List[UDPTracker] = []
+
+
+    async def asyncTearDown(self):
+        for tracker in self.trackers:
+            await tracker.close()
+        self.server.close()
+
+
+    def tracker(self, port: int | None = None, **kwargs) -> UDPTracker:
+        tracker = UDPTracker(
+            Client(6881),
+            TorrentStandIn(f'udp://127.0.0.1:{port or self.port}/announce'.encode()),
+            SimpleNamespace(downloaded=0, left=1000, uploaded=0),
+            **kwargs
+        )
+        self.trackers.append(tracker)
+        return tracker
+
+
+    async def test_announce(self):
+        tracker = self.tracker()
+
+        peers, interval = await tracker.get_peers()
+        self.assertEqual(peers, [PEERS[:6], PEERS[6:]])
+        self.assertEqual(interval, 900)
+        self.assertEqual(tracker.swarm, (2, 1))
+
+        await tracker.get_peers()
+        self.assertEqual(self.server.events, [Event.STARTED, Event.NONE])
+        self.assertEqual(self.server.connects, 1)
+
+
+    async def test_dropped_packets_are_retransmitted(self):
+        tracker = self.tracker(timeout=0.05, max_retries=3)
+        # the connect request and its first retransmission
+        self.server.drop = 2
+
+        peers, _ = await tracker.get_peers()
+        self.assertEqual(len(peers), 2)
+        self.assertEqual(self.server.received, 4)
+        self.assertEqual(self.server.connects, 1)
+
+
+    async def test_gives_up_when_nothing_answers(self):
+        tracker = self.tracker(timeout=0.05, max_retries=2)
+        self.server.drop = 100
+
+        with self.assertRaises(DeadTrackerException):
+            await tracker.get_peers()
+        self.assertEqual(self.server.received, 3)
+
+
+    async def test_expired_connection_id_is_renewed(self):
+        tracker = self.tracker()
+        tracker.CONNECTION_ID_TTL = 0.1
+        self.server.id_ttl = 0.2
+
+        await tracker.get_peers()
+        await asyncio.sleep(0.15)
+        await tracker.get_peers()
+
+        self.assertEqual(self.server.connects, 2)
+        self.assertEqual(len(self.server.events), 2)
+
+
+    async def test_error_reply(self):
+        tracker = self.tracker()
+        self.server.error = 'torrent not registered'
+
+        with self.assertRaisesRegex(RequestRejectedException, 'torrent not registered'):
+            await tracker.get_peers()
+
+
+    async def test_unreachable_port(self):
+        # a port nothing listens on, the kernel answers with ICMP unreachable
+        with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+            sock.bind(('127.0.0.1', 0))
+            port = sock.getsockname()[1]
+
+        tracker = self.tracker(port, timeout=5, max_retries=0)
+        started = time.monotonic()
+        with self.assertRaises(DeadTrackerException):
+            await tracker.get_peers()
+        self.assertLess(time.monotonic() - started, 5)
+
+
+    async def test_scrape_error_is_no_counts(self):
+        tracker = self.tracker(timeout=0.05)
+        self.server.error = 'scrape not supported'
+
+        self.assertIsNone(await tracker.scrape())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,266 @@
+from typing import Callable, Dict, List, Tuple
+
+import time
+import random
+import struct
+import asyncio
+
+from urllib.parse import urlparse
+
+from client import Client
+
+from tracker import (
+    Tracker,
+    CompactPeer,
+    compact_peers
+)
+from tracker.compact import IPV4_PEER_SIZE, IPV6_PEER_SIZE
+
+from torrent_manager import TorrentStatus
+from torrent import TorrentFile
+
+from .udp_tracker_exceptions import (
+    UDPTrackerException,
+    DeadTrackerException,
+    RequestRejectedException,
+    BadResponseException
+)
+
+
+class Action:
+    CONNECT = 0
+    ANNOUNCE = 1
+    SCRAPE = 2
+    ERROR = 3
+
+
+class Event:
+    NONE = 0
+    COMPLETED = 1
+    STARTED = 2
+    STOPPED = 3
+
+
+class UDPTracker(Tracker):
+    """ UDP tracker client (BEP 15)
+
+    announce defaults to the torrent announce URL. A request that isn't 
+    answered is sent again after 15 * 2 ^ n seconds, n going up to 8 (or 
+    max_retries). The connection id the tracker hands out is reused for a
+    minute, after that a new one is requested before announcing.
+    """
+    PROTOCOL_ID = 0x41727101980
+    CONNECTION_ID_TTL = 60
+    TIMEOUT = 15
+    MAX_RETRIES = 8
+
+    def __init__(
+        self,
+        client: Client,
+        torrent: TorrentFile,
+        status: TorrentStatus,
+        announce: bytes | None = None,
+        timeout: float = TIMEOUT,
+        max_retries: int = MAX_RETRIES
+    ):
+        self._client         = client
+        self._torrent        = torrent
+        self._status         = status
+        self._event_state    = Event.STARTED
+        self._timeout        = timeout
+        self._max_retries    = max_retries
+
+        url = urlparse((announce or torrent['announce']).decode('utf-8'))
+        if url.hostname is None or url.port is None:
+            raise UDPTrackerException(f'Invalid UDP tracker {url.geturl()}')
+        self._addr = (url.hostname, url.port)
+
+        # identifies us across announces even if our IP changes
+        self._key = random.getrandbits(32)
+
+        self._transport: asyncio.DatagramTransport | None = None
+        self._protocol: UDPTrackerProtocol | None = None
+        self._connection_id: int | None = None
+        self._connected_at = 0.0
+
+
+    async def get_peers(self) -> Tuple[List[CompactPeer], int]:
+        event = self._event_state
+        response = await self._transact(
+            lambda tid: self._announce_request(tid, event), Action.ANNOUNCE, self._max_retries
+        )
+        self._event_state = Event.NONE
+
+        if len(response) < 20:
+            raise BadResponseException('Announce response too short')
+
+        interval, leechers, seeders = struct.unpack_from('>III', response, 8)
+        self.swarm = (seeders, leechers)
+
+        # trackers reached over IPv6 answer with IPv6 peers
+        ipv6 = len(self._transport.get_extra_info('peername')) == 4
+        return compact_peers(response[20:], IPV6_PEER_SIZE if ipv6 else IPV4_PEER_SIZE), interval
+
+
+    async def scrape(self) -> Tuple[int, int] | None:
+        """ Seeders and leechers, a single attempt as it is only a hint """
+        try:
+            response = await self._transact(
+                lambda tid: struct.pack(
+                    '>QII20s', self._connection_id, Action.SCRAPE, tid, self._torrent.info_hash
+                ),
+                Action.SCRAPE,
+                0
+            )
+        except UDPTrackerException:
+            return None
+
+        if len(response) < 20:
+            return None
+
+        seeders, _, leechers = struct.unpack_from('>III', response, 8)
+        return seeders, leechers
+
+
+    async def close(self) -> None:
+        if self._transport is None:
+            return
+
+        # nobody waits for the answer, only worth it with a valid connection id
+        # and if we announced at all
+        if self._has_connection_id() and self._event_state != Event.STARTED:
+            try:
+                tid = random.getrandbits(32)
+                self._transport.sendto(self._announce_request(tid, Event.STOPPED))
+            except OSError:
+                pass
+
+        self._transport.close()
+        self._transport = None
+
+
+    async def _transact(self, build: Callable[[int], bytes], action: int, retries: int) -> bytes:
+        """ Send the request build makes for a transaction id, retransmitting and
+        reconnecting as needed
+        """
+        await self._open()
+
+        for n in range(retries + 1):
+            timeout = self._timeout * 2 ** n
+            try:
+                if not self._has_connection_id():
+                    await self._connect(timeout)
+
+                tid = random.getrandbits(32)
+                return await self._request(tid, build(tid), action, timeout)
+            except asyncio.TimeoutError:
+                continue
+
+        raise DeadTrackerException(f'No answer from tracker {self._addr[0]}:{self._addr[1]}')
+
+
+    async def _connect(self, timeout: float):
+        tid = random.getrandbits(32)
+        request = struct.pack('>QII', self.PROTOCOL_ID, Action.CONNECT, tid)
+
+        response = await self._request(tid, request, Action.CONNECT, timeout)
+        if len(response) < 16:
+            raise BadResponseException('Connect response too short')
+
+        self._connection_id, = struct.unpack_from('>Q', response, 8)
+        self._connected_at = time.monotonic()
+
+
+    async def _request(self, tid: int, request: bytes, action: int, timeout: float) -> bytes:
+        """ Send a request and wait for the response with the same transaction id """
+        fut = self._protocol.expect(tid)
+        try:
+            self._transport.sendto(request)
+            response = await asyncio.wait_for(fut, timeout)
+        except asyncio.TimeoutError:
+            # an OSError as well, retransmitted by the caller
+            raise
+        except OSError as e:
+            raise DeadTrackerException(f'Tracker {self._addr[0]}:{self._addr[1]} unreachable {e!r}')
+        finally:
+            self._protocol.forget(tid)
+
+        response_action, = struct.unpack_from('>I', response)
+        if response_action == Action.ERROR:
+            raise RequestRejectedException(response[8:].decode('utf-8', 'replace'))
+        if response_action != action:
+            raise BadResponseException(f'Unexpected action {response_action} in response')
+
+        return response
+
+
+    async def _open(self):
+        if self._transport is not None:
+            return
+
+        loop = asyncio.get_running_loop()
+        try:
+            self._transport, self._protocol = await loop.create_datagram_endpoint(
+                UDPTrackerProtocol, remote_addr=self._addr
+            )
+        except OSError as e:
+            raise DeadTrackerException(f'Failed resolving tracker {self._addr[0]} {e!r}')
+
+
+    def _has_connection_id(self) -> bool:
+        if self._connection_id is None:
+            return False
+
+        return time.monotonic() - self._connected_at < self.CONNECTION_ID_TTL
+
+
+    def _announce_request(self, tid: int, event: int) -> bytes:
+        return struct.pack(
+            '>QII20s20sQQQIIIiH',
+            self._connection_id,
+            Action.ANNOUNCE,
+            tid,
+            self._torrent.info_hash,
+            self._client.id.encode(),
+            self._status.downloaded,
+            self._status.left,
+            self._status.uploaded,
+            event,
+            0, # our IP, the tracker sees it
+            self._key,
+            -1, # as many peers as the tracker wants to give
+            self._client.port
+        )
+
+
+class UDPTrackerProtocol(asyncio.DatagramProtocol):
+    """ Hands responses to the request waiting on their transaction id """
+    def __init__(self):
+        self._waiters: Dict[int, asyncio.Future] = {}
+
+
+    def expect(self, tid: int) -> asyncio.Future:
+        fut = asyncio.get_running_loop().create_future()
+        self._waiters[tid] = fut
+        return fut
+
+
+    def forget(self, tid: int):
+        self._waiters.pop(tid, None)
+
+
+    def datagram_received(self, data: bytes, addr: Tuple[str, int]):
+        if len(data) < 8:
+            return
+
+        _, tid = struct.unpack_from('>II', data)
+        fut = self._waiters.get(tid)
+        if fut is not None and not fut.done():
+            fut.set_result(data)
+
+
+    def error_received(self, exc: Exception):
+        # ICMP errors, the tracker isn't listening
+        for fut in self._waiters.values():
+            if not fut.done():
+                fut.set_exception(exc)
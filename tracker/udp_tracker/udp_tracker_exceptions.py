@@ -0,0 +1,13 @@
+from tracker import TrackerException
+
+class UDPTrackerException(TrackerException):
+    """ Exception raised from UDPTracker """
+
+class DeadTrackerException(UDPTrackerException):
+    """ Tracker can't be reached, it didn't answer after every retransmission """
+
+class RequestRejectedException(UDPTrackerException):
+    """ Tracker answered with an error message """
+
+class BadResponseException(UDPTrackerException):
+    """ Exception used when we don't understand a tracker's response """